@@ -0,0 +1,441 @@
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import quote
+from uuid import uuid4
+from xml.etree import ElementTree
+
+from floorist import tracing
+from floorist.config import DEFAULT_DATABASE, DatabaseConfig
+from floorist.conversion import JSON_OBJECT, TypeConversion
+from floorist.floorist import (
+    _THROTTLING_S3_ERROR_CODES,
+    ParquetOptions,
+    RetryResult,
+    S3Client,
+    S3RetryPolicy,
+    _s3_error_code,
+    _sqlstate,
+)
+from floorist.history import DumpStats
+from floorist.layout import LAYOUT_OBJECT, cleanup_shards, layout_manifest, sharded_name, write_layout
+from floorist.lazy import lazy_import
+from floorist.spill import PARQUET_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+aiohttp = lazy_import("aiohttp")
+asyncpg = lazy_import("asyncpg")
+boto3 = lazy_import("boto3")
+botocore = lazy_import("botocore")
+pd = lazy_import("pandas")
+yarl = lazy_import("yarl")
+
+# Region the requests are signed for when none is configured, the same default as of boto3
+DEFAULT_REGION = "us-east-1"
+
+
+class AsyncDatabase:
+    """
+    Pool of asyncpg connections to a single database target, opened on the first dump using it.
+
+    At most ``max_connections`` dumps run a query on the target at once, the other ones wait for a connection.
+    The rows are decoded from the binary protocol by asyncpg, except for UUIDs and NUMERIC values, which are
+    fetched as strings and decoded by the type conversion, the same as by the threads engine. The JSON documents
+    are parsed into objects, as by psycopg2, unless the type conversion decodes them.
+    """
+
+    def __init__(self, config: DatabaseConfig, conversion=None):
+        self.config = config
+        self.conversion = TypeConversion() if conversion is None else conversion
+        self._pool = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def dsn(self):
+        return f"postgresql://{self.config.username}:{self.config.password}@{self.config.hostname}/{self.config.name}"
+
+    async def verify(self):
+        # Fails if the database is not reachable or the credentials are invalid. A single connection instead of the
+        # pool, which is bound to the event loop it was created on
+        conn = await asyncpg.connect(self.dsn)
+        await conn.close()
+
+    async def pool(self):
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await asyncpg.create_pool(
+                    self.dsn,
+                    min_size=0,
+                    max_size=self.config.max_connections,
+                    init=self._init_connection,
+                )
+
+            return self._pool
+
+    async def _init_connection(self, conn):
+        await conn.set_type_codec("uuid", encoder=str, decoder=str, schema="pg_catalog", format="text")
+        await conn.set_type_codec("numeric", encoder=str, decoder=str, schema="pg_catalog", format="text")
+        if self.conversion.json_type == JSON_OBJECT:
+            # asyncpg returns the documents as strings, psycopg2 parses them into objects
+            for name in ("json", "jsonb"):
+                await conn.set_type_codec(name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+    async def fetch(self, query, chunksize, write):
+        """
+        Run the query in a transaction, awaiting ``write`` with every chunk of the result as a DataFrame.
+
+        An empty result is passed as a single empty chunk with the columns of the query. The transaction is rolled
+        back if fetching or writing any of the chunks fails.
+        """
+        pool = await self.pool()
+        async with pool.acquire() as conn, conn.transaction():
+            statement = await conn.prepare(query)
+            attributes = statement.get_attributes()
+            columns = [attribute.name for attribute in attributes]
+            # Only the type of the columns is known, like in a DB-API description without the precision and scale,
+            # so the NUMERIC columns are kept as strings instead of decimals
+            converters = self.conversion.converters(
+                [(attribute.name, attribute.type.oid, None, None, None, None, None) for attribute in attributes]
+            )
+            if chunksize is None:
+                await write(self._data_frame(await statement.fetch(), columns, converters))
+                return
+
+            cursor = await statement.cursor()
+            fetched = False
+            while records := await cursor.fetch(chunksize):
+                fetched = True
+                await write(self._data_frame(records, columns, converters))
+            if not fetched:
+                await write(self._data_frame([], columns, converters))
+
+    def _data_frame(self, records, columns, converters):
+        return self.conversion.frame([tuple(record) for record in records], columns, converters)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+
+
+class AsyncAdaptiveLimiter:
+    """
+    Limits the number of concurrent S3 requests of the coroutines, adapting the limit to throttling.
+
+    The same as the ``AdaptiveLimiter`` of the threads engine: the limit is halved every time S3 asks to slow down
+    and raised back by one after about as many successful requests as the current limit, up to the maximum.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self._active = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < int(self.limit))
+            self._active += 1
+
+        return self
+
+    async def __aexit__(self, *args):
+        async with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    async def throttled(self):
+        async with self._condition:
+            self.limit = max(1.0, self.limit / 2)
+            logger.warning("S3 is throttling the requests, reduced the upload concurrency to %d", int(self.limit))
+
+    async def succeeded(self):
+        async with self._condition:
+            if self.limit < self.maximum:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+                self._condition.notify_all()
+
+
+class AsyncS3Client:
+    """
+    Writes the objects into the bucket of an S3 sink through aiohttp, without a thread per request.
+
+    The requests are signed by botocore with the credentials of the bucket and use path style addressing, which
+    works with both AWS and minio. Every request is retried on its own with the same policy as the requests of
+    the threads engine. At most ``upload_concurrency`` requests are sent at once, fewer while S3 is throttling.
+    """
+
+    def __init__(self, sink: S3Client, config):
+        self.sink = sink
+        self.endpoint = config.bucket_url.rstrip("/")
+        session = boto3.session.Session(
+            aws_access_key_id=config.bucket_access_key,
+            aws_secret_access_key=config.bucket_secret_key,
+            region_name=config.bucket_region,
+        )
+        self.credentials = session.get_credentials()
+        self.region = session.region_name or DEFAULT_REGION
+        self.retry_policy = S3RetryPolicy()
+        self.limiter = AsyncAdaptiveLimiter(config.upload_concurrency)
+        self._session = None
+
+    async def put_object(self, path, body):
+        bucket, key = self.sink._split_path(path)
+        url = f"{self.endpoint}/{bucket}/{quote(key, safe='/~')}"
+        with tracing.span("upload", **{"object.key": path}, bytes=len(body)) as span:
+            await self._put_retrying(path, url, body, span)
+
+    async def _put_retrying(self, path, url, body, span):
+        for attempt in range(self.retry_policy.max_retries):
+            try:
+                async with self.limiter:
+                    result = await self._put(url, body)
+                await self.limiter.succeeded()
+                return result
+            except Exception as ex:
+                if self.retry_policy.evaluate(ex, attempt) != RetryResult.RETRY:
+                    raise
+
+                if _s3_error_code(ex) in _THROTTLING_S3_ERROR_CODES:
+                    await self.limiter.throttled()
+                backoff_time = self.retry_policy.backoff_delay(attempt)
+                span.add("retries")
+                span.set(**{"retry.cause": _s3_error_code(ex) or type(ex).__name__})
+                logger.warning(
+                    "Retrying %s in %.1f seconds due to: %s",
+                    path,
+                    backoff_time,
+                    _s3_error_code(ex) or type(ex).__name__,
+                )
+                await asyncio.sleep(backoff_time)
+
+    async def _put(self, url, body):
+        request = botocore.awsrequest.AWSRequest(method="PUT", url=url, data=body)
+        if self.credentials is not None:
+            botocore.auth.S3SigV4Auth(self.credentials, "s3", self.region).add_auth(request)
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        try:
+            async with self._session.put(
+                yarl.URL(url, encoded=True), data=body, headers=dict(request.headers.items())
+            ) as response:
+                content = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+            # Retried the same as the network errors of boto3
+            raise botocore.exceptions.HTTPClientError(error=ex) from ex
+
+        if response.status >= 300:
+            raise botocore.exceptions.ClientError(_error_response(response.status, content), "PutObject")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def _error_response(status, content):
+    error = {}
+    try:
+        document = ElementTree.fromstring(content)
+        error = {child.tag: child.text for child in document if child.tag in ("Code", "Message")}
+    except ElementTree.ParseError:
+        # Some errors (e.g. of proxies in front of the bucket) have no XML body, the status code is the error then
+        pass
+
+    return {"Error": error, "ResponseMetadata": {"HTTPStatusCode": status}}
+
+
+class AsyncDumpExecutor:
+    """
+    Runs the dumps as coroutines on a single event loop.
+
+    Each dump fetches its chunks through asyncpg and writes them through the async S3 client, encoding the parquet
+    files in a worker thread. Other sinks are written in worker threads. A dump failing on a transient database
+    error is retried as a whole with the same policy, and logged the same way, as by the threads engine.
+    """
+
+    def __init__(self, config, sink, retry_policy):
+        self.config = config
+        self.sink = sink
+        self.retry_policy = retry_policy
+        self.s3 = AsyncS3Client(sink, config) if isinstance(sink, S3Client) else None
+        self._databases = {}
+
+    def _database(self, row):
+        # Raises a KeyError for undefined targets, same as any other invalid floorplan row
+        # The same as DatabaseTargets, rows without a target and the ones naming the default share its pool
+        name = row.get("database") or DEFAULT_DATABASE
+        if name not in self._databases:
+            self._databases[name] = AsyncDatabase(self.config.database(name), TypeConversion.from_config(self.config))
+
+        return self._databases[name]
+
+    async def execute(self, row, dump_count, stats=None) -> bool:
+        stats = DumpStats(measure_bytes=tracing.enabled()) if stats is None else stats
+        started = time.monotonic()
+        prefix = row.get("prefix") if isinstance(row, dict) else None
+        with tracing.span("dump", dump=dump_count, prefix=prefix) as span:
+            try:
+                stats.succeeded = await self._execute(row, dump_count, stats)
+            finally:
+                stats.duration = time.monotonic() - started
+            span.set(
+                succeeded=stats.succeeded,
+                rows=stats.rows,
+                bytes=stats.bytes,
+                objects=stats.objects,
+                retries=stats.retries,
+            )
+
+        return stats.succeeded
+
+    async def _execute(self, row, dump_count, stats):
+        try:
+            database = self._database(row)
+            path, target = self.sink.make_path(row["prefix"])
+            options = ParquetOptions.from_row(row)
+            if options.partition_by:
+                raise ValueError("partition_by is not supported by the asyncio engine")
+            query = options.sort_query(row["query"])
+            chunksize = row.get("chunksize", 1000) or None
+        except (AttributeError, KeyError, TypeError, ValueError):
+            logger.exception("[Dump #%d] invalid config row: %r", dump_count, row)
+            return False
+
+        stats.prefix = row["prefix"]
+
+        for attempt in range(self.retry_policy.max_retries):
+            with tracing.span("attempt", attempt=attempt + 1) as span:
+                try:
+                    if attempt > 0:
+                        logger.info(
+                            "[Dump #%d] Retry %d of %d (attempt %d total)",
+                            dump_count,
+                            attempt,
+                            self.retry_policy.max_retries - 1,
+                            attempt + 1,
+                        )
+                        try:
+                            await asyncio.to_thread(self.sink.cleanup, target, cleanup_shards(options))
+                        except Exception:
+                            logger.exception("[Dump #%d] S3 cleanup failed, cannot retry", dump_count)
+                            return False
+                        stats.retries = attempt
+                        stats.reset()
+
+                    with tracing.span("query", **{"db.statement": query}) as query_span:
+                        await self._write_chunks(database, path, target, query, chunksize, dump_count, options, stats)
+                        query_span.set(rows=stats.rows, bytes=stats.bytes)
+                    return True
+
+                except (asyncpg.PostgresError, asyncpg.InterfaceError) as ex:
+                    # The transaction is rolled back when the error leaves it
+                    logger.warning("[Dump #%d] Database error, rolling back", dump_count)
+
+                    retry_result = self.retry_policy.evaluate(ex, attempt)
+
+                    span.fail(ex)
+                    if retry_result == RetryResult.FAILURE:
+                        logger.exception("[Dump #%d] Non-retryable database error", dump_count)
+                        break
+
+                    if retry_result == RetryResult.EXHAUSTED:
+                        logger.exception("[Dump #%d] Retries exhausted", dump_count)
+                        break
+
+                    backoff_time = self.retry_policy.backoff_delay(attempt)
+                    span.set(**{"retry.cause": _sqlstate(ex) or type(ex).__name__})
+                    logger.warning(
+                        "[Dump #%d] Retrying in %d seconds due to: %s",
+                        dump_count,
+                        backoff_time,
+                        str(ex).split("\n")[0],
+                    )
+                    await asyncio.sleep(backoff_time)
+                    continue
+
+                except Exception as ex:
+                    span.fail(ex)
+                    logger.exception("[Dump #%d] Unexpected error", dump_count)
+                    break
+
+        return False  # Dump failed
+
+    async def _write_chunks(self, database, path, target, query, chunksize, dump_count, options, stats):
+        logger.debug("[Dump #%d] Query: %s", dump_count, query)
+        if options.key_shards:
+            await self._write_layout(path, options)
+        chunk = 1
+
+        async def write(data):
+            nonlocal chunk
+            stats.add(data)
+            data = options.sort_chunk(data)
+            await self._write_parquet(data, target, path, options)
+            if len(data) > 0:
+                logger.info("[Dump #%d] Written parquet chunk #%d", dump_count, chunk)
+                chunk += 1
+            else:
+                logger.info("[Dump #%d] Empty folder created for empty result", dump_count)
+
+        await database.fetch(query, chunksize, write)
+
+        stats.objects = chunk - 1
+        logger.debug("[Dump #%d] Dumped %s to %s", dump_count, query, path)
+
+    async def _write_parquet(self, data, target, path, options):
+        if self.s3 is None:
+            await asyncio.to_thread(self.sink.write_parquet, data, target, path, options)
+        elif len(data) > 0:
+            # Encoding is CPU bound, pyarrow releases the GIL while the loop keeps running the other dumps
+            body = await asyncio.to_thread(self.sink.encode, data, options)
+            name = sharded_name(f"{uuid4().hex}{PARQUET_EXTENSION}", options)
+            await self.s3.put_object(f"{path}/{name}", body.to_pybytes())
+        else:
+            await self.s3.put_object(f"{path.rstrip('/')}/", b"")
+
+    async def _write_layout(self, path, options):
+        if self.s3 is None:
+            await asyncio.to_thread(write_layout, self.sink, path, options)
+        else:
+            await self.s3.put_object(f"{path}/{LAYOUT_OBJECT}", layout_manifest(options).encode())
+
+    async def close(self):
+        for database in self._databases.values():
+            await database.close()
+        if self.s3 is not None:
+            await self.s3.close()
+
+
+def verify_database(config: DatabaseConfig):
+    """Connect to the database through asyncpg on an event loop of its own, failing if it is not usable."""
+    asyncio.run(AsyncDatabase(config).verify())
+
+
+def run_dumps(config, sink, retry_policy, dumps, stats, completed=None):
+    """
+    Run the dumps on a new event loop, ``config.concurrency`` at once. Returns whether each of them succeeded.
+
+    ``completed`` is called in a worker thread with the number and the row of every dump that succeeded.
+    """
+    return asyncio.run(_run_dumps(config, sink, retry_policy, dumps, stats, completed))
+
+
+async def _run_dumps(config, sink, retry_policy, dumps, stats, completed):
+    executor = AsyncDumpExecutor(config, sink, retry_policy)
+    slots = asyncio.Semaphore(config.concurrency)
+
+    async def execute(row, dump_count):
+        async with slots:
+            succeeded = await executor.execute(row, dump_count, stats[dump_count])
+        if succeeded and completed is not None:
+            await asyncio.to_thread(completed, dump_count, row)
+
+        return succeeded
+
+    try:
+        return await asyncio.gather(*(execute(row, count) for count, row in dumps))
+    finally:
+        await executor.close()
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import logging
+import threading
+from datetime import date, datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Length of the hex digest of the floorplan in the name of the checkpoint
+DIGEST_LENGTH = 16
+
+
+class RunCheckpoint:
+    """
+    Dumps completed by the attempts of a run, stored as a single JSON object in the bucket.
+
+    The object is named after the day of the run and a hash of the floorplan, so a job restarted on the same day
+    with the same floorplan finds it, while the next day or a changed floorplan starts from scratch. It is written
+    when the run starts, so a restart is recognized even if no dump completed, and again after every completed dump.
+    """
+
+    def __init__(self, sink, prefix, shard=None):
+        self.sink = sink
+        self.prefix = prefix.strip("/")
+        self.shard = shard
+        self.path = None
+        self.restarted = False
+        self.completed = {}
+        self._lock = threading.Lock()
+
+    def start(self, floorplan, day=None):
+        """Load the checkpoint of the floorplan (its fingerprint, see load_floorplan) for the day, or create it."""
+        digest = hashlib.sha256(floorplan).hexdigest()[:DIGEST_LENGTH]
+        # The local date is intentional, the same as for the folders of the dumps
+        name = f"{(day or date.today()).isoformat()}-{digest}"
+        if self.shard is not None:
+            name = f"{name}-{self.shard}"
+        self.path = f"{self.prefix}/{name}.json"
+
+        body = self.sink.read_object(self.path)
+        if body is not None:
+            try:
+                self.completed = json.loads(body)["completed"]
+                self.restarted = True
+            except (KeyError, TypeError, ValueError):
+                logger.warning("Ignoring the invalid checkpoint in %s", self.path)
+
+        with self._lock:
+            self._write()
+
+    def resume(self, dumps):
+        """
+        Split the dumps into the ones to run and the ones completed by a previous attempt.
+
+        A completed dump is run again if it shares its prefix with a dump that did not complete, as the partial
+        output of the latter cannot be removed without removing the output of the former.
+        """
+        if not self.restarted:
+            return dumps, []
+
+        incomplete = {_prefix(row) for count, row in dumps if str(count) not in self.completed}
+        skipped = [
+            (count, row) for count, row in dumps if str(count) in self.completed and _prefix(row) not in incomplete
+        ]
+        return [dump for dump in dumps if dump not in skipped], skipped
+
+    def complete(self, dump_count, row):
+        with self._lock:
+            self.completed[str(dump_count)] = {
+                "prefix": _prefix(row),
+                "completed": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+            self._write()
+
+    def _write(self):
+        self.sink.write_object(self.path, json.dumps({"completed": self.completed}, separators=(",", ":")))
+
+
+def _prefix(row):
+    return row.get("prefix") if isinstance(row, dict) else None
@@ -1,13 +1,46 @@
-from os import R_OK, access, environ
-from os.path import isfile
+import re
+from os import R_OK, W_OK, access, environ
+from os.path import isdir, isfile
 from urllib.parse import urlparse
 
 import attr
 from app_common_python import LoadedConfig, isClowderEnabled
 
+from floorist.conversion import JSON_OBJECT, JSON_TYPES, NUMERIC_FLOAT, NUMERIC_TYPES, UUID_STRING, UUID_TYPES
+from floorist.profiling import PROFILE_KINDS
+from floorist.sinks import SINK_LOCAL, SINK_S3, SINKS
+from floorist.throttle import THROTTLE_CHECK_INTERVAL, THROTTLE_MAX_PAUSE
+
+# Name of the database target configured through Clowder or the POSTGRES* environment variables
+DEFAULT_DATABASE = "default"
+
+# Replicas lagging behind the primary by more than this many seconds are not used for dumps
+DEFAULT_MAX_REPLICA_LAG = 300
+
+# Ways of running the dumps: a pool of threads, or a single event loop
+ENGINE_THREADS = "threads"
+ENGINE_ASYNCIO = "asyncio"
+ENGINES = (ENGINE_THREADS, ENGINE_ASYNCIO)
+
+
+@attr.s
+class DatabaseConfig:
+    hostname = attr.ib(default=None)
+    name = attr.ib(default=None)
+    username = attr.ib(default=None)
+    password = attr.ib(default=None)
+    max_connections = attr.ib(default=1)
+    replicas = attr.ib(factory=list)
+    max_replica_lag = attr.ib(default=DEFAULT_MAX_REPLICA_LAG)
+    allow_primary = attr.ib(default=False)
+
 
 @attr.s
 class Config:
+    engine = attr.ib(default=ENGINE_THREADS)
+    sink = attr.ib(default=SINK_S3)
+    sink_directory = attr.ib(default=None)
+    sink_mmap = attr.ib(default=False)
     bucket_url = attr.ib(default=None)
     bucket_name = attr.ib(default=None)
     bucket_secret_key = attr.ib(default=None)
@@ -17,20 +50,77 @@ class Config:
     database_username = attr.ib(default=None)
     database_password = attr.ib(default=None)
     database_name = attr.ib(default=None)
+    database_max_connections = attr.ib(default=1)
+    database_replicas = attr.ib(factory=list)
+    database_max_replica_lag = attr.ib(default=DEFAULT_MAX_REPLICA_LAG)
+    database_allow_primary = attr.ib(default=False)
+    databases = attr.ib(factory=dict)
+    concurrency = attr.ib(default=1)
+    shard_index = attr.ib(default=0)
+    shard_count = attr.ib(default=1)
     floorplan_filename = attr.ib(default=None)
+    spill_directory = attr.ib(default=None)
+    upload_concurrency = attr.ib(default=10)
+    multipart_chunksize = attr.ib(default=8 * 1024 * 1024)
+    encode_workers = attr.ib(default=0)
+    uuid_type = attr.ib(default=UUID_STRING)
+    numeric_type = attr.ib(default=NUMERIC_FLOAT)
+    json_type = attr.ib(default=JSON_OBJECT)
+    history_prefix = attr.ib(default=None)
+    checkpoint_prefix = attr.ib(default=None)
+    max_rows_per_second = attr.ib(default=None)
+    max_bytes_per_second = attr.ib(default=None)
+    run_max_rows_per_second = attr.ib(default=None)
+    run_max_bytes_per_second = attr.ib(default=None)
+    max_replication_lag = attr.ib(default=None)
+    max_active_connections = attr.ib(default=None)
+    throttle_check_interval = attr.ib(default=THROTTLE_CHECK_INTERVAL)
+    throttle_max_pause = attr.ib(default=THROTTLE_MAX_PAUSE)
+    profile = attr.ib(factory=list)
+    profile_directory = attr.ib(default=None)
+    profile_prefix = attr.ib(default=None)
+    trace_file = attr.ib(default=None)
+    trace_endpoint = attr.ib(default=None)
+
+    def database(self, name=None):
+        if name is None or name == DEFAULT_DATABASE:
+            return DatabaseConfig(
+                hostname=self.database_hostname,
+                name=self.database_name,
+                username=self.database_username,
+                password=self.database_password,
+                max_connections=self.database_max_connections,
+                replicas=self.database_replicas,
+                max_replica_lag=self.database_max_replica_lag,
+                allow_primary=self.database_allow_primary,
+            )
+
+        return self.databases[name]
 
 
 def get_config():
     config = Config()
+    _set_sink_config(config)
     _set_bucket_config(config)
     _set_database_config(config)
+    _set_database_targets_config(config)
     _set_floorist_config(config)
     _validate_config(config)
 
     return config
 
 
+def _set_sink_config(config):
+    config.sink = environ.get("FLOORIST_SINK", SINK_S3).strip().lower()
+    config.sink_directory = environ.get("FLOORIST_SINK_DIR") or None
+    config.sink_mmap = _is_enabled(environ.get("FLOORIST_SINK_MMAP", ""))
+
+
 def _set_bucket_config(config):
+    if config.sink != SINK_S3 and not environ.get("AWS_BUCKET"):
+        # Only the S3 sink needs a bucket
+        return
+
     config.bucket_name = get_bucket_requested_name_from_environment()
     config.bucket_url = _get_bucket_url(environ.get("AWS_ENDPOINT"))
     config.bucket_secret_key = environ.get("AWS_SECRET_ACCESS_KEY")
@@ -76,8 +166,78 @@ def _set_database_config_from_environment(config):
     config.database_password = environ.get("POSTGRESQL_PASSWORD")
 
 
+def _set_database_targets_config(config):
+    config.database_max_connections = int(environ.get("FLOORIST_DATABASE_MAX_CONNECTIONS", "1"))
+    config.database_replicas = _split_list(environ.get("FLOORIST_DATABASE_REPLICAS", ""))
+    config.database_max_replica_lag = float(
+        environ.get("FLOORIST_DATABASE_MAX_REPLICA_LAG", str(DEFAULT_MAX_REPLICA_LAG))
+    )
+    config.database_allow_primary = _is_enabled(environ.get("FLOORIST_DATABASE_ALLOW_PRIMARY", ""))
+
+    for name in _split_list(environ.get("FLOORIST_DATABASES", "")):
+        prefix = f"FLOORIST_DATABASE_{re.sub(r'[^A-Z0-9]', '_', name.upper())}_"
+        config.databases[name] = DatabaseConfig(
+            hostname=environ.get(f"{prefix}HOST"),
+            name=environ.get(f"{prefix}NAME"),
+            username=environ.get(f"{prefix}USER"),
+            password=environ.get(f"{prefix}PASSWORD"),
+            max_connections=int(environ.get(f"{prefix}MAX_CONNECTIONS", "1")),
+            replicas=_split_list(environ.get(f"{prefix}REPLICAS", "")),
+            max_replica_lag=float(environ.get(f"{prefix}MAX_REPLICA_LAG", str(DEFAULT_MAX_REPLICA_LAG))),
+            allow_primary=_is_enabled(environ.get(f"{prefix}ALLOW_PRIMARY", "")),
+        )
+
+
+def _split_list(value):
+    return [item for item in (item.strip() for item in value.split(",")) if item]
+
+
+def _is_enabled(value):
+    return value.strip().lower() in ("1", "true", "yes")
+
+
 def _set_floorist_config(config):
     config.floorplan_filename = environ.get("FLOORPLAN_FILE")
+    config.engine = environ.get("FLOORIST_ENGINE", ENGINE_THREADS).strip().lower()
+    config.concurrency = int(environ.get("FLOORIST_CONCURRENCY", config.concurrency))
+    # Kubernetes sets JOB_COMPLETION_INDEX for the pods of Indexed Jobs, the number of shards has to be set explicitly
+    config.shard_index = int(environ.get("FLOORIST_SHARD_INDEX", environ.get("JOB_COMPLETION_INDEX", "0")))
+    config.shard_count = int(environ.get("FLOORIST_SHARD_COUNT", "1"))
+    config.spill_directory = environ.get("FLOORIST_SPILL_DIR") or None
+    config.upload_concurrency = int(environ.get("FLOORIST_UPLOAD_CONCURRENCY", config.upload_concurrency))
+    config.multipart_chunksize = int(environ.get("FLOORIST_MULTIPART_CHUNKSIZE", config.multipart_chunksize))
+    config.encode_workers = int(environ.get("FLOORIST_ENCODE_WORKERS", config.encode_workers))
+    config.uuid_type = environ.get("FLOORIST_UUID_TYPE", UUID_STRING).strip().lower()
+    config.numeric_type = environ.get("FLOORIST_NUMERIC_TYPE", NUMERIC_FLOAT).strip().lower()
+    config.json_type = environ.get("FLOORIST_JSON_TYPE", JSON_OBJECT).strip().lower()
+    config.history_prefix = environ.get("FLOORIST_HISTORY_PREFIX") or None
+    config.checkpoint_prefix = environ.get("FLOORIST_CHECKPOINT_PREFIX") or None
+    _set_throttle_config(config)
+    config.profile = [kind.strip().lower() for kind in environ.get("FLOORIST_PROFILE", "").split(",") if kind.strip()]
+    config.profile_directory = environ.get("FLOORIST_PROFILE_DIR") or None
+    config.profile_prefix = environ.get("FLOORIST_PROFILE_PREFIX") or None
+    config.trace_file = environ.get("FLOORIST_TRACE_FILE") or None
+    # The standard variable of the OpenTelemetry SDKs is honored as well
+    config.trace_endpoint = (
+        environ.get("FLOORIST_TRACE_ENDPOINT") or environ.get("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT") or None
+    )
+
+
+def _set_throttle_config(config):
+    config.max_rows_per_second = _optional_number(environ.get("FLOORIST_MAX_ROWS_PER_SECOND"))
+    config.max_bytes_per_second = _optional_number(environ.get("FLOORIST_MAX_BYTES_PER_SECOND"))
+    config.run_max_rows_per_second = _optional_number(environ.get("FLOORIST_RUN_MAX_ROWS_PER_SECOND"))
+    config.run_max_bytes_per_second = _optional_number(environ.get("FLOORIST_RUN_MAX_BYTES_PER_SECOND"))
+    config.max_replication_lag = _optional_number(environ.get("FLOORIST_MAX_REPLICATION_LAG"))
+    config.max_active_connections = _optional_number(environ.get("FLOORIST_MAX_ACTIVE_CONNECTIONS"))
+    config.throttle_check_interval = float(
+        environ.get("FLOORIST_THROTTLE_CHECK_INTERVAL", str(config.throttle_check_interval))
+    )
+    config.throttle_max_pause = float(environ.get("FLOORIST_THROTTLE_MAX_PAUSE", str(config.throttle_max_pause)))
+
+
+def _optional_number(value):
+    return float(value) if value else None
 
 
 def _validate_config(config):
@@ -99,5 +259,136 @@ def _validate_config(config):
     if not config.database_password:
         raise ValueError("Database password not defined")
 
-    if not config.bucket_url:
+    for name, database in config.databases.items():
+        _validate_database_target(name, database)
+
+    if config.database_max_connections < 1:
+        raise ValueError("Database connection limit must be at least 1")
+
+    if config.database_max_replica_lag < 0:
+        raise ValueError("Maximum replica lag must not be negative")
+
+    if config.concurrency < 1:
+        raise ValueError("Concurrency must be at least 1")
+
+    if config.shard_count < 1:
+        raise ValueError("Shard count must be at least 1")
+
+    if not 0 <= config.shard_index < config.shard_count:
+        raise ValueError(f"Shard index must be between 0 and {config.shard_count - 1}")
+
+    if config.sink not in SINKS:
+        raise ValueError(f"Unknown sink '{config.sink}', expected one of: {', '.join(SINKS)}")
+
+    if config.sink == SINK_S3 and not config.bucket_url:
         raise ValueError("Bucket endpoint not defined")
+
+    if config.sink == SINK_LOCAL and (
+        not config.sink_directory or not isdir(config.sink_directory) or not access(config.sink_directory, W_OK)
+    ):
+        raise OSError(f"Sink directory '{config.sink_directory}' does not exist or is not writable")
+
+    if config.spill_directory and (not isdir(config.spill_directory) or not access(config.spill_directory, W_OK)):
+        raise OSError(f"Spill directory '{config.spill_directory}' does not exist or is not writable")
+
+    if config.upload_concurrency < 1:
+        raise ValueError("Upload concurrency must be at least 1")
+
+    if config.encode_workers < 0:
+        raise ValueError("Number of encode workers must not be negative")
+
+    for name in (
+        "max_rows_per_second",
+        "max_bytes_per_second",
+        "run_max_rows_per_second",
+        "run_max_bytes_per_second",
+    ):
+        if getattr(config, name) is not None and getattr(config, name) <= 0:
+            raise ValueError(f"FLOORIST_{name.upper()} must be positive")
+
+    if config.throttle_check_interval <= 0:
+        raise ValueError("Throttle check interval must be positive")
+
+    if config.throttle_max_pause <= 0:
+        raise ValueError("Throttle max pause must be positive")
+
+    _validate_profile_config(config)
+    _validate_engine_config(config)
+    _validate_types_config(config)
+
+
+def _validate_engine_config(config):
+    if config.engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{config.engine}', expected one of: {', '.join(ENGINES)}")
+
+    if config.engine != ENGINE_ASYNCIO:
+        return
+
+    unsupported = {
+        "FLOORIST_SPILL_DIR": config.spill_directory,
+        "FLOORIST_PROFILE": config.profile,
+        "Replicas": config.database_replicas or any(database.replicas for database in config.databases.values()),
+        "Throttling": any(
+            getattr(config, name) is not None
+            for name in (
+                "max_rows_per_second",
+                "max_bytes_per_second",
+                "run_max_rows_per_second",
+                "run_max_bytes_per_second",
+                "max_replication_lag",
+                "max_active_connections",
+            )
+        ),
+    }
+    for name, value in unsupported.items():
+        if value:
+            raise ValueError(f"{name} is not supported by the asyncio engine")
+
+
+def _validate_types_config(config):
+    types = {
+        "FLOORIST_UUID_TYPE": (config.uuid_type, UUID_TYPES),
+        "FLOORIST_NUMERIC_TYPE": (config.numeric_type, NUMERIC_TYPES),
+        "FLOORIST_JSON_TYPE": (config.json_type, JSON_TYPES),
+    }
+    for name, (value, allowed) in types.items():
+        if value not in allowed:
+            raise ValueError(f"Unknown {name} '{value}', expected one of: {', '.join(allowed)}")
+
+
+def _validate_profile_config(config):
+    if not config.profile:
+        return
+
+    for kind in config.profile:
+        if kind not in PROFILE_KINDS:
+            raise ValueError(f"Unknown profile '{kind}', expected one of: {', '.join(PROFILE_KINDS)}")
+
+    if not config.profile_directory and not config.profile_prefix:
+        raise ValueError("Profiling needs FLOORIST_PROFILE_DIR or FLOORIST_PROFILE_PREFIX to write the profiles to")
+
+    if config.profile_directory and (not isdir(config.profile_directory) or not access(config.profile_directory, W_OK)):
+        raise OSError(f"Profile directory '{config.profile_directory}' does not exist or is not writable")
+
+
+def _validate_database_target(name, database):
+    if name == DEFAULT_DATABASE:
+        raise ValueError(f"Database target name '{DEFAULT_DATABASE}' is reserved")
+
+    if not database.hostname:
+        raise ValueError(f"Database host not defined for target '{name}'")
+
+    if not database.name:
+        raise ValueError(f"Database name not defined for target '{name}'")
+
+    if not database.username:
+        raise ValueError(f"Database user not defined for target '{name}'")
+
+    if not database.password:
+        raise ValueError(f"Database password not defined for target '{name}'")
+
+    if database.max_connections < 1:
+        raise ValueError(f"Database connection limit must be at least 1 for target '{name}'")
+
+    if database.max_replica_lag < 0:
+        raise ValueError(f"Maximum replica lag must not be negative for target '{name}'")
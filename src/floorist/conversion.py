@@ -0,0 +1,217 @@
+import json
+import logging
+
+import attr
+
+from floorist.lazy import lazy_import
+
+np = lazy_import("numpy")
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+pd = lazy_import("pandas")
+pa_json = lazy_import("pyarrow.json")
+
+logger = logging.getLogger(__name__)
+
+# Representations of the columns of the converted types in the parquet files
+UUID_STRING = "string"
+UUID_BINARY = "binary"
+UUID_TYPES = (UUID_STRING, UUID_BINARY)
+NUMERIC_FLOAT = "float"
+NUMERIC_DECIMAL = "decimal"
+NUMERIC_TYPES = (NUMERIC_FLOAT, NUMERIC_DECIMAL)
+JSON_OBJECT = "object"
+JSON_STRING = "string"
+JSON_STRUCT = "struct"
+JSON_TYPES = (JSON_OBJECT, JSON_STRING, JSON_STRUCT)
+
+# Stable OIDs of the types, assigned in src/include/catalog/pg_type.dat in the PostgreSQL source.
+# Verify with: SELECT oid, typname FROM pg_type WHERE typname IN ('uuid', 'numeric', 'json', 'jsonb')
+PG_UUID_OID = 2950
+PG_NUMERIC_OID = 1700
+PG_JSON_OID = 114
+PG_JSONB_OID = 3802
+
+# Largest precisions of the Arrow decimal types, NUMERIC columns with more digits are kept as strings
+DECIMAL128_MAX_PRECISION = 38
+DECIMAL256_MAX_PRECISION = 76
+
+# NUMERIC values without a decimal representation
+_NUMERIC_SPECIAL = ("NaN", "Infinity", "-Infinity")
+_NULL_UUID = "00000000-0000-0000-0000-000000000000"
+
+
+@attr.s(frozen=True)
+class TypeConversion:
+    """
+    Decodes the UUID, NUMERIC and JSON columns of the fetched chunks in bulk.
+
+    The driver returns the values of these types as text, which is cheap, instead of building a Python object
+    (``Decimal``, ``dict``) for every single value. The text columns are then decoded by Arrow a whole chunk at a
+    time into the configured representation:
+
+    * UUIDs as strings, or as ``fixed_size_binary(16)``
+    * NUMERIC as ``float64`` (the same as pandas coerces the ``Decimal`` values to), or as ``decimal128`` (or
+      ``decimal256`` over 38 digits) with the precision and scale of the column. Columns without them, or with too
+      many digits, are kept as strings, so every chunk of a dump has the same type
+    * JSON and JSONB parsed by the driver into objects, as ``large_string`` with the documents as they are, or as
+      structs (lists, scalars) parsed by the Arrow JSON reader. The type is inferred from the first chunk and the
+      later chunks are parsed into it, a dump whose documents do not fit it fails
+    """
+
+    uuid_type = attr.ib(default=UUID_STRING)
+    numeric_type = attr.ib(default=NUMERIC_FLOAT)
+    json_type = attr.ib(default=JSON_OBJECT)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(uuid_type=config.uuid_type, numeric_type=config.numeric_type, json_type=config.json_type)
+
+    @property
+    def text_oids(self):
+        """OIDs of the types the driver has to return as text."""
+        oids = (PG_UUID_OID, PG_NUMERIC_OID)
+        return oids if self.json_type == JSON_OBJECT else (*oids, PG_JSON_OID, PG_JSONB_OID)
+
+    def converters(self, description):
+        """Return the converters of the columns of a result by their position, from its DB-API description."""
+        converters = {}
+        for index, column in enumerate(description):
+            type_code = column[1]
+            if type_code == PG_UUID_OID and self.uuid_type == UUID_BINARY:
+                converters[index] = _uuid_binary
+            elif type_code == PG_NUMERIC_OID:
+                converters[index] = _numeric_float if self.numeric_type == NUMERIC_FLOAT else _numeric_decimal(column)
+            elif type_code in (PG_JSON_OID, PG_JSONB_OID) and self.json_type != JSON_OBJECT:
+                converters[index] = _large_string if self.json_type == JSON_STRING else _json_struct(column)
+
+        return converters
+
+    def frame(self, rows, columns, converters, coerce_float=True):
+        """Build the DataFrame of a chunk from the fetched rows, decoding the converted columns."""
+        data = pd.DataFrame.from_records(rows, columns=columns, coerce_float=coerce_float)
+        for index, dtype in enumerate(data.dtypes):
+            # The same as pandas.read_sql does for the columns with a time zone
+            if isinstance(dtype, pd.DatetimeTZDtype):
+                data.isetitem(index, pd.to_datetime(data.iloc[:, index], utc=True))
+        for index, convert in converters.items():
+            data.isetitem(index, convert(data.iloc[:, index].to_numpy(dtype=object)))
+
+        return data
+
+
+def _strings(values):
+    return pa.array(values, type=pa.string(), from_pandas=True)
+
+
+def _arrow_series(array):
+    return pd.Series(array, dtype=pd.ArrowDtype(array.type))
+
+
+def _large_string(values):
+    return _arrow_series(pa.array(values, type=pa.large_string(), from_pandas=True))
+
+
+def _uuid_binary(values):
+    missing = pd.isna(values)
+    has_missing = bool(missing.any())
+    if has_missing:
+        values = np.where(missing, _NULL_UUID, values)
+    # A single hex decoding of the whole column instead of parsing every UUID separately
+    raw = bytes.fromhex("".join(values).replace("-", ""))
+    validity = pa.array(~missing).buffers()[1] if has_missing else None
+    return _arrow_series(pa.Array.from_buffers(pa.binary(16), len(values), [validity, pa.py_buffer(raw)]))
+
+
+def _numeric_float(values):
+    # Missing values become NaN, the same as when pandas coerces the Decimal values
+    return pc.cast(_strings(values), pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def _numeric_decimal(column):
+    precision, scale = column[4], column[5]
+    declared = precision is not None and precision > 0 and scale is not None
+    decimal_type = _decimal_type(precision, scale) if declared else None
+    if decimal_type is None:
+        # A type inferred from the values could differ between the chunks, and so between the files of the dump
+        logger.debug("Keeping NUMERIC column %s as strings, it has no precision of a decimal", column[0])
+        return _large_string
+
+    def convert(values):
+        strings = _strings(values)
+        if pc.any(pc.is_in(strings, value_set=pa.array(_NUMERIC_SPECIAL))).as_py():
+            raise ValueError(
+                f"NUMERIC column {column[0]} has NaN or infinite values, which a decimal cannot hold, use "
+                "FLOORIST_NUMERIC_TYPE=float or cast the column to text in the query"
+            )
+
+        return _arrow_series(pc.cast(strings, decimal_type))
+
+    return convert
+
+
+def _decimal_type(precision, scale):
+    if precision <= DECIMAL128_MAX_PRECISION:
+        return pa.decimal128(precision, scale)
+    if precision <= DECIMAL256_MAX_PRECISION:
+        return pa.decimal256(precision, scale)
+
+    return None
+
+
+def _json_struct(column):
+    # The type of the column is fixed by the first chunk with documents, so every file of the dump has the same
+    # schema, the same as for the NUMERIC columns
+    value_type = None
+    objects = False
+
+    def convert(values):
+        nonlocal value_type, objects
+        if len(values) == 0:
+            return _large_string(values)
+        if objects:
+            return _json_objects(values)
+
+        if value_type is not None:
+            try:
+                table = _read_json_lines(values, pa.schema([("v", value_type)]))
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as ex:
+                raise ValueError(
+                    f"JSON column {column[0]} has documents that do not fit the type of the previous chunks "
+                    f"({value_type}), use FLOORIST_JSON_TYPE=string or a chunk size covering all their fields: {ex}"
+                ) from ex
+
+            return _arrow_series(table.column("v").combine_chunks())
+
+        try:
+            table = _read_json_lines(values)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            # E.g. a field holding a number in one document and a string in another, the same as the driver would
+            logger.debug("Parsing the JSON documents one by one, they have no common type", exc_info=True)
+            objects = True
+            return _json_objects(values)
+
+        array = table.column("v").combine_chunks()
+        if not pa.types.is_null(array.type):
+            value_type = array.type
+
+        return _arrow_series(array)
+
+    return convert
+
+
+def _read_json_lines(values, schema=None):
+    # Every document is wrapped into an object, so the reader accepts arrays and scalars as well, and the whole
+    # column is parsed at once from a single buffer of newline delimited objects
+    lines = pc.binary_join_element_wise('{"v":', pc.fill_null(_strings(values), "null"), "}\n", "")
+    body = lines.buffers()[2][: pc.sum(pc.binary_length(lines)).as_py()]
+    parse_options = pa_json.ParseOptions(explicit_schema=schema, unexpected_field_behavior="error") if schema else None
+    return pa_json.read_json(
+        pa.BufferReader(body),
+        read_options=pa_json.ReadOptions(block_size=max(len(body), 1), use_threads=False),
+        parse_options=parse_options,
+    )
+
+
+def _json_objects(values):
+    return pd.Series([None if pd.isna(value) else json.loads(value) for value in values], dtype=object)
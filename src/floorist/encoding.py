@@ -0,0 +1,212 @@
+import contextvars
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+from floorist.lazy import lazy_import
+from floorist.spill import PARQUET_COMPRESSION, PARQUET_WRITER_ARGS
+
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+logger = logging.getLogger(__name__)
+
+# Chunks smaller than this (as Arrow tables) are encoded in the process fetching them, shipping them to a worker
+# would cost more than it saves
+ENCODE_MIN_BYTES = 1024 * 1024
+
+# The tmpfs backing SharedMemory on Linux. Containers get only 64 MiB of it by default, and writing past its capacity
+# kills the process with SIGBUS instead of failing the write
+SHARED_MEMORY_DIRECTORY = "/dev/shm"
+
+# Chunks of a dump being encoded and uploaded while the next one is fetched, each of them is kept in memory until
+# it is written
+ENCODE_IN_FLIGHT = 2
+
+
+def encode_table(table, writer_kwargs=None):
+    """Encode an Arrow table into a parquet file in memory, with the same settings awswrangler uses for S3."""
+    stream = pa.BufferOutputStream()
+    pq.write_table(table, stream, compression=PARQUET_COMPRESSION, **PARQUET_WRITER_ARGS, **(writer_kwargs or {}))
+    return stream.getvalue()
+
+
+class ProcessEncoder:
+    """
+    Encodes the parquet files of the chunks in a pool of worker processes, so the compression uses all the cores.
+
+    The chunk is converted into an Arrow table and written into shared memory in the Arrow IPC format, which the
+    worker maps without copying it. Only the compressed file is sent back. The workers are spawned on the first
+    chunk, they only import pyarrow. A chunk that does not fit into the free space of the shared memory, less the
+    chunks being encoded at the same time, is encoded in place. So is a chunk whose worker died (e.g. killed for
+    running out of memory), the pool is then started again for the next chunks.
+
+    The conversion into an Arrow table stays in the calling process, the workers would otherwise get the chunk
+    pickled, which is the copy the shared memory avoids. ``ChunkPipeline`` runs it in the background instead.
+    """
+
+    def __init__(self, workers, min_bytes=ENCODE_MIN_BYTES):
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self._pool = None
+        self._lock = threading.Lock()
+        self._reserved = 0
+        self._memory_lock = threading.Lock()
+        self._warned = False
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Forking a process running the threads of the dumps and of boto3 is not safe
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+            return self._pool
+
+    def encode(self, data, options=None):
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        writer_kwargs = options.writer_kwargs(table.column_names) if options is not None else {}
+        if table.nbytes < self.min_bytes:
+            return encode_table(table, writer_kwargs)
+
+        size = _ipc_size(table)
+        if not self._reserve(size):
+            return encode_table(table, writer_kwargs)
+
+        try:
+            memory = shared_memory.SharedMemory(create=True, size=size)
+            try:
+                _write_ipc(table, memory.buf)
+                pool = self.pool
+                try:
+                    return pa.py_buffer(pool.submit(_encode_shared, memory.name, size, writer_kwargs).result())
+                except BrokenProcessPool:
+                    self._discard(pool)
+                    return encode_table(table, writer_kwargs)
+            finally:
+                memory.close()
+                memory.unlink()
+        finally:
+            with self._memory_lock:
+                self._reserved -= size
+
+    def _reserve(self, size):
+        # The pages of a new segment are only allocated as they are written, so the chunks being written at the same
+        # time are not in the free space yet
+        with self._memory_lock:
+            free = _shared_memory_free()
+            if free is not None and free - self._reserved < size:
+                if not self._warned:
+                    self._warned = True
+                    logger.warning(
+                        "Not enough free space in %s for a chunk of %d bytes, encoding the chunks that do not fit in "
+                        "place, mount a larger volume there",
+                        SHARED_MEMORY_DIRECTORY,
+                        size,
+                    )
+                return False
+
+            self._reserved += size
+            return True
+
+    def _discard(self, pool):
+        # The chunks encoded by the broken pool at the same time discard it only once
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+
+        logger.warning("An encode worker stopped unexpectedly, encoding the chunk in place and restarting the workers")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+class ChunkPipeline:
+    """
+    Writes the chunks of a dump in background threads, so the next chunk is fetched while the previous ones are
+    being encoded and uploaded.
+
+    At most ``depth`` chunks are written at a time, ``submit`` waits for the oldest one before starting another and
+    raises its error. Leaving the context waits for the rest, the writes still running after an error are waited for
+    as well, so the folder of the dump is not cleaned up under them. With a ``depth`` of 0 the chunks are written by
+    ``submit`` itself.
+    """
+
+    def __init__(self, depth=ENCODE_IN_FLIGHT):
+        self.depth = depth
+        self._pending = deque()
+        self._threads = ThreadPoolExecutor(depth) if depth else None
+
+    def submit(self, write, *args):
+        if self._threads is None:
+            write(*args)
+            return
+
+        while len(self._pending) >= self.depth:
+            self._pending.popleft().result()
+        self._pending.append(self._threads.submit(contextvars.copy_context().run, write, *args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if self._threads is None:
+            return
+
+        try:
+            while exc_type is None and self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._threads.shutdown(cancel_futures=True)
+
+
+def _shared_memory_free():
+    try:
+        stats = os.statvfs(SHARED_MEMORY_DIRECTORY)
+    except OSError:
+        # Not a tmpfs limiting the shared memory, e.g. on macOS
+        return None
+
+    return stats.f_bavail * stats.f_frsize
+
+
+def _ipc_size(table):
+    sink = pa.MockOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.size()
+
+
+def _write_ipc(table, memory):
+    # Every reference to the shared memory has to be released before it is closed
+    stream = pa.FixedSizeBufferWriter(pa.py_buffer(memory))
+    with pa.ipc.new_stream(stream, table.schema) as writer:
+        writer.write_table(table)
+    stream.close()
+
+
+def _encode_shared(name, size, writer_kwargs):
+    """Encode the Arrow IPC stream in the named shared memory, runs in a worker process."""
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        return _encode_ipc(memory.buf[:size], writer_kwargs)
+    finally:
+        memory.close()
+
+
+def _encode_ipc(buffer, writer_kwargs):
+    with pa.ipc.open_stream(pa.py_buffer(buffer)) as reader:
+        table = reader.read_all()
+
+    return encode_table(table, writer_kwargs).to_pybytes()
@@ -1,35 +1,97 @@
+import argparse
+import contextvars
 import logging
+import random
 import sys
+import threading
 import time
+from collections import OrderedDict
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import date
 from enum import Enum
 from os import environ
+from uuid import uuid4
 
 logger = logging.getLogger(__name__)
 
-import awswrangler as wr
-import boto3
-import botocore.exceptions
-import pandas as pd
-import psycopg2.extensions
-import yaml
-from pandas import DataFrame
-from sqlalchemy import create_engine, event
-from sqlalchemy import exc as sqlalchemy_exc
+import attr
 
-from floorist.config import Config, get_config
+from floorist import tracing
+from floorist.checkpoint import RunCheckpoint
+from floorist.config import DEFAULT_DATABASE, ENGINE_ASYNCIO, Config, DatabaseConfig, get_config
+from floorist.conversion import TypeConversion
+from floorist.encoding import ENCODE_IN_FLIGHT, ChunkPipeline, ProcessEncoder
+from floorist.floorplan import DumpSelector, load_floorplan
+from floorist.history import DumpStats, PerformanceHistory
+from floorist.layout import LAYOUT_OBJECT, MAX_KEY_SHARDS, cleanup_shards, sharded_name, write_layout
+from floorist.lazy import lazy_import
+from floorist.profiling import PROFILE_MEMORY, DumpProfiler
+from floorist.sinks import DATE_PATH_FORMAT, SINK_LOCAL, SINK_MEMORY, SINK_NULL, LocalSink, MemorySink, NullSink, Sink
+from floorist.spill import PARQUET_EXTENSION, SPILL_BATCH_SIZE, SpillWriter
+from floorist.throttle import Throttle
+from floorist.tracing import Tracer
+
+# The heavy dependencies are only imported when they are first used, which keeps the startup fast and
+# avoids importing the modules that the selected way of dumping does not need at all.
+wr = lazy_import("awswrangler")
+boto3 = lazy_import("boto3")
+botocore = lazy_import("botocore")
+pd = lazy_import("pandas")
+pq = lazy_import("pyarrow.parquet")
+psycopg2 = lazy_import("psycopg2")
+s3transfer = lazy_import("s3transfer")
+sqlalchemy = lazy_import("sqlalchemy")
+aio = lazy_import("floorist.aio")
 
 # Retry configuration
 MAX_RETRIES = 3
 RETRY_DELAY = 5  # seconds
 
+# Retry configuration of the single S3 requests, the delays are randomized up to the exponential backoff
+S3_MAX_RETRIES = 5
+S3_RETRY_DELAY = 1  # seconds
+S3_MAX_RETRY_DELAY = 30  # seconds
+
 LOG_FMT = "[%(asctime)s] [%(levelname)s] %(message)s"
 
-# Stable OID for the UUID type, assigned in src/include/catalog/pg_type.dat in the PostgreSQL source.
-# Verify with: SELECT oid FROM pg_type WHERE typname = 'uuid'
-_PG_UUID_OID = 2950
+# Seconds between the health checks of a replica, and seconds a replica is avoided after a conflict with recovery
+REPLICA_CHECK_INTERVAL = 30
+REPLICA_COOLDOWN = 300
+
+# Whether the host is a standby, and how many seconds of the received WAL it has not replayed yet
+_REPLICA_STATUS_QUERY = (
+    "SELECT pg_is_in_recovery(), CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+# Replication lag in seconds (of the host itself on standbys, of the slowest standby on primaries), the number of
+# connections running a query, and whether the role sees the statistics of the other roles. Without
+# pg_read_all_stats (granted by pg_monitor) the lag of the standbys reads as NULL and the connections of the other
+# roles have no state, so both would be too low.
+_LOAD_QUERY = (
+    "SELECT CASE WHEN pg_is_in_recovery() THEN "
+    "CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END "
+    "ELSE (SELECT EXTRACT(EPOCH FROM max(replay_lag)) FROM pg_stat_replication) END, "
+    "(SELECT count(*) FROM pg_stat_activity WHERE state = 'active' AND backend_type = 'client backend'), "
+    "pg_has_role(current_user, 'pg_read_all_stats', 'USAGE')"
+)
+
+# Defaults limiting the number of partition buffers held in memory and the partitions created by a single dump
+MAX_OPEN_PARTITIONS = 64
+MAX_PARTITIONS = 10000
+
+# Name of the partition holding null values, and the characters escaped in partition values, both as in Hive
+_HIVE_DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+_HIVE_ESCAPED_CHARS = frozenset("\"#%'*/:=?\\\x7f{[]^")
 
+# SQLSTATE codes of transient errors: serialization_failure (also raised for queries cancelled due to a conflict
+# with recovery on hot standbys) and deadlock_detected
+_RETRYABLE_SQLSTATES = frozenset({"40001", "40P01"})
+
+# Fallback for the errors raised by SQLAlchemy itself, which carry no SQLSTATE
 _RETRYABLE_DB_ERROR_PATTERNS = (
     "SerializationFailure",
     "conflict with recovery",
@@ -37,6 +99,14 @@ _RETRYABLE_DB_ERROR_PATTERNS = (
     "invalid transaction",
 )
 
+# S3 error codes (or HTTP status codes when the response has no body) of transient errors
+_THROTTLING_S3_ERROR_CODES = frozenset(
+    {"SlowDown", "Throttling", "ThrottlingException", "RequestLimitExceeded", "TooManyRequestsException", "503"}
+)
+_RETRYABLE_S3_ERROR_CODES = _THROTTLING_S3_ERROR_CODES | frozenset(
+    {"RequestTimeout", "InternalError", "ServiceUnavailable", "500", "502", "504"}
+)
+
 
 class RetryResult(Enum):
     RETRY = "retry"
@@ -61,18 +131,272 @@ class RetryPolicy:
 
     @staticmethod
     def _is_retryable(ex: Exception) -> bool:
+        sqlstate = _sqlstate(ex)
+        if sqlstate is not None:
+            return sqlstate in _RETRYABLE_SQLSTATES
+        if isinstance(ex, sqlalchemy.exc.PendingRollbackError):
+            return True
+
         error_str = str(ex)
         return any(p in error_str for p in _RETRYABLE_DB_ERROR_PATTERNS)
 
 
-class S3Client:
+class S3RetryPolicy(RetryPolicy):
+    def __init__(self, max_retries=S3_MAX_RETRIES, base_delay=S3_RETRY_DELAY, max_delay=S3_MAX_RETRY_DELAY):
+        super().__init__(max_retries, base_delay)
+        self.max_delay = max_delay
+
+    def backoff_delay(self, attempt: int) -> float:
+        # Full jitter, so the clients throttled at the same time do not retry at the same time either
+        return random.uniform(0, min(self.max_delay, super().backoff_delay(attempt)))
+
+    @staticmethod
+    def _is_retryable(ex: Exception) -> bool:
+        if _s3_error_code(ex) in _RETRYABLE_S3_ERROR_CODES:
+            return True
+
+        return isinstance(ex, (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError))
+
+
+def _sqlstate(ex):
+    # SQLAlchemy wraps the errors of the driver, psycopg2 exposes the SQLSTATE as pgcode and asyncpg as sqlstate
+    for error in (ex, getattr(ex, "orig", None)):
+        code = getattr(error, "pgcode", None) or getattr(error, "sqlstate", None)
+        if isinstance(code, str):
+            return code
+
+    return None
+
+
+def _s3_error_code(ex):
+    response = getattr(ex, "response", None)
+    if not isinstance(response, dict):
+        return None
+
+    code = response.get("Error", {}).get("Code")
+    if not code and "HTTPStatusCode" in response.get("ResponseMetadata", {}):
+        code = str(response["ResponseMetadata"]["HTTPStatusCode"])
+
+    return code
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of concurrent S3 requests, adapting the limit to throttling.
+
+    The limit is halved every time S3 asks to slow down and raised back by one after about as many successful
+    requests as the current limit, but never above the configured maximum.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self._active = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self._active >= int(self.limit):
+                self._condition.wait()
+            self._active += 1
+
+        return self
+
+    def __exit__(self, *args):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def throttled(self):
+        with self._condition:
+            self.limit = max(1.0, self.limit / 2)
+            logger.warning("S3 is throttling the requests, reduced the upload concurrency to %d", int(self.limit))
+
+    def succeeded(self):
+        with self._condition:
+            if self.limit < self.maximum:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+                self._condition.notify_all()
+
+
+def _quote_identifier(name):
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+
+def _escape_partition_value(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return _HIVE_DEFAULT_PARTITION
+    if isinstance(value, float) and value.is_integer():
+        # pandas turns an integer column with a NULL into floats, the chunk has to write into the same partitions
+        value = int(value)
+
+    return "".join(f"%{ord(c):02X}" if c in _HIVE_ESCAPED_CHARS or ord(c) < 0x20 else c for c in str(value))
+
+
+@attr.s(frozen=True)
+class ParquetOptions:
+    """
+    Layout options of the parquet files written for a single floorplan row.
+
+    ``sort_by`` orders the rows of every written file by the given columns so that the min/max statistics
+    of the row groups (and of the pages, with ``page_index``) can be used for pruning by the readers. The
+    sorting is done either in memory for each chunk, or by the database for the whole result when
+    ``sort_pushdown`` is enabled. ``bloom_filter`` writes bloom filters of the given columns, which let the readers
+    skip the row groups without a looked up value even if the column is not sorted.
+
+    ``partition_by`` splits the output into ``column=value`` hive partitions under the date path. At most
+    ``max_open_partitions`` partitions are buffered at once and a dump fails when it would create more than
+    ``max_partitions`` of them.
+
+    ``key_shards`` spreads the files of every folder over that many hashed ``key_shard=<hex>`` sub-folders, so
+    the uploads of a dump writing many objects are not throttled by S3 as requests to a single key prefix.
+    """
+
+    sort_by = attr.ib(default=(), converter=tuple)
+    sort_pushdown = attr.ib(default=False)
+    page_index = attr.ib(default=False)
+    bloom_filter = attr.ib(default=(), converter=tuple)
+    partition_by = attr.ib(default=(), converter=tuple)
+    max_open_partitions = attr.ib(default=MAX_OPEN_PARTITIONS)
+    max_partitions = attr.ib(default=MAX_PARTITIONS)
+    key_shards = attr.ib(default=0)
+
+    @classmethod
+    def from_row(cls, row):
+        key_shards = int(row.get("key_shards") or 0)
+        if not 0 <= key_shards <= MAX_KEY_SHARDS:
+            raise ValueError(f"key_shards must be between 0 and {MAX_KEY_SHARDS}")
+
+        return cls(
+            sort_by=_as_column_list(row.get("sort_by")),
+            sort_pushdown=bool(row.get("sort_pushdown", False)),
+            page_index=bool(row.get("page_index", False)),
+            bloom_filter=_as_column_list(row.get("bloom_filter")),
+            partition_by=_as_column_list(row.get("partition_by")),
+            max_open_partitions=int(row.get("max_open_partitions", MAX_OPEN_PARTITIONS)),
+            max_partitions=int(row.get("max_partitions", MAX_PARTITIONS)),
+            key_shards=key_shards,
+        )
+
+    @property
+    def file_sort_by(self):
+        # Partition columns are not stored in the files, all their rows have the same value anyway
+        return [column for column in self.sort_by if column not in self.partition_by]
+
+    def sort_query(self, query):
+        if not (self.sort_by and self.sort_pushdown):
+            return query
+
+        columns = ", ".join(_quote_identifier(column) for column in self.sort_by)
+        return f"SELECT * FROM ({query.strip().rstrip(';')}) AS floorist_sorted ORDER BY {columns}"
+
+    def sort_chunk(self, data):
+        if not self.file_sort_by or self.sort_pushdown or len(data) < 2:
+            return data
+
+        return data.sort_values(self.file_sort_by, kind="stable", ignore_index=True)
+
+    def sort_table(self, table):
+        # The same as sort_chunk for an Arrow table, the sort is stable and puts the nulls last as well
+        if not self.file_sort_by or self.sort_pushdown or len(table) < 2:
+            return table
+
+        return table.sort_by([(column, "ascending") for column in self.file_sort_by])
+
+    def writer_kwargs(self, columns):
+        kwargs = {}
+        if self.page_index:
+            kwargs["write_page_index"] = True
+        if self.file_sort_by:
+            columns = list(columns)
+            kwargs["sorting_columns"] = [pq.SortingColumn(columns.index(column)) for column in self.file_sort_by]
+        # Only the columns in the file, the partition columns are not and the folders of empty results have none
+        bloom_filter = [column for column in self.bloom_filter if column in columns and column not in self.partition_by]
+        if bloom_filter:
+            kwargs["bloom_filter_options"] = dict.fromkeys(bloom_filter, True)
+
+        return kwargs
+
+
+def _as_column_list(value):
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    return tuple(value)
+
+
+class PartitionedWriter:
+    """
+    Writes the chunks of a dump into hive partitions based on the values of the partition columns.
+
+    The rows are buffered per partition until there are enough of them for a file. When a new partition
+    would exceed the limit of open buffers, the least recently used one is flushed into a file first.
+    """
+
+    def __init__(self, sink, path, target, options, rows_per_file, dump_count, pipeline=None):
+        self.sink = sink
+        self.path = path
+        self.target = target
+        self.options = options
+        self.rows_per_file = rows_per_file
+        self.dump_count = dump_count
+        self.pipeline = ChunkPipeline(0) if pipeline is None else pipeline
+        self.files = 0
+        self._buffers = OrderedDict()
+        self._buffered_rows = {}
+        self._partitions = set()
+
+    def write(self, data):
+        columns = list(self.options.partition_by)
+        for keys, group in data.groupby(columns, sort=False, dropna=False, observed=True):
+            keys = keys if isinstance(keys, tuple) else (keys,)
+            partition = "/".join(f"{column}={_escape_partition_value(key)}" for column, key in zip(columns, keys))
+            self._append(partition, group.drop(columns=columns))
+
+    def close(self):
+        while self._buffers:
+            self._flush(next(iter(self._buffers)))
+
+        if not self.files:
+            self.sink.write_parquet(pd.DataFrame(), self.target, self.path, self.options)
+            logger.info("[Dump #%d] Empty folder created for empty result", self.dump_count)
+
+    def _append(self, partition, data):
+        if partition in self._buffers:
+            self._buffers.move_to_end(partition)
+        else:
+            if partition not in self._partitions:
+                if len(self._partitions) >= self.options.max_partitions:
+                    raise ValueError(f"Dump exceeds the limit of {self.options.max_partitions} partitions")
+                self._partitions.add(partition)
+            if len(self._buffers) >= self.options.max_open_partitions:
+                self._flush(next(iter(self._buffers)))
+            self._buffers[partition] = []
+            self._buffered_rows[partition] = 0
+
+        self._buffers[partition].append(data)
+        self._buffered_rows[partition] += len(data)
+        if self.rows_per_file and self._buffered_rows[partition] >= self.rows_per_file:
+            self._flush(partition)
+
+    def _flush(self, partition):
+        del self._buffered_rows[partition]
+        self.files += 1
+        self.pipeline.submit(self._write, self._buffers.pop(partition), partition, self.files)
+
+    def _write(self, buffers, partition, number):
+        data = self.options.sort_chunk(pd.concat(buffers, ignore_index=True))
+        self.sink.write_parquet(data, f"{self.target}/{partition}", f"{self.path}/{partition}", self.options)
+        logger.info("[Dump #%d] Written parquet file #%d to partition %s", self.dump_count, number, partition)
+
+
+class S3Client(Sink):
     def __init__(self, config: Config):
         self.bucket_name = config.bucket_name
 
         # Compatibility with minio, setting the endpoint URL explicitly if available
         self.bucket_url = config.bucket_url
-        if self.bucket_url:
-            wr.config.s3_endpoint_url = self.bucket_url
 
         boto3.setup_default_session(
             aws_access_key_id=config.bucket_access_key,
@@ -80,179 +404,722 @@ class S3Client:
             region_name=config.bucket_region,
         )
 
+        self.upload_concurrency = config.upload_concurrency
+        self.multipart_chunksize = config.multipart_chunksize
+        self.retry_policy = S3RetryPolicy()
+        self._client = None
+        self._limiter = None
+        self._transfer_manager = None
+        self._upload_pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = boto3.client(
+                    "s3",
+                    endpoint_url=self.bucket_url,
+                    config=botocore.config.Config(max_pool_connections=self.upload_concurrency),
+                )
+
+            return self._client
+
+    @property
+    def limiter(self):
+        with self._lock:
+            if self._limiter is None:
+                self._limiter = AdaptiveLimiter(self.upload_concurrency)
+
+            return self._limiter
+
+    @property
+    def wrangler(self):
+        # Importing awswrangler is expensive, so it is only configured when a dump is written through it
+        if self.bucket_url:
+            wr.config.s3_endpoint_url = self.bucket_url
+
+        return wr
+
     def verify(self):
-        # Fails if can't connect to S3 or the bucket does not exist
-        try:
-            wr.s3.list_directories(f"s3://{self.bucket_name}")
-        except botocore.exceptions.ClientError as e:
-            # On an exception, try again with a trailing slash since the client might not have
-            # ListBuckets permission on the bucket name itself, but only on items beneath it.
-            error_code = e.response.get("Error", {}).get("Code")
-            if error_code in {"AccessDenied"}:
-                wr.s3.list_directories(f"s3://{self.bucket_name.rstrip('/')}/")
-            else:
-                raise
+        # Fails if can't connect to S3 or the bucket does not exist. Listing at most a single key is a cheap
+        # request regardless of the size of the bucket. If the bucket name embeds a key prefix, the listing is
+        # restricted to it, as the client might only have permissions on the items beneath it.
+        bucket, prefix = self._split_path("")
+        self.client.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1)
 
     def make_path(self, prefix):
-        path = f"{prefix}/{date.today().strftime('year_created=%Y/month_created=%-m/day_created=%-d')}"  # noqa: DTZ011 — local time is intentional
+        path = f"{prefix}/{date.today().strftime(DATE_PATH_FORMAT)}"  # noqa: DTZ011 — local time is intentional
         target = f"s3://{self.bucket_name}/{path}"
         return path, target
 
-    def write_parquet(self, data, target, path):
+    def write_parquet(self, data, target, path, options=None):
         if len(data) > 0:
-            wr.s3.to_parquet(data, target, index=False, compression="gzip", dataset=True, mode="append")
-        else:
-            name = self.bucket_name.rstrip("/")
-            if "/" in name:
-                bucket, prefix = name.split("/", 1)
-                key = f"{prefix.rstrip('/')}/{path.lstrip('/')}"
+            kwargs = {}
+            if options is not None and (writer_kwargs := options.writer_kwargs(data.columns)):
+                kwargs["pyarrow_additional_kwargs"] = writer_kwargs
+            # The name of the file is fixed before the first attempt, so a retry after an upload that did succeed
+            # (e.g. the connection dropped before the response) overwrites it instead of duplicating the rows.
+            name = sharded_name(f"{uuid4().hex}{PARQUET_EXTENSION}", options)
+            file_target = f"{target}/{name}"
+            if self.encoder is not None:
+                # Encoded by the worker processes, only the upload is left for this thread
+                body = self.encode(data, options).to_pybytes()
+                bucket, key = self._split_path(f"{path}/{name}")
+                with tracing.span("upload", **{"object.key": file_target}, rows=len(data), bytes=len(body)):
+                    self._retrying(file_target, lambda: self.client.put_object(Bucket=bucket, Body=body, Key=key))
             else:
-                bucket = name
-                key = path
-            wr._utils.client("s3").put_object(Bucket=bucket, Body="", Key=f"{key.rstrip('/')}/")
+                # awswrangler encodes and uploads the file at once
+                with tracing.span("upload", **{"object.key": file_target}, rows=len(data)):
+                    self._retrying(
+                        file_target,
+                        lambda: self.wrangler.s3.to_parquet(
+                            data, file_target, index=False, compression="gzip", **kwargs
+                        ),
+                    )
+        else:
+            bucket, key = self._split_path(path)
+            self._retrying(path, lambda: self.client.put_object(Bucket=bucket, Body="", Key=f"{key.rstrip('/')}/"))
 
-    def cleanup(self, target):
-        wr.s3.delete_objects(target)
+    @property
+    def upload_pool(self):
+        with self._lock:
+            if self._upload_pool is None:
+                self._upload_pool = ThreadPoolExecutor(max_workers=self.upload_concurrency)
 
+            return self._upload_pool
 
-class DatabaseClient:
-    _uuid_caster = psycopg2.extensions.new_type(
-        (_PG_UUID_OID,),
-        "UUID_AS_STRING",
-        psycopg2.STRING,
-    )
+    def upload_file(self, filename, path):
+        """Start uploading a local file into the given path under the bucket, returns a future of the upload."""
+        bucket, key = self._split_path(path)
+        return self.upload_pool.submit(contextvars.copy_context().run, self._upload_file, filename, bucket, key, path)
 
-    def __init__(self, config: Config):
-        self.engine = create_engine(
-            f"postgresql+psycopg2://{config.database_username}:{config.database_password}@{config.database_hostname}/{config.database_name}"
+    def _upload_file(self, filename, bucket, key, path):
+        with tracing.span("upload", **{"object.key": path}, file=filename):
+            self._retrying(path, lambda: self._transfer_manager_upload(filename, bucket, key))
+
+    def read_object(self, path):
+        """Return the content of an object under the bucket, or None if it does not exist."""
+        bucket, key = self._split_path(path)
+        try:
+            response = self._retrying(path, lambda: self.client.get_object(Bucket=bucket, Key=key))
+        except botocore.exceptions.ClientError as ex:
+            if _s3_error_code(ex) in ("NoSuchKey", "404"):
+                return None
+            raise
+
+        return response["Body"].read()
+
+    def write_object(self, path, body):
+        bucket, key = self._split_path(path)
+        self._retrying(path, lambda: self.client.put_object(Bucket=bucket, Body=body, Key=key))
+
+    def cleanup(self, target, shards=()):
+        if not shards:
+            # Not sharded, or partitioned with the shards nested in the partitions, the whole folder is listed
+            self._retrying(target, self._delete_objects(target))
+            return
+
+        # Each shard is listed and deleted separately, as S3 limits the requests to a single prefix
+        deletes = [
+            self.upload_pool.submit(self._retrying, f"{target}/{shard}", self._delete_objects(f"{target}/{shard}"))
+            for shard in shards
+        ]
+        for delete in deletes:
+            delete.result()
+
+        # Only the layout and the folder marker of an empty result are left next to the shards, they are deleted by
+        # their keys instead of listing the whole folder again
+        bucket, key = self._split_path(target.removeprefix(f"s3://{self.bucket_name}/"))
+        self._retrying(target, lambda: self._delete_keys(bucket, [f"{key}/{LAYOUT_OBJECT}", f"{key}/"]))
+
+    def _delete_objects(self, target):
+        return lambda: self.wrangler.s3.delete_objects(target)
+
+    def _delete_keys(self, bucket, keys):
+        # Missing keys are not errors, the failures of the others are only reported in the response
+        response = self.client.delete_objects(
+            Bucket=bucket, Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
         )
-        event.listen(self.engine, "connect", self._register_uuid_caster)
-        self.conn = self.engine.connect().execution_options(stream_results=True)
+        if response.get("Errors"):
+            error = response["Errors"][0]
+            raise OSError(f"Failed to delete {error['Key']}: {error['Code']}")
+
+    def close(self):
+        if self._upload_pool is not None:
+            self._upload_pool.shutdown(cancel_futures=True)
+            self._upload_pool = None
+        if self._transfer_manager is not None:
+            self._transfer_manager.shutdown()
+            self._transfer_manager = None
+
+    def _transfer_manager_upload(self, filename, bucket, key):
+        client = self.client
+        with self._lock:
+            if self._transfer_manager is None:
+                transfer_config = s3transfer.manager.TransferConfig(
+                    multipart_threshold=self.multipart_chunksize,
+                    multipart_chunksize=self.multipart_chunksize,
+                    max_request_concurrency=self.upload_concurrency,
+                )
+                self._transfer_manager = s3transfer.manager.TransferManager(client, transfer_config)
+
+        return self._transfer_manager.upload(filename, bucket, key).result()
+
+    def _retrying(self, name, request):
+        """Run a single S3 request, retrying transient errors with a backoff and slowing down when throttled."""
+        limiter = self.limiter
+        for attempt in range(self.retry_policy.max_retries):
+            try:
+                with limiter:
+                    result = request()
+                limiter.succeeded()
+                return result
+            except Exception as ex:
+                if self.retry_policy.evaluate(ex, attempt) != RetryResult.RETRY:
+                    raise
+
+                if _s3_error_code(ex) in _THROTTLING_S3_ERROR_CODES:
+                    limiter.throttled()
+                backoff_time = self.retry_policy.backoff_delay(attempt)
+                span = tracing.current()
+                span.add("retries")
+                span.set(**{"retry.cause": _s3_error_code(ex) or type(ex).__name__})
+                logger.warning(
+                    "Retrying %s in %.1f seconds due to: %s",
+                    name,
+                    backoff_time,
+                    _s3_error_code(ex) or type(ex).__name__,
+                )
+                time.sleep(backoff_time)
+
+    def _split_path(self, path):
+        # AWS_BUCKET may embed a key prefix after the bucket name
+        name = self.bucket_name.rstrip("/")
+        if "/" in name:
+            bucket, prefix = name.split("/", 1)
+            return bucket, f"{prefix.rstrip('/')}/{path.lstrip('/')}"
+
+        return name, path.lstrip("/")
+
+
+# psycopg2 type casters returning the values as strings, by the OIDs they are registered for
+_TEXT_CASTERS = {}
+
+
+@attr.s
+class _Replica:
+    host = attr.ib()
+    engine = attr.ib()
+    active = attr.ib(default=0)
+    healthy = attr.ib(default=True)
+    checked = attr.ib(default=None)
+    avoided_until = attr.ib(default=0.0)
+
+
+class DatabaseClient:
+    """
+    Pooled connections to a single database target.
+
+    Each thread running a dump checks out its own connection on the first query and returns it to the pool on
+    commit or rollback. At most ``max_connections`` connections are checked out at once, other threads wait
+    for one of them to be returned.
+
+    If the target has replicas, the connections are spread over the healthy ones, preferring the replicas with
+    the fewest dumps running. A replica is healthy if it is reachable, is a standby and its replay lag is below
+    the limit, which is checked at most every ``REPLICA_CHECK_INTERVAL`` seconds. A replica cancelling a dump due
+    to a conflict with recovery is avoided for ``REPLICA_COOLDOWN`` seconds, so the retry fails over to another
+    one. The primary host is used only if no replica is healthy and the primary is explicitly allowed.
+    """
+
+    def __init__(self, config: DatabaseConfig, conversion=None):
+        self.config = config
+        self.conversion = TypeConversion() if conversion is None else conversion
+        self.engine = self._create_engine(config, config.hostname)
+        self.replicas = [_Replica(host, self._create_engine(config, host)) for host in config.replicas]
+        self.max_replica_lag = config.max_replica_lag
+        self.allow_primary = config.allow_primary
+        self._slots = threading.BoundedSemaphore(config.max_connections)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._turn = 0
+        self._load = {}
+        self._monitors = {}
+        self._unprivileged = set()
+
+    def _create_engine(self, config, host):
+        engine = sqlalchemy.create_engine(_database_url(config, host), pool_size=config.max_connections, max_overflow=0)
+        sqlalchemy.event.listen(engine, "connect", self._register_text_casters)
+        return engine
+
+    def verify(self):
+        # Fails if the database is not reachable or the credentials are invalid
+        if not self.replicas:
+            self.engine.connect().close()
+            return
+
+        self.checkout()
+        self.rollback()
+
+    @property
+    def conn(self):
+        return self.checkout()
+
+    def checkout(self, allow_primary=None):
+        """Check out the connection of the current thread, ``allow_primary`` overrides the setting of the target."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self._slots.acquire()
+            try:
+                replica, conn = self._connect(self.allow_primary if allow_primary is None else allow_primary)
+            except BaseException:
+                self._slots.release()
+                raise
+            self._local.conn = conn.execution_options(stream_results=True)
+            self._local.replica = replica
+
+        return self._local.conn
+
+    def load(self, max_age):
+        """
+        Return the replication lag and the number of active connections of the host of the current connection.
+
+        The load is queried through a separate connection, as the statistics are frozen within the transaction of
+        the dump. The result is shared by all the dumps on the same host for ``max_age`` seconds.
+        """
+        replica = getattr(self._local, "replica", None)
+        host = self.config.hostname if replica is None else replica.host
+        now = time.monotonic()
+        with self._lock:
+            checked, lag, active = self._load.get(host, (None, None, 0))
+            if checked is not None and now - checked < max_age:
+                return lag, active
+
+            if host not in self._monitors:
+                # Not pooled, the pool of the host might be exhausted by the dumps
+                self._monitors[host] = sqlalchemy.create_engine(
+                    _database_url(self.config, host), poolclass=sqlalchemy.pool.NullPool
+                )
+            monitor = self._monitors[host]
+
+        with monitor.connect() as conn:
+            lag, active, privileged = conn.execute(sqlalchemy.text(_LOAD_QUERY)).one()
+        lag = None if lag is None else float(lag)
+        with self._lock:
+            self._load[host] = (time.monotonic(), lag, active)
+            warn = not privileged and host not in self._unprivileged
+            if warn:
+                self._unprivileged.add(host)
+        if warn:
+            logger.warning(
+                "The role %s is not a member of pg_monitor or pg_read_all_stats on %s, the replication lag of the "
+                "standbys and the queries of the other roles are not visible, the throttling cannot see the load",
+                self.config.username,
+                host,
+            )
+
+        return lag, active
+
+    def _connect(self, allow_primary):
+        if not self.replicas:
+            return None, self.engine.connect()
+
+        for replica in self._candidates():
+            conn = self._connect_replica(replica)
+            if conn is not None:
+                return replica, conn
+
+        if not allow_primary:
+            raise RuntimeError(f"None of the replicas {[r.host for r in self.replicas]} is healthy")
+
+        logger.warning("None of the replicas is healthy, connecting to the primary")
+        return None, self.engine.connect()
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            count = len(self.replicas)
+            self._turn = (self._turn + 1) % count
+            # The least busy replicas first, the ones avoided due to recovery conflicts only as the last resort.
+            # The turn rotates the order of equally busy replicas, so sequential dumps are spread as well.
+            return sorted(
+                (
+                    r
+                    for r in self.replicas
+                    if r.healthy or r.checked is None or now - r.checked >= REPLICA_CHECK_INTERVAL
+                ),
+                key=lambda r: (r.avoided_until > now, r.active, (self.replicas.index(r) - self._turn) % count),
+            )
+
+    def _connect_replica(self, replica):
+        try:
+            conn = replica.engine.connect()
+        except sqlalchemy.exc.OperationalError as ex:
+            self._update_health(replica, False, "is not reachable: %s", str(ex).split("\n")[0])
+            return None
+
+        now = time.monotonic()
+        if replica.checked is None or now - replica.checked >= REPLICA_CHECK_INTERVAL:
+            try:
+                in_recovery, lag = conn.execute(sqlalchemy.text(_REPLICA_STATUS_QUERY)).one()
+                conn.rollback()
+            except sqlalchemy.exc.DBAPIError as ex:
+                conn.close()
+                self._update_health(replica, False, "failed the health check: %s", str(ex).split("\n")[0])
+                return None
+
+            if not in_recovery:
+                self._update_health(replica, False, "is not a standby")
+            elif lag is not None and float(lag) > self.max_replica_lag:
+                self._update_health(replica, False, "is lagging behind by %.0f seconds", float(lag))
+            else:
+                self._update_health(replica, True, "is healthy")
+
+        if not replica.healthy:
+            conn.close()
+            return None
+
+        with self._lock:
+            replica.active += 1
+        return conn
 
     @staticmethod
-    def _register_uuid_caster(dbapi_conn, connection_record):
+    def _update_health(replica, healthy, reason, *args):
+        if healthy != replica.healthy or replica.checked is None:
+            log = logger.info if healthy else logger.warning
+            log("Replica %s " + reason, replica.host, *args)
+        replica.healthy = healthy
+        replica.checked = time.monotonic()
+
+    def _register_text_casters(self, dbapi_conn, connection_record):
         if not isinstance(dbapi_conn, psycopg2.extensions.connection):
             raise TypeError(
-                f"Expected a psycopg2 connection, got {type(dbapi_conn).__name__}. "
-                "The UUID type caster requires psycopg2."
+                f"Expected a psycopg2 connection, got {type(dbapi_conn).__name__}. The type casters require psycopg2."
             )
-        # Convert all UUID types to strings automatically.  The s3.write_parquet method will fail if
-        # columns remain the UUID type
-        psycopg2.extensions.register_type(DatabaseClient._uuid_caster, dbapi_conn)
-
-    def execute_query(self, query, chunksize) -> Generator[DataFrame, None, None]:
-        result = pd.read_sql(query, self.conn, chunksize=chunksize)
-        if isinstance(result, DataFrame):
-            yield result
-        else:
-            yield from result
+        # Fetch the UUIDs (the s3.write_parquet method fails on the UUID type), NUMERIC and JSON values as strings
+        # instead of Python objects, they are decoded in bulk by the type conversion
+        oids = self.conversion.text_oids
+        caster = _TEXT_CASTERS.get(oids)
+        if caster is None:
+            caster = _TEXT_CASTERS[oids] = psycopg2.extensions.new_type(oids, "FLOORIST_AS_STRING", psycopg2.STRING)
+        psycopg2.extensions.register_type(caster, dbapi_conn)
+
+    def execute_query(self, query, chunksize) -> Generator["pd.DataFrame", None, None]:
+        # The same as pandas.read_sql, except for the columns decoded by the type conversion
+        result = self.conn.exec_driver_sql(query)
+        try:
+            columns = list(result.keys())
+            converters = self.conversion.converters(result.cursor.description)
+            if chunksize is None:
+                yield self.conversion.frame(result.fetchall(), columns, converters)
+                return
+
+            fetched = False
+            while rows := result.fetchmany(chunksize):
+                fetched = True
+                yield self.conversion.frame(rows, columns, converters)
+            if not fetched:
+                # An empty result is a single empty chunk with the columns of the query
+                yield self.conversion.frame([], columns, converters)
+        finally:
+            result.close()
 
     def commit(self):
-        self.conn.commit()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            try:
+                conn.commit()
+            finally:
+                self._release(conn)
 
-    def rollback(self):
-        self.conn.rollback()
+    def rollback(self, error=None):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            replica = getattr(self._local, "replica", None)
+            if replica is not None and error is not None and _is_recovery_conflict(error):
+                logger.warning(
+                    "Replica %s cancelled the query due to a conflict with recovery, avoiding it for %d seconds",
+                    replica.host,
+                    REPLICA_COOLDOWN,
+                )
+                replica.avoided_until = time.monotonic() + REPLICA_COOLDOWN
+            try:
+                conn.rollback()
+            finally:
+                self._release(conn)
 
     def close(self):
-        self.conn.close()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._release(conn)
         self.engine.dispose()
+        for replica in self.replicas:
+            replica.engine.dispose()
+        for monitor in self._monitors.values():
+            monitor.dispose()
+
+    def _release(self, conn):
+        replica = getattr(self._local, "replica", None)
+        self._local.conn = None
+        self._local.replica = None
+        if replica is not None:
+            with self._lock:
+                replica.active -= 1
+        try:
+            conn.close()
+        finally:
+            self._slots.release()
+
+
+def _database_url(config, host):
+    return f"postgresql+psycopg2://{config.username}:{config.password}@{host}/{config.name}"
+
+
+def _is_recovery_conflict(ex):
+    # Queries on hot standbys cancelled by the replay of the WAL fail with serialization_failure
+    return _sqlstate(ex) == "40001" or "conflict with recovery" in str(ex)
+
+
+class DatabaseTargets:
+    """Database clients of the named targets referenced by the floorplan, connected on their first use."""
+
+    def __init__(self, config, default_client):
+        self.config = config
+        self._clients = {DEFAULT_DATABASE: default_client}
+        self._lock = threading.Lock()
+
+    def get(self, name=None):
+        name = name or DEFAULT_DATABASE
+        with self._lock:
+            if name not in self._clients:
+                # Raises a KeyError for undefined targets, same as any other invalid floorplan row
+                self._clients[name] = DatabaseClient(
+                    self.config.database(name), self._clients[DEFAULT_DATABASE].conversion
+                )
+                logger.info("Created connection pool for database target '%s'", name)
+
+            return self._clients[name]
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
 
 
 class DumpExecutor:
-    def __init__(self, s3_client, db_client, retry_policy):
-        self.s3_client = s3_client
+    def __init__(
+        self,
+        sink,
+        db_client,
+        retry_policy,
+        spill_directory=None,
+        databases=None,
+        profiler=None,
+        throttle=None,
+        in_flight=0,
+    ):
+        self.sink = sink
         self.db_client = db_client
         self.retry_policy = retry_policy
+        self.spill_directory = spill_directory
+        self.databases = databases
+        self.profiler = profiler
+        self.throttle = throttle
+        # Chunks written in the background while the next one is fetched, see ChunkPipeline
+        self.in_flight = in_flight
+
+    def _database(self, row):
+        if "database" not in row:
+            return self.db_client
+        if self.databases is None:
+            raise KeyError(row["database"])
 
-    def _write_chunks(self, path, target, query, chunksize, dump_count):
+        return self.databases.get(row["database"])
+
+    def _write_chunks(
+        self, db_client, path, target, query, chunksize, dump_count, options=None, stats=None, throttle=None
+    ):
+        options = options or ParquetOptions()
+        stats = DumpStats() if stats is None else stats
         logger.debug("[Dump #%d] Query: %s", dump_count, query)
-        cursor = self.db_client.execute_query(query, chunksize)
+        write_layout(self.sink, path, options)
+
+        if self.spill_directory and not options.partition_by:
+            self._spill_chunks(db_client, path, target, query, chunksize, dump_count, options, stats, throttle)
+            return
+
+        cursor = self._fetch(db_client, query, chunksize, stats, throttle)
+        pipeline = ChunkPipeline(self.in_flight)
+
+        if options.partition_by:
+            with pipeline:
+                writer = PartitionedWriter(self.sink, path, target, options, chunksize, dump_count, pipeline)
+                for data in cursor:
+                    writer.write(data)
+                writer.close()
+            stats.objects = writer.files
+            logger.debug("[Dump #%d] Dumped %s to %s", dump_count, query, path)
+            return
 
         chunk = 1
-        for data in cursor:
-            self.s3_client.write_parquet(data, target, path)
-            if len(data) > 0:
-                logger.info("[Dump #%d] Written parquet chunk #%d", dump_count, chunk)
-                chunk += 1
-            else:
-                logger.info("[Dump #%d] Empty folder created for empty result", dump_count)
+        with pipeline:
+            for data in cursor:
+                pipeline.submit(self._write_chunk, data, target, path, options, dump_count, chunk)
+                if len(data) > 0:
+                    chunk += 1
+
+        stats.objects = chunk - 1
+        logger.debug("[Dump #%d] Dumped %s to %s", dump_count, query, path)
+
+    def _write_chunk(self, data, target, path, options, dump_count, chunk):
+        data = options.sort_chunk(data)
+        self.sink.write_parquet(data, target, path, options)
+        if len(data) > 0:
+            logger.info("[Dump #%d] Written parquet chunk #%d", dump_count, chunk)
+        else:
+            logger.info("[Dump #%d] Empty folder created for empty result", dump_count)
+
+    def _spill_chunks(self, db_client, path, target, query, chunksize, dump_count, options, stats, throttle=None):
+        writer = SpillWriter(self.sink, self.spill_directory, path, target, options, chunksize, dump_count)
+        batch_size = min(chunksize or SPILL_BATCH_SIZE, SPILL_BATCH_SIZE)
+        try:
+            for data in self._fetch(db_client, query, batch_size, stats, throttle):
+                writer.write(data)
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+
+        stats.objects = writer.files
 
         logger.debug("[Dump #%d] Dumped %s to %s", dump_count, query, path)
 
-    def execute(self, row, dump_count) -> bool:
+    @staticmethod
+    def _fetch(db_client, query, chunksize, stats, throttle):
+        chunks = stats.count(tracing.batches(db_client.execute_query(query, chunksize)))
+        if throttle is not None:
+            chunks = throttle(chunks, stats=stats)
+
+        return chunks
+
+    def execute(self, row, dump_count, stats=None) -> bool:
         """
         Execute a dump with retry logic.
 
         Args:
             row: Floorplan row configuration containing 'query', 'prefix', etc.
             dump_count: The dump number for logging
+            stats: Optional DumpStats collecting the performance of the dump
 
         Returns:
             bool: True if dump succeeded, False if dump failed
         """
+        stats = DumpStats(measure_bytes=tracing.enabled()) if stats is None else stats
+        profile = nullcontext() if self.profiler is None else self.profiler.profile(dump_count)
+        started = time.monotonic()
+        prefix = row.get("prefix") if isinstance(row, dict) else None
+        with profile, tracing.span("dump", dump=dump_count, prefix=prefix) as span:
+            try:
+                stats.succeeded = self._execute(row, dump_count, stats)
+            finally:
+                stats.duration = time.monotonic() - started
+            span.set(
+                succeeded=stats.succeeded,
+                rows=stats.rows,
+                bytes=stats.bytes,
+                objects=stats.objects,
+                retries=stats.retries,
+            )
+
+        return stats.succeeded
+
+    def _execute(self, row, dump_count, stats):
         try:
-            path, target = self.s3_client.make_path(row["prefix"])
-            query = row["query"]
+            db_client = self._database(row)
+            path, target = self.sink.make_path(row["prefix"])
+            options = ParquetOptions.from_row(row)
+            query = options.sort_query(row["query"])
             chunksize = row.get("chunksize", 1000) or None
-        except KeyError:
+            allow_primary = row.get("allow_primary")
+            throttle = self.throttle.for_dump(row, db_client, dump_count) if self.throttle is not None else None
+        except (AttributeError, KeyError, TypeError, ValueError):
+            # E.g. a row that is not a mapping, which only fails its own dump if it gets past the floorplan
             logger.exception("[Dump #%d] invalid config row: %r", dump_count, row)
             return False
 
+        stats.prefix = row["prefix"]
+
         for attempt in range(self.retry_policy.max_retries):
-            try:
-                if attempt > 0:
-                    logger.info(
-                        "[Dump #%d] Retry %d of %d (attempt %d total)",
-                        dump_count,
-                        attempt,
-                        self.retry_policy.max_retries - 1,
-                        attempt + 1,
-                    )
-                    try:
-                        self.s3_client.cleanup(target)
-                    except Exception:
-                        logger.exception("[Dump #%d] S3 cleanup failed, cannot retry", dump_count)
-                        return False
+            with tracing.span("attempt", attempt=attempt + 1) as span:
+                try:
+                    if attempt > 0:
+                        logger.info(
+                            "[Dump #%d] Retry %d of %d (attempt %d total)",
+                            dump_count,
+                            attempt,
+                            self.retry_policy.max_retries - 1,
+                            attempt + 1,
+                        )
+                        try:
+                            self.sink.cleanup(target, cleanup_shards(options))
+                        except Exception:
+                            logger.exception("[Dump #%d] S3 cleanup failed, cannot retry", dump_count)
+                            return False
+                        stats.retries = attempt
+                        stats.reset()
 
-                self._write_chunks(path, target, query, chunksize, dump_count)
+                    with tracing.span("query", **{"db.statement": query}) as query_span:
+                        db_client.checkout(allow_primary)
+                        self._write_chunks(
+                            db_client, path, target, query, chunksize, dump_count, options, stats, throttle
+                        )
 
-                # Commit the transaction to release resources and prevent long-running transactions
-                self.db_client.commit()
-                return True  # Success
+                        # Commit the transaction to release resources and prevent long-running transactions
+                        db_client.commit()
+                        query_span.set(rows=stats.rows, bytes=stats.bytes)
+                    return True  # Success
 
-            except (
-                sqlalchemy_exc.OperationalError,
-                sqlalchemy_exc.PendingRollbackError,
-            ) as ex:
-                logger.warning("[Dump #%d] Database error, rolling back", dump_count)
-                try:
-                    self.db_client.rollback()
-                except Exception:
-                    logger.exception("[Dump #%d] Rollback failed", dump_count)
+                except (
+                    sqlalchemy.exc.OperationalError,
+                    sqlalchemy.exc.PendingRollbackError,
+                ) as ex:
+                    logger.warning("[Dump #%d] Database error, rolling back", dump_count)
+                    span.fail(ex)
+                    try:
+                        db_client.rollback(ex)
+                    except Exception:
+                        logger.exception("[Dump #%d] Rollback failed", dump_count)
 
-                retry_result = self.retry_policy.evaluate(ex, attempt)
+                    retry_result = self.retry_policy.evaluate(ex, attempt)
 
-                if retry_result == RetryResult.FAILURE:
-                    logger.exception("[Dump #%d] Non-retryable database error", dump_count)
-                    break
+                    if retry_result == RetryResult.FAILURE:
+                        logger.exception("[Dump #%d] Non-retryable database error", dump_count)
+                        break
 
-                if retry_result == RetryResult.EXHAUSTED:
-                    logger.exception("[Dump #%d] Retries exhausted", dump_count)
-                    break
+                    if retry_result == RetryResult.EXHAUSTED:
+                        logger.exception("[Dump #%d] Retries exhausted", dump_count)
+                        break
 
-                backoff_time = self.retry_policy.backoff_delay(attempt)
-                logger.warning(
-                    "[Dump #%d] Retrying in %d seconds due to: %s",
-                    dump_count,
-                    backoff_time,
-                    str(ex).split("\n")[0],
-                )
-                time.sleep(backoff_time)
-                continue
+                    backoff_time = self.retry_policy.backoff_delay(attempt)
+                    logger.warning(
+                        "[Dump #%d] Retrying in %d seconds due to: %s",
+                        dump_count,
+                        backoff_time,
+                        str(ex).split("\n")[0],
+                    )
+                    span.set(**{"retry.cause": _sqlstate(ex) or type(ex).__name__})
+                    time.sleep(backoff_time)
+                    continue
 
-            except Exception:
-                logger.exception("[Dump #%d] Unexpected error", dump_count)
-                break
+                except Exception as ex:
+                    logger.exception("[Dump #%d] Unexpected error", dump_count)
+                    span.fail(ex)
+                    # Do not keep the transaction open, the connection might be needed by another dump
+                    try:
+                        db_client.rollback()
+                    except Exception:
+                        logger.exception("[Dump #%d] Rollback failed", dump_count)
+                    break
 
         return False  # Dump failed
 
@@ -260,45 +1127,299 @@ class DumpExecutor:
 class Floorist:
     def __init__(self, config):
         self.config = config
+        tracing.set_tracer(Tracer.from_config(config))
 
-        s3_client: S3Client = S3Client(config)
-        s3_client.verify()
-        logger.info("Successfully connected to the S3 bucket")
+        sink: Sink = _create_sink(config)
+        sink.verify()
+        if isinstance(sink, S3Client):
+            logger.info("Successfully connected to the S3 bucket")
+        else:
+            logger.info("Writing the dumps into the %s sink", config.sink)
 
-        self.db_client: DatabaseClient = DatabaseClient(config)
+        if config.encode_workers:
+            sink.encoder = ProcessEncoder(config.encode_workers)
+            logger.info("Encoding the parquet files in %d worker processes", config.encode_workers)
+            if config.spill_directory:
+                logger.warning(
+                    "The spill mode encodes its files in place, the workers only encode the partitioned dumps"
+                )
+
+        if config.engine == ENGINE_ASYNCIO:
+            # All the queries run through asyncpg, SQLAlchemy and psycopg2 are not even imported
+            aio.verify_database(config.database())
+            self.db_client = self.databases = None
+        else:
+            self.db_client: DatabaseClient = DatabaseClient(config.database(), TypeConversion.from_config(config))
+            self.db_client.verify()
+            self.databases = DatabaseTargets(config, self.db_client)
         logger.info("Successfully connected to the database")
 
         retry_policy: RetryPolicy = RetryPolicy(MAX_RETRIES, RETRY_DELAY)
-        self.executor = DumpExecutor(s3_client, self.db_client, retry_policy)
+        self.sink = sink
+        profiler = None
+        if config.profile:
+            profiler = DumpProfiler(config.profile, config.profile_directory, sink, config.profile_prefix)
+            logger.info("Profiling the dumps: %s", ", ".join(sorted(config.profile)))
+        self.executor = DumpExecutor(
+            sink,
+            self.db_client,
+            retry_policy,
+            config.spill_directory,
+            databases=self.databases,
+            profiler=profiler,
+            throttle=Throttle.from_config(config),
+            # With the encode workers the next chunk is fetched while the previous ones are encoded
+            in_flight=ENCODE_IN_FLIGHT if config.encode_workers else 0,
+        )
+        self.history = None
+        if config.history_prefix:
+            # Every shard runs different dumps, so the shards keep separate histories
+            name = "history.json" if config.shard_count == 1 else f"history-{config.shard_index}.json"
+            self.history = PerformanceHistory(sink, f"{config.history_prefix.strip('/')}/{name}")
+        self.checkpoint = None
+        if config.checkpoint_prefix:
+            shard = None if config.shard_count == 1 else config.shard_index
+            self.checkpoint = RunCheckpoint(sink, config.checkpoint_prefix, shard)
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args):
-        self.db_client.close()
+        if self.databases is not None:
+            self.databases.close()
+        self.sink.close()
+        if self.sink.encoder is not None:
+            self.sink.encoder.close()
+        tracing.shutdown()
+
+    def run(self, selectors=()):
+        try:
+            floorplan = load_floorplan(self.config.floorplan_filename, selectors)
+        except ValueError:
+            # Nothing has run, but the run fails the same way as with a failed dump
+            logger.exception("Invalid floorplan %s", self.config.floorplan_filename)
+            sys.exit(1)
+        dumps = floorplan.dumps
+        if selectors:
+            logger.info(
+                "Running the selected dumps %s from total of %d", [count for count, _ in dumps], floorplan.total
+            )
+
+        if self.config.shard_count > 1:
+            total = len(dumps)
+            dumps = shard_dumps(dumps, self.config.shard_index, self.config.shard_count)
+            logger.info(
+                "Shard %d of %d running dumps %s from total of %d",
+                self.config.shard_index,
+                self.config.shard_count,
+                [count for count, _ in dumps],
+                total,
+            )
 
-    def run(self):
-        dump_count = 0
-        dumped_count = 0
+        skipped = failed = []
+        if self.checkpoint is not None:
+            dumps, skipped, failed = self._resume(floorplan.fingerprint, dumps)
 
-        with open(self.config.floorplan_filename, "r") as stream:
-            for row in yaml.safe_load(stream):
-                dump_count += 1
+        # The size of the chunks is only recorded in the history and the spans
+        measure_bytes = self.history is not None or tracing.enabled()
+        stats = {count: DumpStats(measure_bytes=measure_bytes) for count, _ in dumps}
+        completed = self._complete if self.checkpoint is not None else None
+        concurrency = self._concurrency()
+        with tracing.span("run", dumps=len(dumps), skipped=len(skipped), engine=self.config.engine) as span:
+            if self.config.engine == ENGINE_ASYNCIO:
+                results = aio.run_dumps(
+                    self.config, self.sink, self.executor.retry_policy, _interleave_targets(dumps), stats, completed
+                )
+            elif concurrency > 1:
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    # Copying the context makes the spans of the dumps children of the span of the run
+                    futures = [
+                        pool.submit(contextvars.copy_context().run, self._execute, row, count, stats[count])
+                        for count, row in _interleave_targets(dumps)
+                    ]
+                    results = [future.result() for future in futures]
+            else:
+                results = [self._execute(row, count, stats[count]) for count, row in dumps]
+            span.set(failed=len(results) - sum(results))
+        results += [True] * len(skipped) + [False] * len(failed)
 
-                if self.executor.execute(row, dump_count):
-                    dumped_count += 1
+        if self.history is not None:
+            try:
+                self.history.record(stats.values())
+            except Exception:
+                # The dumps are done already, the history is not worth failing the run for
+                logger.exception("Recording the performance history failed")
 
+        dump_count = len(results)
+        dumped_count = sum(results)
         logger.info("Dumped %d from total of %d", dumped_count, dump_count)
         if dumped_count != dump_count:
             sys.exit(1)
 
+    def _concurrency(self):
+        if self.config.concurrency > 1 and PROFILE_MEMORY in self.config.profile:
+            # tracemalloc traces the whole process, the dumps running at once would reset the peaks of each other
+            logger.warning("Running the dumps one at a time, the memory of concurrent dumps cannot be profiled")
+            return 1
+
+        return self.config.concurrency
+
+    def _execute(self, row, dump_count, stats):
+        succeeded = self.executor.execute(row, dump_count, stats)
+        if succeeded and self.checkpoint is not None:
+            self._complete(dump_count, row)
+
+        return succeeded
+
+    def _complete(self, dump_count, row):
+        try:
+            self.checkpoint.complete(dump_count, row)
+        except Exception:
+            # The dump is done, a restart would only repeat it
+            logger.exception("[Dump #%d] Recording the dump in the checkpoint failed", dump_count)
+
+    def _resume(self, fingerprint, dumps):
+        try:
+            self.checkpoint.start(fingerprint)
+        except Exception:
+            logger.exception("Reading the checkpoint failed, running all the dumps")
+            self.checkpoint = None
+            return dumps, [], []
+
+        dumps, skipped = self.checkpoint.resume(dumps)
+        if not self.checkpoint.restarted:
+            return dumps, skipped, []
+
+        logger.info(
+            "Resuming the run from %s, skipping the completed dumps %s",
+            self.checkpoint.path,
+            [count for count, _ in skipped],
+        )
+        resumed, failed = [], []
+        for count, row in dumps:
+            try:
+                # The previous attempt might have written a part of the dump already
+                _, target = self.sink.make_path(row["prefix"])
+                self.sink.cleanup(target, cleanup_shards(ParquetOptions.from_row(row)))
+            except (KeyError, TypeError, ValueError):
+                # Invalid rows fail in the executor
+                pass
+            except Exception:
+                logger.exception("[Dump #%d] Cleaning up the output of the previous attempt failed", count)
+                failed.append((count, row))
+                continue
+            resumed.append((count, row))
+
+        return resumed, skipped, failed
+
+
+def _create_sink(config):
+    if config.sink == SINK_LOCAL:
+        return LocalSink(config.sink_directory, use_mmap=config.sink_mmap)
+    if config.sink == SINK_MEMORY:
+        return MemorySink()
+    if config.sink == SINK_NULL:
+        return NullSink()
+
+    return S3Client(config)
+
+
+def _dump_cost(row):
+    try:
+        return max(float(row.get("cost", 1)), 0.0)
+    except (AttributeError, TypeError, ValueError):
+        # Invalid rows fail fast, the executor reports them
+        return 0.0
+
+
+def shard_dumps(dumps, index, count, cost=_dump_cost):
+    """
+    Select the dumps of a single shard, balancing the total cost of the shards.
+
+    The dumps are assigned to the shards from the most expensive one, always to the shard with the lowest cost so
+    far. Every shard computes the same assignment from the same floorplan, so the shards do not need to coordinate.
+    """
+    loads = [0.0] * count
+    selected = []
+    for dump in sorted(dumps, key=lambda dump: (-cost(dump[1]), dump[0])):
+        shard = min(range(count), key=lambda shard: (loads[shard], shard))
+        loads[shard] += cost(dump[1])
+        if shard == index:
+            selected.append(dump)
+
+    return sorted(selected, key=lambda dump: dump[0])
+
+
+def _interleave_targets(dumps):
+    # Alternate between the database targets, so the workers are not all waiting for the connections of one target
+    # while the dumps of the others are queued behind them
+    queues = OrderedDict()
+    for count, row in dumps:
+        target = row.get("database") if isinstance(row, dict) else None
+        queues.setdefault(target, []).append((count, row))
+
+    interleaved = []
+    while queues:
+        for target in list(queues):
+            interleaved.append(queues[target].pop(0))
+            if not queues[target]:
+                del queues[target]
+
+    return interleaved
+
 
 def _configure_loglevel():
     LOGLEVEL = environ.get("LOGLEVEL", "INFO").upper()
     logging.basicConfig(level=LOGLEVEL, format=LOG_FMT)
 
 
-def main():
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"has to be at least 1: {value}")
+    return number
+
+
+def _dump_selector(value):
+    try:
+        return DumpSelector.parse(value)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex)) from ex
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog="floorist", description="Dump the results of SQL queries into parquet files.")
+    parser.add_argument(
+        "dumps",
+        nargs="*",
+        type=_dump_selector,
+        metavar="DUMP",
+        help="run only the selected dumps: a number of a floorplan row (from 1), a range of them (3-7), "
+        "a prefix (with the prefixes nested in it) or a glob of the prefixes (insights/*), all if none given",
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=_positive_int, help="number of dumps running at once, FLOORIST_CONCURRENCY if unset"
+    )
+    parser.add_argument("-l", "--list", action="store_true", help="only list the selected dumps, without running them")
+    return parser.parse_args(argv)
+
+
+def main(argv=()):
+    args = _parse_args(argv)
     _configure_loglevel()
-    with Floorist(get_config()) as f:
-        f.run()
+    config = get_config()
+    if args.concurrency is not None:
+        config.concurrency = args.concurrency
+
+    if args.list:
+        for count, row in load_floorplan(config.floorplan_filename, args.dumps).dumps:
+            prefix = row.get("prefix") if isinstance(row, dict) else None
+            print(f"{count}\t{prefix}")
+        return
+
+    with Floorist(config) as f:
+        f.run(args.dumps)
+
+
+def cli():
+    main(sys.argv[1:])
@@ -0,0 +1,162 @@
+import fnmatch
+import hashlib
+import re
+
+import attr
+import yaml
+from yaml.composer import Composer
+from yaml.events import SequenceEndEvent, SequenceStartEvent, StreamEndEvent
+
+_RANGE = re.compile(r"(\d+)(?:-(\d+))?")
+_GLOB_CHARACTERS = "*?["
+
+# Keys every row of the floorplan has to have
+REQUIRED_KEYS = ("query", "prefix")
+
+# The events come from libyaml if PyYAML was built with it, only composing the rows is done in Python then
+_Parser = yaml.CSafeLoader if yaml.__with_libyaml__ else yaml.SafeLoader
+
+
+class _RowLoader(_Parser, Composer):
+    """Loader composing and constructing the rows of the floorplan one at a time."""
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        Composer.__init__(self)
+
+
+@attr.s(frozen=True)
+class DumpSelector:
+    """
+    Dumps of the floorplan picked on the command line.
+
+    A number selects the dump of the row with the number (counted from 1, as in the logs), and ``first-last`` a
+    range of them. Anything else selects the dumps by their prefix, either as a glob (``insights/*``) or as a path
+    matching the prefix itself and the prefixes nested in it.
+    """
+
+    text = attr.ib()
+    first = attr.ib(default=None)
+    last = attr.ib(default=None)
+    pattern = attr.ib(default=None)
+
+    @classmethod
+    def parse(cls, text):
+        text = text.strip()
+        if not text:
+            raise ValueError("Empty dump selector")
+
+        numbers = _RANGE.fullmatch(text)
+        if numbers:
+            first = int(numbers.group(1))
+            last = int(numbers.group(2) or first)
+            if first < 1 or last < first:
+                raise ValueError(f"Invalid range of dumps '{text}', the dumps are numbered from 1")
+            return cls(text, first=first, last=last)
+
+        return cls(text, pattern=text.strip("/"))
+
+    def matches(self, count, row):
+        if self.pattern is None:
+            return self.first <= count <= self.last
+
+        prefix = row.get("prefix") if isinstance(row, dict) else None
+        if not isinstance(prefix, str):
+            return False
+
+        prefix = prefix.strip("/")
+        if any(character in self.pattern for character in _GLOB_CHARACTERS):
+            return fnmatch.fnmatchcase(prefix, self.pattern)
+
+        return prefix == self.pattern or prefix.startswith(f"{self.pattern}/")
+
+
+@attr.s(frozen=True)
+class Floorplan:
+    """The selected dumps of a floorplan, numbered by their rows, and its fingerprint for the checkpoints."""
+
+    dumps = attr.ib()
+    total = attr.ib()
+    fingerprint = attr.ib()
+
+
+class _HashingReader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.name = getattr(stream, "name", "<file>")
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
+
+
+def load_floorplan(filename, selectors=()):
+    """
+    Parse the floorplan row by row, keeping only the dumps picked by any of the selectors (all without them).
+
+    The rows are parsed one at a time instead of the whole document at once, so the rows left out are dropped right
+    away, and libyaml does the parsing if available. The floorplan has to be a single list of mappings with a
+    ``query`` and a ``prefix``, the rest of a row is only validated by the executor running it. Raises a ValueError
+    for an invalid row, selected or not, and if a selector matches no dump at all, so a mistyped one does not end in
+    a successful run of nothing.
+    """
+    matched = set()
+    dumps = []
+    with open(filename, "rb") as stream:
+        reader = _HashingReader(stream)
+        loader = _RowLoader(reader)
+        try:
+            total = 0
+            for count, row in enumerate(_rows(loader, filename), start=1):
+                total = count
+                _validate_row(filename, count, row)
+                selected = [selector for selector in selectors if selector.matches(count, row)]
+                matched.update(selected)
+                if selected or not selectors:
+                    dumps.append((count, row))
+        finally:
+            loader.dispose()
+
+    unmatched = [selector.text for selector in selectors if selector not in matched]
+    if unmatched:
+        raise ValueError(f"No dump of the floorplan matches: {', '.join(unmatched)}")
+
+    # A partial run keeps its progress apart from the runs of the whole floorplan
+    fingerprint = reader.hash.digest() + "\n".join(selector.text for selector in selectors).encode()
+    return Floorplan(dumps, total, fingerprint)
+
+
+def _validate_row(filename, count, row):
+    # A ValueError like for any other invalid floorplan, the run reports those
+    if isinstance(row, dict):
+        for key in REQUIRED_KEYS:
+            if key not in row:
+                raise ValueError(f"Row #{count} of floorplan {filename} has no '{key}'") from KeyError(key)
+            if not isinstance(row[key], str) or not row[key].strip():
+                raise ValueError(f"The '{key}' of row #{count} of floorplan {filename} has to be a non-empty string")
+        return
+
+    raise ValueError(f"Row #{count} of floorplan {filename} has to be a mapping, not {type(row).__name__}")
+
+
+def _rows(loader, filename):
+    loader.get_event()  # StreamStartEvent
+    if loader.check_event(StreamEndEvent):
+        raise ValueError(f"Floorplan {filename} is empty")
+
+    loader.get_event()  # DocumentStartEvent
+    if not loader.check_event(SequenceStartEvent):
+        raise ValueError(f"Floorplan {filename} has to be a list of dumps\n{loader.peek_event().start_mark}")
+
+    loader.get_event()
+    index = 0
+    while not loader.check_event(SequenceEndEvent):
+        yield loader.construct_document(loader.compose_node(None, index))
+        index += 1
+
+    loader.get_event()
+    loader.get_event()  # DocumentEndEvent
+    if not loader.check_event(StreamEndEvent):
+        raise ValueError(f"Floorplan {filename} has to be a single document\n{loader.peek_event().start_mark}")
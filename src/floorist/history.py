@@ -0,0 +1,152 @@
+import json
+import logging
+import statistics
+from datetime import datetime, timezone
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+# Number of runs kept in the history object, older ones are dropped when a new run is recorded
+HISTORY_RUNS = 60
+
+# The baseline of a dump is the median of its last successful runs, at least a few of them are needed for it
+BASELINE_RUNS = 10
+BASELINE_MIN_RUNS = 3
+
+# A dump regressed when it is this many times slower or larger than its baseline
+REGRESSION_FACTOR = 2.0
+# Differences below these are noise regardless of the factor, e.g. a dump taking 3 seconds instead of 1
+REGRESSION_MIN_DURATION = 60.0
+REGRESSION_MIN_BYTES = 64 * 1024 * 1024
+
+_METRICS = ("duration", "rows", "bytes", "objects", "retries")
+
+
+def memory_size(data):
+    """Size of the chunk in memory, expensive for the columns of Python objects (strings, dicts) that are walked."""
+    return int(data.memory_usage(index=False, deep=True).sum())
+
+
+@attr.s
+class DumpStats:
+    """
+    Performance of a single dump.
+
+    The size of the fetched chunks is only measured with ``measure_bytes``, as it takes longer than converting the
+    chunk into Arrow. ``chunk_bytes`` is the size of the last counted chunk, for the throttle limiting the bytes.
+    """
+
+    prefix = attr.ib(default=None)
+    succeeded = attr.ib(default=False)
+    duration = attr.ib(default=0.0)
+    rows = attr.ib(default=0)
+    bytes = attr.ib(default=0)
+    objects = attr.ib(default=0)
+    retries = attr.ib(default=0)
+    measure_bytes = attr.ib(default=True)
+    chunk_bytes = attr.ib(default=0)
+
+    def reset(self):
+        self.rows = self.bytes = self.objects = 0
+
+    def count(self, chunks):
+        """Pass the fetched chunks through, counting their rows and their size in memory."""
+        for data in chunks:
+            self.add(data)
+            yield data
+
+    def add(self, data):
+        self.rows += len(data)
+        if self.measure_bytes:
+            self.chunk_bytes = memory_size(data)
+            self.bytes += self.chunk_bytes
+
+    def as_record(self):
+        record = {metric: getattr(self, metric) for metric in _METRICS}
+        record["duration"] = round(self.duration, 3)
+        if not self.succeeded:
+            record["failed"] = True
+
+        return record
+
+
+class PerformanceHistory:
+    """
+    Performance records of the previous runs, stored as a single JSON object in the bucket.
+
+    Every run appends a record with the duration, number of rows, size of the fetched data, number of written
+    objects and number of retries of each dump. The dumps are compared to the median of their previous successful
+    runs when a new run is recorded.
+    """
+
+    def __init__(self, sink, path, runs=HISTORY_RUNS):
+        self.sink = sink
+        self.path = path
+        self.runs = runs
+
+    def load(self):
+        body = self.sink.read_object(self.path)
+        if body is None:
+            return []
+
+        try:
+            return json.loads(body)["runs"]
+        except (KeyError, TypeError, ValueError):
+            logger.warning("Ignoring the invalid performance history in %s", self.path)
+            return []
+
+    def record(self, stats):
+        """Compare the dumps of a finished run to their baselines and append the run to the history."""
+        history = self.load()
+        dumps = {s.prefix: s.as_record() for s in stats if s.prefix is not None}
+        regressions = [
+            regression
+            for s in stats
+            if s.prefix is not None and s.succeeded
+            for regression in self.regressions(s, history)
+        ]
+
+        for prefix, metric, value, baseline in regressions:
+            logger.warning(
+                "Performance regression of %s: %s is %s, the baseline of the previous runs is %s",
+                prefix,
+                metric,
+                value,
+                baseline,
+            )
+
+        run = {"started": datetime.now(timezone.utc).isoformat(timespec="seconds"), "dumps": dumps}
+        if regressions:
+            run["regressions"] = [[prefix, metric] for prefix, metric, _, _ in regressions]
+        history = [*history, run][-self.runs :]
+        self.sink.write_object(self.path, json.dumps({"runs": history}, separators=(",", ":")))
+        logger.info("Performance of %d dumps recorded in %s", len(dumps), self.path)
+
+        return regressions
+
+    @staticmethod
+    def baseline(prefix, history):
+        samples = [
+            run["dumps"][prefix]
+            for run in history
+            if prefix in run.get("dumps", {}) and not run["dumps"][prefix].get("failed")
+        ][-BASELINE_RUNS:]
+        if len(samples) < BASELINE_MIN_RUNS:
+            return None
+
+        return {metric: statistics.median(sample.get(metric, 0) for sample in samples) for metric in _METRICS}
+
+    @classmethod
+    def regressions(cls, stats, history):
+        baseline = cls.baseline(stats.prefix, history)
+        if baseline is None:
+            return []
+
+        regressions = []
+        for metric, minimum in (("duration", REGRESSION_MIN_DURATION), ("bytes", REGRESSION_MIN_BYTES)):
+            value = getattr(stats, metric)
+            if value > baseline[metric] * REGRESSION_FACTOR and value - baseline[metric] > minimum:
+                regressions.append((stats.prefix, metric, value, baseline[metric]))
+
+        return regressions
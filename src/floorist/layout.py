@@ -0,0 +1,67 @@
+import json
+import zlib
+
+# Name of the object describing the layout of a sharded dump, readers (Spark, Athena, pyarrow) skip the files
+# starting with an underscore, so it is never mistaken for data
+LAYOUT_OBJECT = "_floorist_layout.json"
+LAYOUT_VERSION = 1
+
+# Hive partition column of the hashed sub-folders of a sharded dump
+SHARD_COLUMN = "key_shard"
+MAX_KEY_SHARDS = 256
+
+
+def shard_prefixes(key_shards):
+    """Names of the ``key_shard=<hex>`` sub-folders the files of a dump are spread over, none if not sharded."""
+    width = len(f"{key_shards - 1:x}") if key_shards else 0
+    return [f"{SHARD_COLUMN}={index:0{width}x}" for index in range(key_shards)]
+
+
+def sharded_name(name, options=None):
+    """
+    Path of a new file relative to its folder.
+
+    With ``key_shards`` the file is placed into one of the hashed sub-folders, so the objects of a dump are spread
+    over as many key prefixes and S3 scales the request rate of each of them separately.
+    """
+    key_shards = options.key_shards if options is not None else 0
+    if not key_shards:
+        return name
+
+    width = len(f"{key_shards - 1:x}")
+    return f"{SHARD_COLUMN}={zlib.crc32(name.encode()) % key_shards:0{width}x}/{name}"
+
+
+def layout_manifest(options):
+    """The layout of a sharded dump as stored next to its files."""
+    return json.dumps(
+        {
+            "version": LAYOUT_VERSION,
+            "key_shards": options.key_shards,
+            "shards": shard_prefixes(options.key_shards),
+            "partition_by": list(options.partition_by),
+        },
+        separators=(",", ":"),
+    )
+
+
+def write_layout(sink, path, options):
+    """Record the layout in the folder of the dump, before any of its files is written."""
+    if options.key_shards:
+        sink.write_object(f"{path}/{LAYOUT_OBJECT}", layout_manifest(options))
+
+
+def read_layout(sink, path):
+    """Return the layout of the dump in the folder as recorded by ``write_layout``, or None if it is not sharded."""
+    body = sink.read_object(f"{path}/{LAYOUT_OBJECT}")
+    return json.loads(body) if body is not None else None
+
+
+def cleanup_shards(options):
+    """
+    Sub-folders of the folder of a dump to clean up separately, in parallel.
+
+    The shards of partitioned dumps are nested in the partitions, which are not known up front, those dumps are
+    cleaned up as a whole.
+    """
+    return [] if options.partition_by else shard_prefixes(options.key_shards)
@@ -0,0 +1,36 @@
+from importlib import import_module
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on the first access of its attributes.
+
+    Submodules that have not been imported by their parent package are imported on access as well, so
+    ``lazy_import("botocore").exceptions`` works the same way as ``import botocore.exceptions`` would.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith("__") and attr.endswith("__"):
+            # Introspection (e.g. by copy or mock) should not trigger the import
+            raise AttributeError(attr)
+
+        module = import_module(self.__name)
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            pass
+
+        try:
+            return import_module(f"{self.__name}.{attr}")
+        except ModuleNotFoundError:
+            raise AttributeError(f"module '{self.__name}' has no attribute '{attr}'") from None
+
+    def __repr__(self):
+        return f"<lazy module '{self.__name}'>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
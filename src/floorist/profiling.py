@@ -0,0 +1,122 @@
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CPU = "cpu"
+PROFILE_MEMORY = "memory"
+PROFILE_KINDS = (PROFILE_CPU, PROFILE_MEMORY)
+
+# Number of functions and allocation sites listed in the text reports
+PROFILE_TOP_ENTRIES = 30
+
+
+class DumpProfiler:
+    """
+    Profiles every dump separately, writing the profiles into files in a local directory or in the bucket.
+
+    The CPU profile is collected by cProfile for the thread running the dump, it is written both as a binary
+    ``.cpu.prof`` file (readable by ``pstats`` or e.g. snakeviz) and as a ``.cpu.txt`` summary. The memory profile
+    in ``.memory.txt`` has the peak of the memory allocated by Python code during the dump (traced by tracemalloc)
+    and the allocation sites that grew the most.
+    """
+
+    def __init__(self, kinds, directory=None, sink=None, prefix=None):
+        self.kinds = frozenset(kinds)
+        self.directory = directory
+        self.sink = sink
+        self.prefix = prefix
+        self.run = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        # Only a single profiler can be active at once since Python 3.12
+        self._cpu_lock = threading.Lock()
+        self._memory_lock = threading.Lock()
+        self._tracing = 0
+
+    @contextmanager
+    def profile(self, dump_count):
+        cpu = self._start_cpu(dump_count) if PROFILE_CPU in self.kinds else None
+        memory = self._start_memory() if PROFILE_MEMORY in self.kinds else None
+        try:
+            yield
+        finally:
+            reports = {}
+            if cpu is not None:
+                cpu.disable()
+                self._cpu_lock.release()
+                reports.update(_cpu_reports(cpu))
+            if memory is not None:
+                reports.update(self._stop_memory(memory, dump_count))
+
+            if reports:
+                try:
+                    self._write(dump_count, reports)
+                except Exception:
+                    # The profile is only a diagnostic aid, the dump itself is not affected
+                    logger.exception("[Dump #%d] Writing the profile failed", dump_count)
+
+    def _start_cpu(self, dump_count):
+        if not self._cpu_lock.acquire(blocking=False):
+            logger.warning("[Dump #%d] Not profiling the CPU, another dump is being profiled", dump_count)
+            return None
+
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _start_memory(self):
+        with self._memory_lock:
+            if self._tracing == 0:
+                tracemalloc.start()
+            self._tracing += 1
+            tracemalloc.reset_peak()
+
+        return tracemalloc.take_snapshot()
+
+    def _stop_memory(self, start, dump_count):
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        with self._memory_lock:
+            self._tracing -= 1
+            if self._tracing == 0:
+                tracemalloc.stop()
+
+        logger.info("[Dump #%d] Peak of traced memory %.1f MiB", dump_count, peak / 2**20)
+        lines = [
+            f"Peak of traced memory: {peak / 2**20:.1f} MiB",
+            "",
+            "Allocation sites by the growth of their allocated memory during the dump:",
+        ]
+        lines.extend(str(stat) for stat in snapshot.compare_to(start, "lineno")[:PROFILE_TOP_ENTRIES])
+        return {"memory.txt": "\n".join(lines).encode() + b"\n"}
+
+    def _write(self, dump_count, reports):
+        if self.directory:
+            os.makedirs(os.path.join(self.directory, self.run), exist_ok=True)
+
+        for suffix, body in reports.items():
+            name = f"{self.run}/dump-{dump_count}.{suffix}"
+            if self.directory:
+                with open(os.path.join(self.directory, name), "wb") as stream:
+                    stream.write(body)
+            if self.prefix:
+                self.sink.write_object(f"{self.prefix.strip('/')}/{name}", body)
+
+        logger.info("[Dump #%d] Profile written as %s/dump-%d.*", dump_count, self.run, dump_count)
+
+
+def _cpu_reports(profile):
+    profile.create_stats()
+    # The same format as written by Profile.dump_stats, without going through a local file
+    binary = marshal.dumps(profile.stats)
+
+    summary = io.StringIO()
+    pstats.Stats(profile, stream=summary).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_ENTRIES)
+    return {"cpu.prof": binary, "cpu.txt": summary.getvalue().encode()}
@@ -0,0 +1,231 @@
+import abc
+import mmap
+import os
+import shutil
+import threading
+from concurrent.futures import Future
+from datetime import date
+from os import W_OK, access
+from uuid import uuid4
+
+from floorist import tracing
+from floorist.encoding import encode_table
+from floorist.layout import sharded_name
+from floorist.lazy import lazy_import
+from floorist.spill import PARQUET_EXTENSION
+
+pa = lazy_import("pyarrow")
+
+SINK_S3 = "s3"
+SINK_LOCAL = "local"
+SINK_MEMORY = "memory"
+SINK_NULL = "null"
+SINKS = (SINK_S3, SINK_LOCAL, SINK_MEMORY, SINK_NULL)
+
+# Folders of the dumps by the day of the run, the same for all the sinks
+DATE_PATH_FORMAT = "year_created=%Y/month_created=%-m/day_created=%-d"
+
+
+def encode_parquet(data, options=None):
+    """Encode a chunk into a parquet file in memory, with the same settings awswrangler uses for S3."""
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    return encode_table(table, options.writer_kwargs(table.column_names) if options is not None else {})
+
+
+def _completed(result=None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class Sink(abc.ABC):
+    """
+    Destination of the dumps, the executor and the writers only talk to the bucket through this interface.
+
+    Paths are relative to the root of the sink and are the same for all of them, targets are the sink specific
+    locations of the folders (e.g. ``s3://`` URLs) returned by ``make_path``.
+    """
+
+    # Number of the spilled files uploaded in parallel
+    upload_concurrency = 1
+    # ProcessEncoder encoding the parquet files in worker processes, they are encoded in place without it
+    encoder = None
+
+    def verify(self):
+        """Fail early if the sink is not usable."""
+
+    def make_path(self, prefix):
+        """Return the path and the target of the folder of a dump from today."""
+        # The local date is intentional, the same as for the S3 bucket
+        path = f"{prefix}/{date.today().strftime(DATE_PATH_FORMAT)}"
+        return path, self._target(path)
+
+    @abc.abstractmethod
+    def write_parquet(self, data, target, path, options=None):
+        """Write a chunk into a new file in the target folder, or just create the folder for an empty chunk."""
+
+    def encode(self, data, options=None):
+        """Encode a chunk into a parquet file in memory."""
+        with tracing.span("encode", rows=len(data), workers=self.encoder is not None) as span:
+            body = encode_parquet(data, options) if self.encoder is None else self.encoder.encode(data, options)
+            span.set(bytes=len(body))
+
+        return body
+
+    @abc.abstractmethod
+    def upload_file(self, filename, path):
+        """Start storing a local file under the path, returns a future of the upload. The file may be moved."""
+
+    @abc.abstractmethod
+    def read_object(self, path):
+        """Return the content stored under the path, or None if there is none."""
+
+    @abc.abstractmethod
+    def write_object(self, path, body):
+        """Store the content under the path, replacing the previous one."""
+
+    @abc.abstractmethod
+    def cleanup(self, target, shards=()):
+        """
+        Remove everything written into the target folder.
+
+        ``shards`` are the sub-folders of a sharded dump (see ``floorist.layout``), for sinks that can clean them up
+        faster separately.
+        """
+
+    def close(self):
+        pass
+
+    def _target(self, path):
+        return path
+
+
+class LocalSink(Sink):
+    """
+    Writes the dumps into a local directory, e.g. a mounted volume synced to the bucket out of band.
+
+    The layout of the directory is the same as the layout of the bucket. Every file is written under a temporary
+    name and renamed when it is complete, so a sync running at the same time never picks up a partial file. With
+    ``use_mmap`` the encoded files are copied into memory mapped files instead of being written through a stream.
+    """
+
+    def __init__(self, directory, use_mmap=False):
+        self.directory = directory
+        self.use_mmap = use_mmap
+
+    def verify(self):
+        if not os.path.isdir(self.directory) or not access(self.directory, W_OK):
+            raise OSError(f"Output directory '{self.directory}' does not exist or is not writable")
+
+    def write_parquet(self, data, target, path, options=None):
+        if len(data) > 0:
+            name = sharded_name(f"{uuid4().hex}{PARQUET_EXTENSION}", options)
+            self._write(os.path.join(target, name), self.encode(data, options))
+        else:
+            os.makedirs(target, exist_ok=True)
+
+    def upload_file(self, filename, path):
+        destination = self._target(path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temporary = self._temporary(destination)
+        shutil.move(filename, temporary)
+        os.replace(temporary, destination)
+        return _completed()
+
+    def read_object(self, path):
+        try:
+            with open(self._target(path), "rb") as stream:
+                return stream.read()
+        except FileNotFoundError:
+            return None
+
+    def write_object(self, path, body):
+        self._write(self._target(path), body.encode() if isinstance(body, str) else body)
+
+    def cleanup(self, target, shards=()):
+        shutil.rmtree(target, ignore_errors=True)
+
+    def _target(self, path):
+        return os.path.join(self.directory, path.lstrip("/"))
+
+    @staticmethod
+    def _temporary(filename):
+        directory, name = os.path.split(filename)
+        return os.path.join(directory, f".{name}.{uuid4().hex}.tmp")
+
+    def _write(self, filename, body):
+        with tracing.span("upload", **{"object.key": filename}, bytes=len(body)):
+            self._write_file(filename, body)
+
+    def _write_file(self, filename, body):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temporary = self._temporary(filename)
+        size = len(body)
+        with open(temporary, "wb+") as stream:
+            if self.use_mmap and size:
+                stream.truncate(size)
+                with mmap.mmap(stream.fileno(), size) as mapped:
+                    mapped[:] = memoryview(body)
+                    mapped.flush()
+            else:
+                stream.write(body)
+        os.replace(temporary, filename)
+
+
+class MemorySink(Sink):
+    """
+    Keeps the written objects in memory, keyed by their path under the bucket. Meant for tests and benchmarks.
+
+    The parquet files are encoded the same way as for the other sinks, so the objects can be read back as they
+    would be from the bucket.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def write_parquet(self, data, target, path, options=None):
+        if len(data) > 0:
+            name = sharded_name(f"{uuid4().hex}{PARQUET_EXTENSION}", options)
+            self._store(f"{target}/{name}", self.encode(data, options).to_pybytes())
+        else:
+            self._store(f"{path.rstrip('/')}/", b"")
+
+    def upload_file(self, filename, path):
+        with open(filename, "rb") as stream:
+            self._store(path, stream.read())
+        return _completed()
+
+    def read_object(self, path):
+        return self.objects.get(path)
+
+    def write_object(self, path, body):
+        self._store(path, body.encode() if isinstance(body, str) else bytes(body))
+
+    def cleanup(self, target, shards=()):
+        with self._lock:
+            for key in [key for key in self.objects if key.startswith(f"{target}/")]:
+                del self.objects[key]
+
+    def _store(self, key, body):
+        with self._lock:
+            self.objects[key] = body
+
+
+class NullSink(MemorySink):
+    """
+    Encodes the parquet files like the other sinks, but discards them.
+
+    Benchmarks with this sink measure the extraction from the database and the encoding without any upload cost.
+    Only the number and the total size of the discarded objects are kept.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.size = 0
+
+    def _store(self, key, body):
+        with self._lock:
+            self.count += 1
+            self.size += len(body)
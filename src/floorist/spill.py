@@ -0,0 +1,156 @@
+import logging
+import os
+from collections import deque
+from tempfile import mkstemp
+from uuid import uuid4
+
+from floorist.layout import sharded_name
+from floorist.lazy import lazy_import
+
+pa = lazy_import("pyarrow")
+pd = lazy_import("pandas")
+pq = lazy_import("pyarrow.parquet")
+
+logger = logging.getLogger(__name__)
+
+# Number of rows fetched from the database at once when spilling, chunks larger than this are assembled on disk
+SPILL_BATCH_SIZE = 1000
+# Largest number of rows of a row group of the spilled files, the batches are buffered until there are as many
+SPILL_ROW_GROUP_SIZE = 100000
+
+# The same settings awswrangler uses for the files it writes, so the spilled files are indistinguishable
+PARQUET_COMPRESSION = "gzip"
+PARQUET_EXTENSION = ".gz.parquet"
+PARQUET_WRITER_ARGS = {
+    "coerce_timestamps": "ms",
+    "flavor": "spark",
+    "version": "1.0",
+    "use_dictionary": True,
+    "write_statistics": True,
+}
+
+
+class SpillWriter:
+    """
+    Assembles the parquet files of a dump in a local directory and uploads the finished ones in the background.
+
+    The fetched batches are buffered until they fill a row group of ``rows_per_file`` rows, at most
+    ``SPILL_ROW_GROUP_SIZE`` of them, which is sorted and appended to the current file. A new file is started after
+    ``rows_per_file`` rows. This keeps only a single row group in memory regardless of the size of the files. The
+    number of files waiting for their upload is limited, the writer blocks until the oldest upload finishes when
+    the limit is hit.
+    """
+
+    def __init__(self, sink, directory, path, target, options, rows_per_file, dump_count):
+        self.sink = sink
+        self.directory = directory
+        self.path = path
+        self.target = target
+        self.options = options
+        self.rows_per_file = rows_per_file
+        self.dump_count = dump_count
+        self.files = 0
+        self.max_pending = max(2 * sink.upload_concurrency, 1)
+        self.row_group_size = min(rows_per_file or SPILL_ROW_GROUP_SIZE, SPILL_ROW_GROUP_SIZE)
+        self._pending = deque()
+        self._writer = None
+        self._filename = None
+        self._rows = 0
+        self._batches = []
+        self._buffered = 0
+
+    def write(self, data):
+        if len(data) == 0:
+            return
+
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        schema = self._batches[0].schema if self._batches else getattr(self._writer, "schema", None)
+        if schema is not None and not table.schema.equals(schema):
+            try:
+                table = table.cast(schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                # The types inferred from this batch are not compatible with the current file
+                self._finish_file()
+
+        self._batches.append(table)
+        self._buffered += len(table)
+        if self._buffered >= self.row_group_size:
+            self._write_row_group()
+        if self.rows_per_file and self._rows >= self.rows_per_file:
+            self._finish_file()
+
+    def close(self):
+        self._finish_file()
+        while self._pending:
+            self._wait_for_upload()
+
+        if not self.files:
+            self.sink.write_parquet(pd.DataFrame(), self.target, self.path, self.options)
+            logger.info("[Dump #%d] Empty folder created for empty result", self.dump_count)
+
+    def abort(self):
+        self._batches = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.remove(self._filename)
+
+        while self._pending:
+            future, filename = self._pending.popleft()
+            future.cancel()
+            try:
+                future.result()
+            except Exception:
+                # The dump is failing already, the caller reports the original error
+                logger.debug("[Dump #%d] Upload of %s aborted", self.dump_count, filename, exc_info=True)
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def _write_row_group(self):
+        if not self._batches:
+            return
+
+        table = self.options.sort_table(pa.concat_tables(self._batches))
+        self._batches = []
+        self._buffered = 0
+        if self._writer is None:
+            self._open_file(table)
+        self._writer.write_table(table, row_group_size=len(table))
+        self._rows += len(table)
+
+    def _open_file(self, table):
+        fd, self._filename = mkstemp(suffix=PARQUET_EXTENSION, dir=self.directory)
+        os.close(fd)
+        self._writer = pq.ParquetWriter(
+            self._filename,
+            table.schema,
+            compression=PARQUET_COMPRESSION,
+            **PARQUET_WRITER_ARGS,
+            **self.options.writer_kwargs(table.column_names),
+        )
+
+    def _finish_file(self):
+        self._write_row_group()
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._writer = None
+        self._rows = 0
+        self.files += 1
+        logger.info("[Dump #%d] Written parquet chunk #%d", self.dump_count, self.files)
+
+        name = sharded_name(f"{uuid4().hex}{PARQUET_EXTENSION}", self.options)
+        key = f"{self.path}/{name}"
+        self._pending.append((self.sink.upload_file(self._filename, key), self._filename))
+        while len(self._pending) > self.max_pending:
+            self._wait_for_upload()
+
+    def _wait_for_upload(self):
+        future, filename = self._pending[0]
+        future.result()
+        self._pending.popleft()
+        # Sinks writing to a local directory move the file instead of copying it
+        if os.path.exists(filename):
+            os.remove(filename)
+        logger.debug("[Dump #%d] Uploaded %s", self.dump_count, filename)
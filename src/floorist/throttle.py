@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from functools import partial
+
+from floorist.history import memory_size
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the checks of the load of the source database
+THROTTLE_CHECK_INTERVAL = 10
+# Seconds a dump stays paused at most, it holds its transaction open while paused
+THROTTLE_MAX_PAUSE = 600
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the average rate of rows or bytes fetched, shared by any number of threads.
+
+    Up to a second worth of the rate can be fetched at once. A chunk larger than the available tokens is fetched
+    anyway and the debt is paid by waiting before the next one, so the average rate holds for any chunk size.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._available = self.rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.rate, self._available + (now - self._updated) * self.rate) - amount
+            self._updated = now
+            delay = -self._available / self.rate if self._available < 0 else 0.0
+
+        if delay > 0:
+            time.sleep(delay)
+
+        return delay
+
+
+class Throttle:
+    """
+    Slows the fetching of the dumps down to protect the source databases.
+
+    The rows and bytes fetched are limited per dump (configurable per floorplan row) and for the whole run. Before
+    fetching the next chunk, the replication lag and the number of active connections of the database host are
+    checked (at most every ``check_interval`` seconds), and the dump pauses while any of them is over its limit.
+    A dump paused for longer than ``max_pause`` seconds fails, releasing its transaction.
+    """
+
+    def __init__(
+        self,
+        rows_per_second=None,
+        bytes_per_second=None,
+        run_rows_per_second=None,
+        run_bytes_per_second=None,
+        max_replication_lag=None,
+        max_active_connections=None,
+        check_interval=THROTTLE_CHECK_INTERVAL,
+        max_pause=THROTTLE_MAX_PAUSE,
+    ):
+        self.rows_per_second = rows_per_second
+        self.bytes_per_second = bytes_per_second
+        self.run_rows = RateLimiter(run_rows_per_second) if run_rows_per_second else None
+        self.run_bytes = RateLimiter(run_bytes_per_second) if run_bytes_per_second else None
+        self.max_replication_lag = max_replication_lag
+        self.max_active_connections = max_active_connections
+        self.check_interval = check_interval
+        self.max_pause = max_pause
+
+    @classmethod
+    def from_config(cls, config):
+        throttle = cls(
+            config.max_rows_per_second,
+            config.max_bytes_per_second,
+            config.run_max_rows_per_second,
+            config.run_max_bytes_per_second,
+            config.max_replication_lag,
+            config.max_active_connections,
+            config.throttle_check_interval,
+            config.throttle_max_pause,
+        )
+        return throttle if throttle.enabled else None
+
+    @property
+    def enabled(self):
+        return any(
+            limit is not None
+            for limit in (
+                self.rows_per_second,
+                self.bytes_per_second,
+                self.run_rows,
+                self.run_bytes,
+                self.max_replication_lag,
+                self.max_active_connections,
+            )
+        )
+
+    def for_dump(self, row, db_client, dump_count):
+        """Return a function throttling the chunks fetched by a single dump."""
+        rows_per_second = row.get("max_rows_per_second", self.rows_per_second)
+        bytes_per_second = row.get("max_bytes_per_second", self.bytes_per_second)
+        rows = [self.run_rows] if self.run_rows else []
+        size = [self.run_bytes] if self.run_bytes else []
+        if rows_per_second:
+            rows.append(RateLimiter(float(rows_per_second)))
+        if bytes_per_second:
+            size.append(RateLimiter(float(bytes_per_second)))
+
+        if not rows and not size and not self._checks_load:
+            return None
+        return partial(self._throttle, db_client=db_client, dump_count=dump_count, rows=rows, size=size)
+
+    @property
+    def _checks_load(self):
+        return self.max_replication_lag is not None or self.max_active_connections is not None
+
+    def _throttle(self, chunks, db_client, dump_count, rows, size, stats=None):
+        if size and stats is not None:
+            # The chunks are counted before they get here, so their size is measured once for both
+            stats.measure_bytes = True
+        for data in chunks:
+            for limiter in rows:
+                limiter.acquire(len(data))
+            if size:
+                nbytes = memory_size(data) if stats is None else stats.chunk_bytes
+                for limiter in size:
+                    limiter.acquire(nbytes)
+            if self._checks_load:
+                self._wait_for_load(db_client, dump_count)
+            yield data
+
+    def _wait_for_load(self, db_client, dump_count):
+        paused = None
+        while True:
+            lag, active = db_client.load(self.check_interval)
+            reasons = []
+            if self.max_replication_lag is not None and lag is not None and lag > self.max_replication_lag:
+                reasons.append(f"replication lag {lag:.0f}s")
+            if self.max_active_connections is not None and active > self.max_active_connections:
+                reasons.append(f"{active} active connections")
+
+            if not reasons:
+                if paused is not None:
+                    logger.info("[Dump #%d] Resuming after %.0f seconds", dump_count, time.monotonic() - paused)
+                return
+
+            if paused is None:
+                paused = time.monotonic()
+                logger.warning("[Dump #%d] Pausing, the source database is over the limit: %s", dump_count, reasons)
+            elif time.monotonic() - paused >= self.max_pause:
+                raise TimeoutError(
+                    f"Paused for more than {self.max_pause:.0f} seconds, the source database is over the limit: "
+                    f"{reasons}"
+                )
+            time.sleep(self.check_interval)
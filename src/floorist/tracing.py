@@ -0,0 +1,269 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "floorist"
+
+# Spans kept in memory until the end of the run, the ones over the limit are dropped
+MAX_SPANS = 100000
+
+# Seconds to wait for the collector when exporting the spans
+EXPORT_TIMEOUT = 10
+
+# Status codes of the OTLP spans
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+# Kind of the OTLP spans, all of them are internal
+_SPAN_KIND_INTERNAL = 1
+
+_tracer = None
+_current = contextvars.ContextVar("floorist_span", default=None)
+
+
+@attr.s
+class Span:
+    name = attr.ib()
+    trace_id = attr.ib()
+    span_id = attr.ib()
+    parent_id = attr.ib()
+    start = attr.ib()
+    end = attr.ib(default=None)
+    attributes = attr.ib(factory=dict)
+    error = attr.ib(default=None)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, name, value=1):
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def fail(self, ex):
+        message = str(ex).split("\n")[0]
+        self.error = f"{type(ex).__name__}: {message}"
+
+    def as_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": _SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": _STATUS_OK} if self.error is None else {"code": _STATUS_ERROR, "message": self.error},
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+
+        return span
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def add(self, name, value=1):
+        pass
+
+    def fail(self, ex):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Collects the spans of a run, all of them in a single trace, and exports them when the run ends.
+
+    The spans are nested by the context they are started in, so the spans started in a thread or a task are only
+    children of the span that started it if the context is copied along (``contextvars.copy_context``).
+    """
+
+    def __init__(self, exporters, max_spans=MAX_SPANS):
+        self.exporters = exporters
+        self.max_spans = max_spans
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        exporters = []
+        if config.trace_file:
+            exporters.append(JsonFileExporter(config.trace_file))
+        if config.trace_endpoint:
+            exporters.append(OtlpExporter(config.trace_endpoint))
+
+        return cls(exporters) if exporters else None
+
+    def start(self, name, attributes, start=None):
+        parent = _current.get()
+        return Span(
+            name,
+            self.trace_id,
+            os.urandom(8).hex(),
+            None if parent is None else parent.span_id,
+            time.time_ns() if start is None else start,
+            attributes=attributes,
+        )
+
+    def finish(self, span):
+        span.end = time.time_ns()
+        with self._lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def export(self):
+        with self._lock:
+            spans, self.spans = self.spans, []
+        if self.dropped:
+            logger.warning("Dropped %d spans over the limit of %d", self.dropped, self.max_spans)
+        if not spans:
+            return
+
+        payload = _otlp_payload(spans)
+        for exporter in self.exporters:
+            try:
+                exporter.export(payload)
+            except Exception:
+                # The dumps are done already, the trace is not worth failing the run for
+                logger.exception("Exporting the trace to %s failed", exporter)
+            else:
+                logger.info("Exported %d spans of trace %s to %s", len(spans), self.trace_id, exporter)
+
+
+class JsonFileExporter:
+    """Writes the spans into a local file as an OTLP/JSON trace, e.g. for ``otel-cli`` or a collector to pick up."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, payload):
+        with open(self.path, "w") as stream:
+            json.dump(payload, stream, separators=(",", ":"))
+
+    def __str__(self):
+        return self.path
+
+
+class OtlpExporter:
+    """Sends the spans to an OpenTelemetry collector over OTLP/HTTP with the JSON encoding."""
+
+    def __init__(self, endpoint, timeout=EXPORT_TIMEOUT):
+        endpoint = endpoint.rstrip("/")
+        self.url = endpoint if endpoint.endswith("/v1/traces") else f"{endpoint}/v1/traces"
+        self.timeout = timeout
+
+    def export(self, payload):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload, separators=(",", ":")).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def __str__(self):
+        return self.url
+
+
+def _otlp_payload(spans):
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": [span.as_otlp() for span in spans]}],
+            }
+        ]
+    }
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+
+    return {"stringValue": str(value)}
+
+
+def set_tracer(tracer):
+    global _tracer
+    _tracer = tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def shutdown():
+    """Export the spans of the run and stop tracing."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.export()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Trace the block as a child of the current span, the span is marked as failed if the block raises."""
+    tracer = _tracer
+    if tracer is None:
+        yield _NOOP_SPAN
+        return
+
+    traced = tracer.start(name, attributes)
+    token = _current.set(traced)
+    try:
+        yield traced
+    except BaseException as ex:
+        traced.fail(ex)
+        raise
+    finally:
+        _current.reset(token)
+        tracer.finish(traced)
+
+
+def current():
+    """The span of the current context, to add attributes to it from deeper down."""
+    return _current.get() or _NOOP_SPAN
+
+
+def batches(chunks, name="fetch"):
+    """Pass the chunks through, tracing the time each of them took to produce as a span with its number of rows."""
+    tracer = _tracer
+    if tracer is None:
+        yield from chunks
+        return
+
+    iterator = iter(chunks)
+    batch = 1
+    while True:
+        started = time.time_ns()
+        try:
+            data = next(iterator)
+        except StopIteration:
+            return
+        tracer.finish(tracer.start(name, {"batch": batch, "rows": len(data)}, start=started))
+        batch += 1
+        yield data
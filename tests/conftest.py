@@ -0,0 +1,13 @@
+import pytest
+import yaml
+
+
+@pytest.fixture
+def env_settings(monkeypatch):
+    """Set the environment variables of tests/env.yaml.example, the standalone tests do not reach the services."""
+    with open("tests/env.yaml.example", "r") as stream:
+        settings = yaml.safe_load(stream)
+    for key in settings:
+        monkeypatch.setenv(key, settings[key])
+
+    return settings
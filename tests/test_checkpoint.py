@@ -0,0 +1,119 @@
+import json
+import logging
+from datetime import date
+from unittest.mock import Mock
+
+import pytest
+
+from floorist.checkpoint import RunCheckpoint
+from floorist.floorist import Floorist
+from floorist.sinks import MemorySink
+
+_FLOORPLAN = [
+    {"prefix": "a", "query": "SELECT 1"},
+    {"prefix": "b", "query": "SELECT 2"},
+    {"prefix": "c", "query": "SELECT 3"},
+]
+
+
+def _floorist(tmp_path, sink, floorplan=_FLOORPLAN):
+    path = tmp_path / "floorplan.yaml"
+    path.write_text(json.dumps(floorplan))
+    floorist = Floorist.__new__(Floorist)
+    floorist.config = Mock(floorplan_filename=str(path), concurrency=1, shard_count=1, engine="threads")
+    floorist.sink = sink
+    floorist.executor = Mock()
+    floorist.executor.execute.return_value = True
+    floorist.history = None
+    floorist.checkpoint = RunCheckpoint(sink, "checkpoints/")
+    return floorist
+
+
+def _executed(floorist):
+    return [call.args[1] for call in floorist.executor.execute.call_args_list]
+
+
+@pytest.mark.standalone
+class TestRunCheckpoint:
+    def test_named_after_the_day_and_the_floorplan(self):
+        sink = MemorySink()
+        checkpoint = RunCheckpoint(sink, "/checkpoints/", shard=2)
+
+        checkpoint.start(b"- prefix: a", day=date(2026, 6, 3))
+
+        assert checkpoint.path.startswith("checkpoints/2026-06-03-")
+        assert checkpoint.path.endswith("-2.json")
+        assert json.loads(sink.objects[checkpoint.path]) == {"completed": {}}
+        assert checkpoint.restarted is False
+
+    def test_first_attempt_runs_and_records_all_the_dumps(self, tmp_path):
+        sink = MemorySink()
+        floorist = _floorist(tmp_path, sink)
+
+        floorist.run()
+
+        assert _executed(floorist) == [1, 2, 3]
+        completed = json.loads(sink.objects[floorist.checkpoint.path])["completed"]
+        assert sorted(completed) == ["1", "2", "3"]
+        assert completed["2"]["prefix"] == "b"
+
+    def test_restart_skips_the_completed_dumps(self, tmp_path, caplog):
+        caplog.set_level(logging.INFO)
+        sink = MemorySink()
+        first = _floorist(tmp_path, sink)
+        first.executor.execute.side_effect = [True, False, True]
+        with pytest.raises(SystemExit):
+            first.run()
+        # The partial output of the failed dump
+        path, _ = sink.make_path("b")
+        sink.write_object(f"{path}/partial.gz.parquet", b"data")
+
+        second = _floorist(tmp_path, sink)
+        second.run()
+
+        assert _executed(second) == [2]
+        assert not any(key.startswith("b/") for key in sink.objects)
+        assert "skipping the completed dumps [1, 3]" in caplog.text
+        assert "Dumped 3 from total of 3" in caplog.text
+
+    def test_completed_dumps_sharing_a_prefix_are_repeated(self, tmp_path):
+        sink = MemorySink()
+        floorplan = [*_FLOORPLAN, {"prefix": "a", "query": "SELECT 4"}]
+        first = _floorist(tmp_path, sink, floorplan)
+        first.executor.execute.side_effect = [True, True, True, False]
+        with pytest.raises(SystemExit):
+            first.run()
+
+        second = _floorist(tmp_path, sink, floorplan)
+        second.run()
+
+        assert _executed(second) == [1, 4]
+
+    def test_changed_floorplan_starts_from_scratch(self, tmp_path):
+        sink = MemorySink()
+        _floorist(tmp_path, sink).run()
+
+        changed = _floorist(tmp_path, sink, [*_FLOORPLAN, {"prefix": "d", "query": "SELECT 4"}])
+        changed.run()
+
+        assert _executed(changed) == [1, 2, 3, 4]
+
+    def test_failing_checkpoint_does_not_fail_the_run(self, tmp_path, caplog):
+        sink = Mock()
+        sink.read_object.side_effect = RuntimeError("boom")
+        floorist = _floorist(tmp_path, sink)
+
+        floorist.run()
+
+        assert _executed(floorist) == [1, 2, 3]
+        assert "Reading the checkpoint failed, running all the dumps" in caplog.text
+
+    def test_invalid_checkpoint_is_ignored(self, tmp_path, caplog):
+        sink = MemorySink()
+        checkpoint = RunCheckpoint(sink, "checkpoints")
+        checkpoint.start(b"[]")
+        sink.write_object(checkpoint.path, "[]")
+
+        RunCheckpoint(sink, "checkpoints").start(b"[]")
+
+        assert "Ignoring the invalid checkpoint" in caplog.text
@@ -0,0 +1,281 @@
+from os import environ
+
+import pytest
+
+from floorist.config import DatabaseConfig, get_config
+
+
+@pytest.mark.standalone
+class TestDatabaseTargets:
+    @pytest.fixture(autouse=True)
+    def setup_env(self, env_settings, monkeypatch):
+        for key in [key for key in environ if key.startswith("FLOORIST_DATABASE")]:
+            monkeypatch.delenv(key)
+
+    def test_default_target_only(self):
+        config = get_config()
+        assert config.databases == {}
+        assert config.database() == DatabaseConfig(
+            hostname=environ["POSTGRES_SERVICE_HOST"],
+            name=environ["POSTGRESQL_DATABASE"],
+            username=environ["POSTGRESQL_USER"],
+            password=environ["POSTGRESQL_PASSWORD"],
+            max_connections=1,
+        )
+
+    def test_named_targets(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_DATABASES", "inventory, host-based")
+        monkeypatch.setenv("FLOORIST_DATABASE_MAX_CONNECTIONS", "2")
+        for prefix in ("FLOORIST_DATABASE_INVENTORY_", "FLOORIST_DATABASE_HOST_BASED_"):
+            monkeypatch.setenv(f"{prefix}HOST", f"{prefix}host")
+            monkeypatch.setenv(f"{prefix}NAME", f"{prefix}name")
+            monkeypatch.setenv(f"{prefix}USER", f"{prefix}user")
+            monkeypatch.setenv(f"{prefix}PASSWORD", f"{prefix}password")
+        monkeypatch.setenv("FLOORIST_DATABASE_INVENTORY_MAX_CONNECTIONS", "3")
+
+        config = get_config()
+
+        assert sorted(config.databases) == ["host-based", "inventory"]
+        assert config.database("inventory").hostname == "FLOORIST_DATABASE_INVENTORY_host"
+        assert config.database("inventory").max_connections == 3
+        assert config.database("host-based").password == "FLOORIST_DATABASE_HOST_BASED_password"
+        assert config.database("host-based").max_connections == 1
+        assert config.database("default").max_connections == 2
+
+    def test_replicas(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_DATABASE_REPLICAS", "standby-1, standby-2:5433")
+        monkeypatch.setenv("FLOORIST_DATABASE_MAX_REPLICA_LAG", "60")
+        monkeypatch.setenv("FLOORIST_DATABASES", "inventory")
+        for name in ("HOST", "NAME", "USER", "PASSWORD"):
+            monkeypatch.setenv(f"FLOORIST_DATABASE_INVENTORY_{name}", "value")
+        monkeypatch.setenv("FLOORIST_DATABASE_INVENTORY_REPLICAS", "inventory-standby")
+        monkeypatch.setenv("FLOORIST_DATABASE_INVENTORY_ALLOW_PRIMARY", "true")
+
+        config = get_config()
+
+        assert config.database().replicas == ["standby-1", "standby-2:5433"]
+        assert config.database().max_replica_lag == 60
+        assert config.database().allow_primary is False
+        assert config.database("inventory").replicas == ["inventory-standby"]
+        assert config.database("inventory").allow_primary is True
+
+    @pytest.mark.parametrize("key", ["HOST", "NAME", "USER", "PASSWORD"])
+    def test_incomplete_named_target(self, monkeypatch, key):
+        monkeypatch.setenv("FLOORIST_DATABASES", "inventory")
+        for name in ("HOST", "NAME", "USER", "PASSWORD"):
+            if name != key:
+                monkeypatch.setenv(f"FLOORIST_DATABASE_INVENTORY_{name}", "value")
+
+        with pytest.raises(ValueError, match="not defined for target 'inventory'"):
+            get_config()
+
+    def test_default_target_name_is_reserved(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_DATABASES", "default")
+        with pytest.raises(ValueError, match="reserved"):
+            get_config()
+
+
+@pytest.mark.standalone
+class TestSharding:
+    @pytest.fixture(autouse=True)
+    def setup_env(self, env_settings, monkeypatch):
+        for key in ("FLOORIST_SHARD_INDEX", "FLOORIST_SHARD_COUNT", "JOB_COMPLETION_INDEX"):
+            monkeypatch.delenv(key, raising=False)
+
+    def test_single_shard_by_default(self):
+        config = get_config()
+        assert (config.shard_index, config.shard_count) == (0, 1)
+
+    def test_index_from_indexed_job(self, monkeypatch):
+        monkeypatch.setenv("JOB_COMPLETION_INDEX", "2")
+        monkeypatch.setenv("FLOORIST_SHARD_COUNT", "3")
+        config = get_config()
+        assert (config.shard_index, config.shard_count) == (2, 3)
+
+    def test_explicit_index_wins(self, monkeypatch):
+        monkeypatch.setenv("JOB_COMPLETION_INDEX", "2")
+        monkeypatch.setenv("FLOORIST_SHARD_INDEX", "0")
+        monkeypatch.setenv("FLOORIST_SHARD_COUNT", "3")
+        assert get_config().shard_index == 0
+
+    def test_index_out_of_range(self, monkeypatch):
+        monkeypatch.setenv("JOB_COMPLETION_INDEX", "3")
+        monkeypatch.setenv("FLOORIST_SHARD_COUNT", "3")
+        with pytest.raises(ValueError, match="Shard index must be between 0 and 2"):
+            get_config()
+
+
+@pytest.mark.standalone
+class TestProfiling:
+    @pytest.fixture(autouse=True)
+    def setup_env(self, env_settings, monkeypatch):
+        for key in ("FLOORIST_PROFILE", "FLOORIST_PROFILE_DIR", "FLOORIST_PROFILE_PREFIX"):
+            monkeypatch.delenv(key, raising=False)
+
+    def test_disabled_by_default(self):
+        assert get_config().profile == []
+
+    def test_profile_kinds(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("FLOORIST_PROFILE", "CPU, memory")
+        monkeypatch.setenv("FLOORIST_PROFILE_DIR", str(tmp_path))
+        config = get_config()
+        assert config.profile == ["cpu", "memory"]
+        assert config.profile_directory == str(tmp_path)
+
+    def test_unknown_profile(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_PROFILE", "gpu")
+        monkeypatch.setenv("FLOORIST_PROFILE_PREFIX", "profiles")
+        with pytest.raises(ValueError, match="Unknown profile 'gpu'"):
+            get_config()
+
+    def test_output_is_required(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_PROFILE", "cpu")
+        with pytest.raises(ValueError, match="Profiling needs"):
+            get_config()
+
+
+@pytest.mark.standalone
+class TestSinks:
+    @pytest.fixture(autouse=True)
+    def setup_env(self, env_settings, monkeypatch):
+        for key in ("FLOORIST_SINK", "FLOORIST_SINK_DIR", "FLOORIST_SINK_MMAP"):
+            monkeypatch.delenv(key, raising=False)
+
+    def test_s3_by_default(self):
+        assert get_config().sink == "s3"
+
+    def test_local_sink_does_not_need_a_bucket(self, monkeypatch, tmp_path):
+        monkeypatch.delenv("AWS_BUCKET")
+        monkeypatch.delenv("AWS_ENDPOINT", raising=False)
+        monkeypatch.setenv("FLOORIST_SINK", "local")
+        monkeypatch.setenv("FLOORIST_SINK_DIR", str(tmp_path))
+        monkeypatch.setenv("FLOORIST_SINK_MMAP", "true")
+        config = get_config()
+        assert (config.sink, config.sink_directory, config.sink_mmap) == ("local", str(tmp_path), True)
+
+    def test_local_sink_needs_a_directory(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_SINK", "local")
+        with pytest.raises(OSError, match="Sink directory"):
+            get_config()
+
+    def test_unknown_sink(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_SINK", "ftp")
+        with pytest.raises(ValueError, match="Unknown sink 'ftp'"):
+            get_config()
+
+
+@pytest.mark.standalone
+@pytest.mark.usefixtures("env_settings")
+class TestThrottle:
+    def test_disabled_by_default(self):
+        config = get_config()
+        assert config.max_rows_per_second is None
+        assert config.max_replication_lag is None
+        assert config.throttle_check_interval == 10
+        assert config.throttle_max_pause == 600
+
+    def test_limits(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_MAX_ROWS_PER_SECOND", "5000")
+        monkeypatch.setenv("FLOORIST_RUN_MAX_BYTES_PER_SECOND", "1048576")
+        monkeypatch.setenv("FLOORIST_MAX_REPLICATION_LAG", "60")
+        monkeypatch.setenv("FLOORIST_MAX_ACTIVE_CONNECTIONS", "20")
+        monkeypatch.setenv("FLOORIST_THROTTLE_CHECK_INTERVAL", "2.5")
+        monkeypatch.setenv("FLOORIST_THROTTLE_MAX_PAUSE", "120")
+        config = get_config()
+        assert config.max_rows_per_second == 5000
+        assert config.run_max_bytes_per_second == 1048576
+        assert (config.max_replication_lag, config.max_active_connections) == (60, 20)
+        assert config.throttle_check_interval == 2.5
+        assert config.throttle_max_pause == 120
+
+    def test_max_pause_must_be_positive(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_THROTTLE_MAX_PAUSE", "0")
+        with pytest.raises(ValueError, match="Throttle max pause must be positive"):
+            get_config()
+
+    def test_rate_must_be_positive(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_MAX_BYTES_PER_SECOND", "-1")
+        with pytest.raises(ValueError, match="FLOORIST_MAX_BYTES_PER_SECOND must be positive"):
+            get_config()
+
+
+@pytest.mark.standalone
+class TestEngine:
+    @pytest.fixture(autouse=True)
+    def setup_env(self, env_settings, monkeypatch):
+        monkeypatch.delenv("FLOORIST_SPILL_DIR", raising=False)
+
+    def test_threads_by_default(self):
+        assert get_config().engine == "threads"
+
+    def test_asyncio(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_ENGINE", "AsyncIO")
+        assert get_config().engine == "asyncio"
+
+    def test_unknown_engine(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_ENGINE", "greenlets")
+        with pytest.raises(ValueError, match="Unknown engine 'greenlets'"):
+            get_config()
+
+    @pytest.mark.parametrize(
+        ("key", "value", "name"),
+        [
+            ("FLOORIST_DATABASE_REPLICAS", "replica", "Replicas"),
+            ("FLOORIST_MAX_ROWS_PER_SECOND", "1000", "Throttling"),
+        ],
+    )
+    def test_unsupported_by_asyncio(self, monkeypatch, key, value, name):
+        monkeypatch.setenv("FLOORIST_ENGINE", "asyncio")
+        monkeypatch.setenv(key, value)
+        with pytest.raises(ValueError, match=f"{name} is not supported by the asyncio engine"):
+            get_config()
+
+
+@pytest.mark.standalone
+@pytest.mark.usefixtures("env_settings")
+class TestEncodeWorkers:
+    def test_encoded_in_place_by_default(self):
+        assert get_config().encode_workers == 0
+
+    def test_negative_encode_workers(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_ENCODE_WORKERS", "-1")
+        with pytest.raises(ValueError, match="Number of encode workers must not be negative"):
+            get_config()
+
+
+@pytest.mark.standalone
+@pytest.mark.usefixtures("env_settings")
+class TestTracing:
+    def test_disabled_by_default(self):
+        config = get_config()
+        assert (config.trace_file, config.trace_endpoint) == (None, None)
+
+    def test_outputs(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_TRACE_FILE", "/tmp/trace.json")
+        monkeypatch.setenv("FLOORIST_TRACE_ENDPOINT", "http://collector:4318")
+        config = get_config()
+        assert (config.trace_file, config.trace_endpoint) == ("/tmp/trace.json", "http://collector:4318")
+
+    def test_standard_otlp_endpoint(self, monkeypatch):
+        monkeypatch.setenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "http://collector:4318/v1/traces")
+        assert get_config().trace_endpoint == "http://collector:4318/v1/traces"
+
+
+@pytest.mark.standalone
+@pytest.mark.usefixtures("env_settings")
+class TestTypes:
+    def test_previous_types_by_default(self):
+        config = get_config()
+        assert (config.uuid_type, config.numeric_type, config.json_type) == ("string", "float", "object")
+
+    def test_types(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_UUID_TYPE", "Binary")
+        monkeypatch.setenv("FLOORIST_NUMERIC_TYPE", " decimal")
+        monkeypatch.setenv("FLOORIST_JSON_TYPE", "struct")
+        config = get_config()
+        assert (config.uuid_type, config.numeric_type, config.json_type) == ("binary", "decimal", "struct")
+
+    def test_unknown_type(self, monkeypatch):
+        monkeypatch.setenv("FLOORIST_JSON_TYPE", "bson")
+        with pytest.raises(ValueError, match="Unknown FLOORIST_JSON_TYPE 'bson', expected one of: object, string"):
+            get_config()
@@ -0,0 +1,307 @@
+import gc
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from os import environ
+from unittest.mock import Mock
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from floorist.conversion import PG_JSON_OID, PG_JSONB_OID, PG_NUMERIC_OID, PG_UUID_OID, TypeConversion
+from floorist.floorist import DatabaseClient
+
+# Lower bound of the speedup of the bulk conversion over decoding every value in Python, can be lowered for
+# noisy machines
+MIN_SPEEDUP = float(environ.get("FLOORIST_CONVERSION_MIN_SPEEDUP", "1.5"))
+BENCHMARK_ROWS = 100000
+
+_TEXT_OID = 25
+
+
+def _column(type_code, precision=None, scale=None, name="c"):
+    return (name, type_code, None, None, precision, scale, None)
+
+
+def _convert(conversion, column, values):
+    return _convert_chunks(conversion, column, [values])[0]
+
+
+def _convert_chunks(conversion, column, chunks):
+    # The chunks of a single query share the converters
+    converters = conversion.converters([column])
+    return [conversion.frame([(value,) for value in values], [column[0]], converters)[column[0]] for values in chunks]
+
+
+@pytest.mark.standalone
+class TestTypeConversion:
+    def test_converted_columns(self):
+        description = [
+            _column(PG_UUID_OID),
+            _column(PG_NUMERIC_OID),
+            _column(PG_JSONB_OID),
+            _column(PG_JSON_OID),
+            _column(_TEXT_OID),
+        ]
+
+        assert list(TypeConversion().converters(description)) == [1]
+        assert list(TypeConversion("binary", "decimal", "string").converters(description)) == [0, 1, 2, 3]
+
+    def test_text_oids(self):
+        assert TypeConversion().text_oids == (PG_UUID_OID, PG_NUMERIC_OID)
+        assert TypeConversion(json_type="struct").text_oids == (PG_UUID_OID, PG_NUMERIC_OID, PG_JSON_OID, PG_JSONB_OID)
+
+    def test_uuid_binary(self):
+        values = [str(uuid.uuid4()), None, str(uuid.uuid4())]
+
+        column = _convert(TypeConversion(uuid_type="binary"), _column(PG_UUID_OID), values)
+
+        assert column.dtype == pd.ArrowDtype(pa.binary(16))
+        assert column.tolist()[::2] == [uuid.UUID(values[0]).bytes, uuid.UUID(values[2]).bytes]
+        assert pd.isna(column[1])
+
+    def test_numeric_float(self):
+        column = _convert(TypeConversion(), _column(PG_NUMERIC_OID), ["1.50", None, "-2", "NaN", "Infinity"])
+
+        assert column.dtype == "float64"
+        assert column.tolist()[:1] + column.tolist()[2:3] == [1.5, -2.0]
+        assert math.isnan(column[1]) and math.isnan(column[3])
+        assert column[4] == math.inf
+
+    def test_numeric_decimal_of_the_column(self):
+        column = _convert(TypeConversion(numeric_type="decimal"), _column(PG_NUMERIC_OID, 10, 2), ["1.5", None])
+
+        assert column.dtype == pd.ArrowDtype(pa.decimal128(10, 2))
+        assert column[0] == Decimal("1.50")
+        assert pd.isna(column[1])
+
+    @pytest.mark.parametrize("precision", [None, 0, 80])
+    def test_numeric_decimal_kept_as_strings(self, precision):
+        values = ["-123.4", "0.001", "1" * 80, "NaN", None]
+
+        column = _convert(TypeConversion(numeric_type="decimal"), _column(PG_NUMERIC_OID, precision, 0), values)
+
+        assert column.dtype == pd.ArrowDtype(pa.large_string())
+        assert column.tolist()[:4] == values[:4]
+        assert pd.isna(column[4])
+
+    def test_numeric_decimal_of_a_wide_column(self):
+        column = _convert(TypeConversion(numeric_type="decimal"), _column(PG_NUMERIC_OID, 50, 0), ["1" * 50])
+
+        assert column.dtype == pd.ArrowDtype(pa.decimal256(50, 0))
+        assert str(column[0]) == "1" * 50
+
+    @pytest.mark.parametrize("special", ["NaN", "Infinity", "-Infinity"])
+    def test_numeric_decimal_special_values(self, special):
+        with pytest.raises(ValueError, match="NUMERIC column c has NaN or infinite values"):
+            _convert(TypeConversion(numeric_type="decimal"), _column(PG_NUMERIC_OID, 10, 2), ["1.5", special])
+
+    def test_json_string(self):
+        column = _convert(TypeConversion(json_type="string"), _column(PG_JSONB_OID), ['{"a": 1}', None])
+
+        assert column.dtype == pd.ArrowDtype(pa.large_string())
+        assert column[0] == '{"a": 1}'
+
+    def test_json_struct(self):
+        values = ['{"a": 1, "b": [1, 2]}', None, '{"a": 2}']
+
+        column = _convert(TypeConversion(json_type="struct"), _column(PG_JSONB_OID), values)
+
+        assert pa.types.is_struct(column.dtype.pyarrow_dtype)
+        assert column[0] == {"a": 1, "b": [1, 2]}
+        assert pd.isna(column[1])
+        assert column[2] == {"a": 2, "b": None}
+
+    def test_json_struct_without_a_common_type(self):
+        values = ['{"a": 1}', '{"a": "one"}', "[1]"]
+
+        column = _convert(TypeConversion(json_type="struct"), _column(PG_JSON_OID), values)
+
+        assert column.tolist() == [{"a": 1}, {"a": "one"}, [1]]
+
+    def test_json_struct_type_is_fixed_by_the_first_chunk(self):
+        chunks = [[None], ['{"a": 1, "b": {"c": "x"}}'], ['{"a": 2}', None], ['{"b": {"c": "y"}}']]
+
+        columns = _convert_chunks(TypeConversion(json_type="struct"), _column(PG_JSONB_OID), chunks)
+
+        assert len({column.dtype for column in columns[1:]}) == 1
+        assert columns[2][0] == {"a": 2, "b": None}
+        assert columns[3][0] == {"a": None, "b": {"c": "y"}}
+
+    @pytest.mark.parametrize("document", ['{"a": 1, "d": 1}', '{"a": 1, "b": {"e": 1}}', '{"a": "one"}', "[1]"])
+    def test_json_struct_documents_not_fitting_the_first_chunk(self, document):
+        chunks = [['{"a": 1, "b": {"c": "x"}}'], [document]]
+
+        with pytest.raises(ValueError, match="JSON column c has documents that do not fit the type"):
+            _convert_chunks(TypeConversion(json_type="struct"), _column(PG_JSONB_OID), chunks)
+
+    def test_json_struct_without_a_common_type_in_the_first_chunk(self):
+        chunks = [['{"a": 1}', '{"a": "one"}'], ['{"a": 2}']]
+
+        columns = _convert_chunks(TypeConversion(json_type="struct"), _column(PG_JSONB_OID), chunks)
+
+        assert [column.dtype for column in columns] == [object, object]
+        assert columns[1].tolist() == [{"a": 2}]
+
+    def test_empty_chunk(self):
+        conversion = TypeConversion("binary", "decimal", "struct")
+        description = [_column(PG_UUID_OID, name="u"), _column(PG_NUMERIC_OID, name="n"), _column(PG_JSONB_OID, "j")]
+
+        data = conversion.frame([], ["u", "n", "j"], conversion.converters(description))
+
+        assert list(data.columns) == ["u", "n", "j"]
+        assert len(data) == 0
+        assert pa.Table.from_pandas(data, preserve_index=False).num_rows == 0
+
+    def test_time_zones_are_converted_to_utc(self):
+        value = datetime(2026, 1, 1, 12, tzinfo=timezone(timedelta(hours=2)))
+
+        data = TypeConversion().frame([(value,)], ["t"], {})
+
+        assert str(data["t"].dt.tz) == "UTC"
+        assert data["t"][0].hour == 10
+
+
+@pytest.mark.standalone
+class TestExecuteQuery:
+    @staticmethod
+    def _client(rows, description, conversion=None):
+        result = Mock()
+        result.keys.return_value = [column[0] for column in description]
+        result.cursor.description = description
+        batches = [rows[i : i + 2] for i in range(0, len(rows), 2)]
+        result.fetchmany.side_effect = [*batches, []]
+        result.fetchall.return_value = rows
+        conn = Mock()
+        conn.exec_driver_sql.return_value = result
+
+        client = DatabaseClient.__new__(DatabaseClient)
+        client.conversion = conversion or TypeConversion()
+        client._local = threading.local()
+        client._local.conn = conn
+        return client, result
+
+    def test_chunks_are_converted(self):
+        rows = [(1, "1.5"), (2, "2.5"), (3, None)]
+        client, result = self._client(rows, [_column(23, name="id"), _column(PG_NUMERIC_OID, name="amount")])
+
+        chunks = list(client.execute_query("SELECT 1", 2))
+
+        assert [chunk["id"].tolist() for chunk in chunks] == [[1, 2], [3]]
+        assert chunks[0]["amount"].tolist() == [1.5, 2.5]
+        assert chunks[0]["amount"].dtype == "float64"
+        result.close.assert_called_once()
+
+    @pytest.mark.parametrize(("precision", "scale"), [(None, None), (10, 2)])
+    def test_numeric_decimal_is_the_same_in_every_chunk(self, precision, scale):
+        rows = [("1.5",), ("-20.25",), ("12345.1",), (None,), ("0",)]
+        client, _ = self._client(
+            rows, [_column(PG_NUMERIC_OID, precision, scale)], TypeConversion(numeric_type="decimal")
+        )
+
+        chunks = list(client.execute_query("SELECT 1", 2))
+
+        assert len(chunks) == 3
+        assert len({pa.Table.from_pandas(chunk, preserve_index=False).schema for chunk in chunks}) == 1
+
+    def test_whole_result(self):
+        client, _ = self._client([(1,), (2,), (3,)], [_column(23, name="id")])
+
+        (chunk,) = client.execute_query("SELECT 1", None)
+
+        assert chunk["id"].tolist() == [1, 2, 3]
+
+    def test_empty_result_is_a_single_empty_chunk(self):
+        client, _ = self._client([], [_column(23, name="id")])
+
+        (chunk,) = client.execute_query("SELECT 1", 1000)
+
+        assert list(chunk.columns) == ["id"]
+        assert len(chunk) == 0
+
+
+def _best_of(function, runs=3):
+    # Without the garbage collector, the same as timeit, its passes over the values of the fixture are noise
+    timings = []
+    gc.disable()
+    try:
+        for _ in range(runs):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+    finally:
+        gc.enable()
+
+    return min(timings)
+
+
+def _per_value(values, decode, coerce_float=True):
+    # Decoding every value into a Python object by the driver, then handing the objects to pandas and Arrow
+    data = pd.DataFrame.from_records([(decode(value),) for value in values], columns=["c"], coerce_float=coerce_float)
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+
+def _bulk(conversion, column, values):
+    data = conversion.frame([(value,) for value in values], ["c"], conversion.converters([column]))
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+
+@pytest.fixture(scope="class")
+def values():
+    rng = random.Random(42)
+    return {
+        "uuid": [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(BENCHMARK_ROWS)],
+        "numeric": [f"{rng.randint(-(10**8), 10**8)}.{rng.randint(0, 99):02d}" for _ in range(BENCHMARK_ROWS)],
+        "json": [
+            json.dumps({"id": i, "name": f"host-{i}", "tags": ["a", "b"], "score": i / 3})
+            for i in range(BENCHMARK_ROWS)
+        ],
+    }
+
+
+@pytest.mark.benchmark
+class TestConversionBenchmark:
+    """Microbenchmarks of the bulk conversion of every type against decoding the values one by one."""
+
+    def _assert_faster(self, name, per_value, bulk):
+        per_value_time, bulk_time = _best_of(per_value), _best_of(bulk)
+        speedup = per_value_time / bulk_time
+        assert speedup >= MIN_SPEEDUP, (
+            f"Bulk {name} conversion took {bulk_time * 1000:.0f}ms, {per_value_time * 1000:.0f}ms one by one "
+            f"(speedup {speedup:.1f}, expected at least {MIN_SPEEDUP})"
+        )
+
+    def test_uuid_binary(self, values):
+        self._assert_faster(
+            "UUID",
+            lambda: _per_value(values["uuid"], lambda value: uuid.UUID(value).bytes),
+            lambda: _bulk(TypeConversion(uuid_type="binary"), _column(PG_UUID_OID), values["uuid"]),
+        )
+
+    def test_numeric_float(self, values):
+        self._assert_faster(
+            "NUMERIC float",
+            lambda: _per_value(values["numeric"], Decimal),
+            lambda: _bulk(TypeConversion(), _column(PG_NUMERIC_OID), values["numeric"]),
+        )
+
+    def test_numeric_decimal(self, values):
+        self._assert_faster(
+            "NUMERIC decimal",
+            lambda: _per_value(values["numeric"], Decimal, coerce_float=False),
+            lambda: _bulk(TypeConversion(numeric_type="decimal"), _column(PG_NUMERIC_OID, 12, 2), values["numeric"]),
+        )
+
+    @pytest.mark.parametrize("json_type", ["string", "struct"])
+    def test_json(self, values, json_type):
+        self._assert_faster(
+            "JSON",
+            lambda: _per_value(values["json"], json.loads),
+            lambda: _bulk(TypeConversion(json_type=json_type), _column(PG_JSONB_OID), values["json"]),
+        )
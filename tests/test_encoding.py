@@ -0,0 +1,177 @@
+import io
+import os
+import threading
+from unittest.mock import Mock, patch
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from floorist.encoding import ChunkPipeline, ProcessEncoder
+from floorist.floorist import DumpExecutor, ParquetOptions, RetryPolicy, S3Client
+from floorist.sinks import LocalSink, MemorySink
+
+
+def _build_chunk(rows=1000):
+    return pd.DataFrame({"id": list(range(rows, 0, -1)), "name": [f"name {i}" for i in range(rows)]})
+
+
+def _shared_memory():
+    # The segments of SharedMemory, the pool keeps its semaphores there as well
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")} if os.path.isdir("/dev/shm") else set()
+
+
+@pytest.fixture
+def encoder():
+    encoder = ProcessEncoder(2, min_bytes=0)
+    yield encoder
+    encoder.close()
+
+
+@pytest.mark.standalone
+class TestProcessEncoder:
+    def test_chunks_are_encoded_by_the_workers(self, encoder):
+        data = _build_chunk()
+        before = _shared_memory()
+
+        body = encoder.encode(data, ParquetOptions(sort_by=["id"], page_index=True))
+
+        assert encoder._pool is not None
+        assert _shared_memory() == before
+        parquet = pq.ParquetFile(io.BytesIO(body.to_pybytes()))
+        assert parquet.read().to_pandas().equals(data)
+        assert parquet.metadata.row_group(0).sorting_columns[0].column_index == 0
+        assert parquet.metadata.row_group(0).column(0).compression == "GZIP"
+
+    def test_small_chunks_are_encoded_in_place(self):
+        encoder = ProcessEncoder(2)
+
+        body = encoder.encode(_build_chunk(10))
+
+        assert encoder._pool is None
+        assert len(pq.read_table(io.BytesIO(body.to_pybytes()))) == 10
+
+    def test_chunks_not_fitting_into_shared_memory_are_encoded_in_place(self, encoder, caplog):
+        with patch("floorist.encoding._shared_memory_free", return_value=1024):
+            bodies = [encoder.encode(_build_chunk()) for _ in range(2)]
+
+        assert encoder._pool is None
+        assert [len(pq.read_table(io.BytesIO(body.to_pybytes()))) for body in bodies] == [1000, 1000]
+        assert caplog.text.count("Not enough free space in /dev/shm") == 1
+
+    def test_chunks_being_encoded_are_reserved(self, encoder):
+        with patch("floorist.encoding._shared_memory_free", return_value=100):
+            assert encoder._reserve(60) is True
+            assert encoder._reserve(60) is False
+            assert encoder._reserve(40) is True
+
+    def test_workers_are_restarted_after_one_died(self, encoder, caplog):
+        encoder.encode(_build_chunk())
+        broken = encoder._pool
+        for process in list(broken._processes.values()):
+            process.kill()
+            process.join()
+        before = _shared_memory()
+
+        body = encoder.encode(_build_chunk())
+
+        assert pq.read_table(io.BytesIO(body.to_pybytes())).to_pandas().equals(_build_chunk())
+        assert caplog.text.count("An encode worker stopped unexpectedly") == 1
+        assert encoder._pool is None
+        assert _shared_memory() <= before
+
+        encoder.encode(_build_chunk())
+        assert encoder._pool is not None
+        assert encoder._pool is not broken
+
+    def test_local_sink_uses_the_encoder(self, encoder, tmp_path):
+        sink = LocalSink(str(tmp_path))
+        sink.encoder = encoder
+        path, target = sink.make_path("p")
+
+        sink.write_parquet(_build_chunk(), target, path)
+
+        (written,) = tmp_path.rglob("*.gz.parquet")
+        assert pq.read_table(written).to_pandas().equals(_build_chunk())
+        assert encoder._pool is not None
+
+    def test_s3_client_puts_the_encoded_files(self, encoder):
+        config = Mock(bucket_name="floorist/exports", bucket_url=None, upload_concurrency=2)
+        with patch("floorist.floorist.boto3.setup_default_session"):
+            client = S3Client(config)
+        client._client = Mock()
+        client.encoder = encoder
+
+        with patch("floorist.floorist.wr.s3.to_parquet") as to_parquet:
+            client.write_parquet(_build_chunk(), "s3://floorist/exports/p/day", "p/day")
+
+        to_parquet.assert_not_called()
+        kwargs = client._client.put_object.call_args.kwargs
+        assert kwargs["Bucket"] == "floorist"
+        assert kwargs["Key"].startswith("exports/p/day/")
+        assert kwargs["Key"].endswith(".gz.parquet")
+        assert pq.read_table(io.BytesIO(kwargs["Body"])).to_pandas().equals(_build_chunk())
+
+
+@pytest.mark.standalone
+class TestChunkPipeline:
+    def test_chunks_are_written_in_place_without_depth(self):
+        written = []
+        with ChunkPipeline(0) as pipeline:
+            pipeline.submit(lambda chunk: written.append((chunk, threading.current_thread())), 1)
+
+        assert written == [(1, threading.current_thread())]
+
+    def test_chunks_in_flight_are_bounded(self):
+        release = threading.Event()
+        started = []
+
+        def write(chunk):
+            started.append(chunk)
+            release.wait(5)
+
+        with ChunkPipeline(2) as pipeline:
+            pipeline.submit(write, 1)
+            pipeline.submit(write, 2)
+            third = threading.Thread(target=pipeline.submit, args=(write, 3))
+            third.start()
+            third.join(0.2)
+
+            assert third.is_alive()
+            assert sorted(started) == [1, 2]
+            release.set()
+            third.join(5)
+
+        assert sorted(started) == [1, 2, 3]
+
+    def test_errors_of_the_writes_are_raised(self):
+        def write(chunk):
+            if chunk == 1:
+                raise OSError("Upload failed")
+
+        with pytest.raises(OSError, match="Upload failed"), ChunkPipeline(2) as pipeline:
+            for chunk in range(5):
+                pipeline.submit(write, chunk)
+
+    def test_next_chunk_is_fetched_while_the_previous_one_is_written(self):
+        fetched = threading.Event()
+
+        class WaitingSink(MemorySink):
+            def write_parquet(self, data, target, path, options=None):
+                # The first chunk is only written once the second one has been fetched
+                if data["id"].iloc[0] == 1:
+                    assert fetched.wait(5)
+                super().write_parquet(data, target, path, options)
+
+        def chunks():
+            yield pd.DataFrame({"id": [1, 2]})
+            fetched.set()
+            yield pd.DataFrame({"id": [3, 4]})
+
+        db = Mock()
+        db.execute_query.return_value = chunks()
+        sink = WaitingSink()
+        executor = DumpExecutor(sink, db, RetryPolicy(), in_flight=2)
+
+        assert executor.execute({"query": "SELECT 1", "prefix": "p"}, 1) is True
+        assert len([key for key in sink.objects if key.endswith(".parquet")]) == 2
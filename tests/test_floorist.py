@@ -218,3 +218,24 @@ class TestFloorist:
         assert len(wr.s3.list_objects(f"{prefix}/valid/", boto3_session=session)) == 1
         df = wr.s3.read_parquet(f"{prefix}/valid/", boto3_session=session)
         assert len(df) == 3
+
+    def test_floorplan_valid_with_asyncio_engine(self, caplog, session, monkeypatch):
+        prefix = f"s3://{env['AWS_BUCKET']}"
+        monkeypatch.setenv("FLOORIST_ENGINE", "asyncio")
+        env["FLOORPLAN_FILE"] = "tests/floorplan_valid.yaml"
+        main()
+        assert "Dumped 1 from total of 1" in caplog.text
+        assert wr.s3.list_directories(prefix, boto3_session=session) == [f"{prefix}/valid/"]
+        df = wr.s3.read_parquet(f"{prefix}/valid/", boto3_session=session)
+        assert len(df) == 3
+
+    def test_floorplan_with_one_failing_dump_with_asyncio_engine(self, caplog, session, monkeypatch):
+        prefix = f"s3://{env['AWS_BUCKET']}"
+        monkeypatch.setenv("FLOORIST_ENGINE", "asyncio")
+        env["FLOORPLAN_FILE"] = "tests/floorplan_with_one_failing_dump.yaml"
+        with pytest.raises(SystemExit) as ex:
+            main()
+        assert ex.value.code == 1
+        assert "PostgresSyntaxError" in caplog.text
+        assert "Dumped 1 from total of 2" in caplog.text
+        assert wr.s3.list_directories(prefix, boto3_session=session) == [f"{prefix}/numbers/"]
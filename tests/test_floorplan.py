@@ -0,0 +1,215 @@
+import json
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+import yaml
+
+from floorist.floorist import Floorist, main
+from floorist.floorplan import DumpSelector, load_floorplan
+
+_FLOORPLAN = [
+    {"prefix": "insights/hosts", "query": "SELECT 1"},
+    {"prefix": "insights/hosts/tags", "query": "SELECT 2"},
+    {"prefix": "insights/hostsets", "query": "SELECT 3"},
+    {"prefix": "marketplace/subscriptions", "query": "SELECT 4"},
+    {"prefix": "inventory/hosts", "query": "SELECT 5"},
+]
+
+
+@pytest.fixture
+def floorplan(tmp_path):
+    path = tmp_path / "floorplan.yaml"
+    path.write_text(yaml.safe_dump(_FLOORPLAN))
+    return str(path)
+
+
+def _selected(floorplan, *selectors):
+    return [count for count, _ in load_floorplan(floorplan, [DumpSelector.parse(s) for s in selectors]).dumps]
+
+
+@pytest.mark.standalone
+class TestDumpSelector:
+    @pytest.mark.parametrize(
+        ("selectors", "expected"),
+        [
+            ((), [1, 2, 3, 4, 5]),
+            (("2",), [2]),
+            (("2-4",), [2, 3, 4]),
+            (("insights/hosts",), [1, 2]),
+            (("/insights/hosts/",), [1, 2]),
+            (("insights/*",), [1, 2, 3]),
+            (("*/subscriptions", "1"), [1, 4]),
+            (("insights/host?",), [1]),
+        ],
+    )
+    def test_selected_dumps(self, floorplan, selectors, expected):
+        assert _selected(floorplan, *selectors) == expected
+
+    @pytest.mark.parametrize("text", ["", "0", "4-2", "0-3"])
+    def test_invalid_selector(self, text):
+        with pytest.raises(ValueError):
+            DumpSelector.parse(text)
+
+    def test_selector_matching_no_dump(self, floorplan):
+        with pytest.raises(ValueError, match="No dump of the floorplan matches: 9, insights/host"):
+            _selected(floorplan, "1", "9", "insights/host")
+
+
+@pytest.mark.standalone
+class TestLoadFloorplan:
+    def test_rows_are_numbered_from_one(self, floorplan):
+        loaded = load_floorplan(floorplan)
+
+        assert loaded.dumps == list(enumerate(_FLOORPLAN, start=1))
+        assert loaded.total == 5
+
+    def test_selection_keeps_the_numbers_of_the_rows(self, floorplan):
+        loaded = load_floorplan(floorplan, [DumpSelector.parse("marketplace")])
+
+        assert loaded.dumps == [(4, _FLOORPLAN[3])]
+        assert loaded.total == 5
+
+    def test_json_floorplan(self, tmp_path):
+        path = tmp_path / "floorplan.yaml"
+        path.write_text(json.dumps(_FLOORPLAN[:1]))
+
+        assert load_floorplan(str(path)).dumps == [(1, _FLOORPLAN[0])]
+
+    def test_aliases_across_the_rows(self, tmp_path):
+        path = tmp_path / "floorplan.yaml"
+        path.write_text("- &base {query: SELECT 1, prefix: a, chunksize: 10}\n- {<<: *base, prefix: b}\n")
+
+        assert [row for _, row in load_floorplan(str(path)).dumps] == [
+            {"query": "SELECT 1", "prefix": "a", "chunksize": 10},
+            {"query": "SELECT 1", "prefix": "b", "chunksize": 10},
+        ]
+
+    @pytest.mark.parametrize(
+        ("content", "message"),
+        [
+            ("", "is empty"),
+            ("prefix: a\nquery: SELECT 1\n", "has to be a list of dumps\n.*line 1"),
+            ("- {prefix: a, query: SELECT 1}\n---\n- prefix: b\n", "has to be a single document\n.*line 2"),
+            ("- not a row\n", "Row #1 of floorplan .* has to be a mapping, not str"),
+            ("- {prefix: a, query: SELECT 1}\n- null\n", "Row #2 of floorplan .* has to be a mapping, not NoneType"),
+            ("- {prefix: a, query: SELECT 1}\n- {prefix: b}\n", "Row #2 of floorplan .* has no 'query'"),
+            ("- query: SELECT 1\n", "Row #1 of floorplan .* has no 'prefix'"),
+            ("- {prefix: , query: SELECT 1}\n", "The 'prefix' of row #1 of floorplan .* has to be a non-empty string"),
+            ("- {prefix: a, query: [1]}\n", "The 'query' of row #1 of floorplan .* has to be a non-empty string"),
+        ],
+    )
+    def test_invalid_floorplan(self, tmp_path, content, message):
+        path = tmp_path / "floorplan.yaml"
+        path.write_text(content)
+
+        with pytest.raises(ValueError, match=message):
+            load_floorplan(str(path))
+
+    def test_syntax_error_is_raised_before_any_dump(self, tmp_path):
+        path = tmp_path / "floorplan.yaml"
+        path.write_text("- {prefix: a, query: SELECT 1}\n- prefix: [b\n")
+
+        with pytest.raises(yaml.YAMLError):
+            load_floorplan(str(path))
+
+    def test_fingerprint(self, floorplan, tmp_path):
+        other = tmp_path / "other.yaml"
+        other.write_text(yaml.safe_dump(_FLOORPLAN[:2]))
+        fingerprint = load_floorplan(floorplan).fingerprint
+
+        assert load_floorplan(floorplan).fingerprint == fingerprint
+        assert load_floorplan(str(other)).fingerprint != fingerprint
+        assert load_floorplan(floorplan, [DumpSelector.parse("1")]).fingerprint != fingerprint
+
+
+@pytest.mark.benchmark
+class TestLoadFloorplanBenchmark:
+    @pytest.mark.skipif(not yaml.__with_libyaml__, reason="PyYAML is built without libyaml")
+    def test_faster_than_loading_the_whole_document(self, tmp_path):
+        path = tmp_path / "floorplan.yaml"
+        rows = [{"prefix": f"insights/table_{i}", "query": f"SELECT * FROM table_{i}"} for i in range(5000)]
+        path.write_text(yaml.safe_dump(rows))
+
+        def best_of(function):
+            timings = []
+            for _ in range(3):
+                started = time.perf_counter()
+                function()
+                timings.append(time.perf_counter() - started)
+            return min(timings)
+
+        whole = best_of(lambda: yaml.safe_load(path.read_bytes()))
+        streamed = best_of(lambda: load_floorplan(str(path)))
+        assert streamed * 2 < whole, f"Loading took {streamed * 1000:.0f}ms, {whole * 1000:.0f}ms with safe_load"
+
+
+@pytest.mark.standalone
+class TestPartialRun:
+    @pytest.fixture
+    def floorist(self, floorplan):
+        floorist = Floorist.__new__(Floorist)
+        floorist.config = Mock(floorplan_filename=floorplan, concurrency=1, shard_count=1, engine="threads")
+        floorist.executor = Mock()
+        floorist.executor.execute.return_value = True
+        floorist.history = None
+        floorist.checkpoint = None
+        return floorist
+
+    def test_only_the_selected_dumps_run(self, floorist, caplog):
+        caplog.set_level("INFO")
+
+        floorist.run([DumpSelector.parse("insights/hosts"), DumpSelector.parse("4")])
+
+        assert [c.args[1] for c in floorist.executor.execute.call_args_list] == [1, 2, 4]
+        assert "Running the selected dumps [1, 2, 4] from total of 5" in caplog.text
+        assert "Dumped 3 from total of 3" in caplog.text
+
+    def test_invalid_floorplan_fails_the_run(self, floorist, tmp_path, caplog):
+        path = tmp_path / "invalid.yaml"
+        path.write_text("- {prefix: a, query: SELECT 1}\n- not a row\n")
+        floorist.config.floorplan_filename = str(path)
+
+        with pytest.raises(SystemExit) as ex:
+            floorist.run()
+
+        assert ex.value.code == 1
+        assert "Row #2 of floorplan" in caplog.text
+        floorist.executor.execute.assert_not_called()
+
+
+@pytest.mark.standalone
+class TestCommandLine:
+    @pytest.fixture(autouse=True)
+    def setup_env(self, env_settings, monkeypatch, floorplan):
+        monkeypatch.setenv("FLOORPLAN_FILE", floorplan)
+
+    @patch("floorist.floorist.Floorist")
+    def test_selection_and_concurrency(self, mock_floorist):
+        main(["insights/*", "4", "--concurrency", "8"])
+
+        (config,) = mock_floorist.call_args.args
+        assert config.concurrency == 8
+        (selectors,) = mock_floorist.return_value.__enter__.return_value.run.call_args.args
+        assert [selector.text for selector in selectors] == ["insights/*", "4"]
+
+    @patch("floorist.floorist.Floorist")
+    def test_whole_floorplan_by_default(self, mock_floorist):
+        main()
+
+        mock_floorist.return_value.__enter__.return_value.run.assert_called_once_with([])
+
+    @patch("floorist.floorist.Floorist")
+    def test_list(self, mock_floorist, capsys):
+        main(["--list", "insights/hosts"])
+
+        assert capsys.readouterr().out == "1\tinsights/hosts\n2\tinsights/hosts/tags\n"
+        mock_floorist.assert_not_called()
+
+    @pytest.mark.parametrize("argv", [["0"], ["5-1"], ["--concurrency", "0"]])
+    def test_invalid_arguments(self, argv, capsys):
+        with pytest.raises(SystemExit) as ex:
+            main(argv)
+
+        assert ex.value.code == 2
+        assert "floorist: error" in capsys.readouterr().err
@@ -0,0 +1,174 @@
+import json
+from unittest.mock import Mock, patch
+
+import botocore.exceptions
+import pandas as pd
+import pytest
+
+from floorist.floorist import DumpExecutor, Floorist, RetryPolicy, S3Client
+from floorist.history import BASELINE_MIN_RUNS, HISTORY_RUNS, DumpStats, PerformanceHistory
+
+
+def _run(prefix, **metrics):
+    record = {"duration": 100.0, "rows": 1000, "bytes": 10**8, "objects": 1, "retries": 0}
+    record.update(metrics)
+    return {"started": "2026-01-01T00:00:00+00:00", "dumps": {prefix: record}}
+
+
+@pytest.mark.standalone
+class TestPerformanceHistory:
+    @pytest.fixture
+    def mock_s3(self):
+        mock = Mock()
+        mock.read_object.return_value = None
+        return mock
+
+    @staticmethod
+    def _written(mock_s3):
+        path, body = mock_s3.write_object.call_args.args
+        assert path == "perf/history.json"
+        return json.loads(body)["runs"]
+
+    def test_first_run_creates_the_history(self, mock_s3):
+        stats = DumpStats(prefix="p", succeeded=True, duration=1.23456, rows=10, bytes=80, objects=1)
+
+        assert PerformanceHistory(mock_s3, "perf/history.json").record([stats]) == []
+
+        (run,) = self._written(mock_s3)
+        assert run["dumps"] == {"p": {"duration": 1.235, "rows": 10, "bytes": 80, "objects": 1, "retries": 0}}
+
+    def test_history_is_trimmed(self, mock_s3):
+        mock_s3.read_object.return_value = json.dumps({"runs": [_run("p")] * HISTORY_RUNS})
+
+        PerformanceHistory(mock_s3, "perf/history.json").record([DumpStats(prefix="p", succeeded=True)])
+
+        runs = self._written(mock_s3)
+        assert len(runs) == HISTORY_RUNS
+        assert runs[-1]["dumps"]["p"]["duration"] == 0
+
+    def test_slow_dump_is_reported(self, mock_s3, caplog):
+        mock_s3.read_object.return_value = json.dumps({"runs": [_run("p"), _run("p", duration=120.0), _run("p")]})
+        stats = DumpStats(prefix="p", succeeded=True, duration=400.0, rows=1000, bytes=10**8)
+
+        regressions = PerformanceHistory(mock_s3, "perf/history.json").record([stats])
+
+        assert regressions == [("p", "duration", 400.0, 100.0)]
+        assert self._written(mock_s3)[-1]["regressions"] == [["p", "duration"]]
+        assert "Performance regression of p: duration is 400.0" in caplog.text
+
+    def test_larger_dump_is_reported(self):
+        history = [_run("p")] * 5
+        stats = DumpStats(prefix="p", succeeded=True, duration=100.0, bytes=3 * 10**8)
+        assert PerformanceHistory.regressions(stats, history) == [("p", "bytes", 3 * 10**8, 10**8)]
+
+    def test_small_differences_are_ignored(self):
+        history = [_run("p", duration=1.0)] * 5
+        stats = DumpStats(prefix="p", succeeded=True, duration=10.0, bytes=10**8)
+        assert PerformanceHistory.regressions(stats, history) == []
+
+    def test_baseline_needs_enough_successful_runs(self):
+        history = [_run("p")] * (BASELINE_MIN_RUNS - 1) + [_run("p", failed=True)] * 5
+        assert PerformanceHistory.baseline("p", history) is None
+        assert PerformanceHistory.baseline("p", [*history, _run("p")])["duration"] == 100.0
+
+    def test_invalid_history_is_replaced(self, mock_s3, caplog):
+        mock_s3.read_object.return_value = b"not json"
+
+        PerformanceHistory(mock_s3, "perf/history.json").record([DumpStats(prefix="p")])
+
+        assert len(self._written(mock_s3)) == 1
+        assert "Ignoring the invalid performance history" in caplog.text
+
+
+@pytest.mark.standalone
+class TestDumpStats:
+    def test_executor_collects_the_stats(self):
+        mock_s3 = Mock()
+        mock_s3.make_path.return_value = ("p/day", "s3://bucket/p/day")
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter([pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3]})])
+        stats = DumpStats()
+
+        executor = DumpExecutor(mock_s3, mock_db, RetryPolicy())
+        assert executor.execute({"query": "SELECT 1", "prefix": "p"}, dump_count=1, stats=stats) is True
+
+        assert stats.prefix == "p"
+        assert stats.succeeded is True
+        assert stats.rows == 3
+        assert stats.bytes == 3 * 8
+        assert stats.objects == 2
+        assert stats.retries == 0
+        assert stats.duration > 0
+
+    @patch("floorist.history.memory_size")
+    def test_size_is_not_measured_without_a_consumer(self, mock_memory_size):
+        mock_s3 = Mock()
+        mock_s3.make_path.return_value = ("p/day", "s3://bucket/p/day")
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter([pd.DataFrame({"id": [1, 2]})])
+        stats = DumpStats(measure_bytes=False)
+
+        assert DumpExecutor(mock_s3, mock_db, RetryPolicy()).execute({"query": "q", "prefix": "p"}, 1, stats) is True
+
+        assert (stats.rows, stats.bytes) == (2, 0)
+        mock_memory_size.assert_not_called()
+
+    def test_failed_dump_is_marked(self):
+        mock_s3 = Mock()
+        mock_s3.make_path.return_value = ("p/day", "s3://bucket/p/day")
+        mock_db = Mock()
+        mock_db.execute_query.side_effect = RuntimeError("boom")
+        stats = DumpStats()
+
+        assert DumpExecutor(mock_s3, mock_db, RetryPolicy()).execute({"query": "q", "prefix": "p"}, 1, stats) is False
+
+        assert stats.succeeded is False
+        assert stats.as_record()["failed"] is True
+
+
+@pytest.mark.standalone
+class TestRecordingTheRun:
+    def test_missing_history_object(self):
+        config = Mock(bucket_name="bucket/prefix", bucket_url=None, upload_concurrency=1)
+        with patch("floorist.floorist.boto3.setup_default_session"):
+            client = S3Client(config)
+        client._client = Mock()
+        client._client.get_object.side_effect = botocore.exceptions.ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+        )
+
+        assert client.read_object("perf/history.json") is None
+        client._client.get_object.assert_called_once_with(Bucket="bucket", Key="prefix/perf/history.json")
+
+    def test_history_failure_does_not_fail_the_run(self, tmp_path, caplog):
+        floorplan = tmp_path / "floorplan.yaml"
+        floorplan.write_text(json.dumps([{"prefix": "a", "query": "SELECT 1"}, {"prefix": "b", "query": "SELECT 1"}]))
+        floorist = Floorist.__new__(Floorist)
+        floorist.config = Mock(floorplan_filename=str(floorplan), concurrency=1, shard_count=1)
+        floorist.executor = Mock()
+        floorist.executor.execute.return_value = True
+        floorist.history = Mock()
+        floorist.history.record.side_effect = RuntimeError("boom")
+        floorist.checkpoint = None
+
+        floorist.run()
+
+        (stats,) = floorist.history.record.call_args.args
+        assert len(list(stats)) == 2
+        assert all(s.measure_bytes for s in stats)
+        assert "Recording the performance history failed" in caplog.text
+
+    def test_size_is_not_measured_without_the_history(self, tmp_path):
+        floorplan = tmp_path / "floorplan.yaml"
+        floorplan.write_text(json.dumps([{"prefix": "a", "query": "SELECT 1"}]))
+        floorist = Floorist.__new__(Floorist)
+        floorist.config = Mock(floorplan_filename=str(floorplan), concurrency=1, shard_count=1)
+        floorist.executor = Mock()
+        floorist.executor.execute.return_value = True
+        floorist.history = None
+        floorist.checkpoint = None
+
+        floorist.run()
+
+        (stats,) = [call.args[2] for call in floorist.executor.execute.call_args_list]
+        assert stats.measure_bytes is False
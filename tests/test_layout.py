@@ -0,0 +1,156 @@
+import json
+from unittest.mock import Mock, call, patch
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+from sqlalchemy import exc as sqlalchemy_exc
+
+from floorist.floorist import DumpExecutor, ParquetOptions, RetryPolicy, S3Client
+from floorist.layout import LAYOUT_OBJECT, read_layout, shard_prefixes, sharded_name
+from floorist.sinks import LocalSink, MemorySink
+
+
+def _dump(sink, row, spill_directory=None):
+    db = Mock()
+    chunks = [pd.DataFrame({"id": range(i, i + 10), "bucket": [i % 3] * 10}) for i in range(0, 200, 10)]
+    db.execute_query.return_value = iter(chunks)
+    executor = DumpExecutor(sink, db, RetryPolicy(), spill_directory=spill_directory)
+    return executor.execute({"query": "SELECT 1", "prefix": "p", "chunksize": 10} | row, 1)
+
+
+@pytest.mark.standalone
+class TestKeyLayout:
+    def test_shard_prefixes(self):
+        assert shard_prefixes(0) == []
+        assert shard_prefixes(4) == ["key_shard=0", "key_shard=1", "key_shard=2", "key_shard=3"]
+        assert shard_prefixes(256)[::255] == ["key_shard=00", "key_shard=ff"]
+
+    def test_names_are_hashed_into_the_shards(self):
+        options = ParquetOptions(key_shards=16)
+        names = [sharded_name(f"{i}.gz.parquet", options) for i in range(1000)]
+
+        assert sharded_name("1.gz.parquet", options) == names[1]
+        assert {name.split("/")[0] for name in names} == set(shard_prefixes(16))
+        assert sharded_name("1.gz.parquet") == sharded_name("1.gz.parquet", ParquetOptions()) == "1.gz.parquet"
+
+    @pytest.mark.parametrize("key_shards", [-1, 257])
+    def test_invalid_number_of_shards(self, key_shards, caplog):
+        assert _dump(MemorySink(), {"key_shards": key_shards}) is False
+        assert "[Dump #1] invalid config row" in caplog.text
+
+
+@pytest.mark.standalone
+class TestShardedDump:
+    def test_objects_are_spread_over_the_shards(self):
+        sink = MemorySink()
+
+        assert _dump(sink, {"key_shards": 4}) is True
+
+        (path,) = {key.split("/key_shard=")[0] for key in sink.objects if "/key_shard=" in key}
+        shards = {key[len(path) + 1 :].split("/")[0] for key in sink.objects if key != f"{path}/{LAYOUT_OBJECT}"}
+        assert shards == set(shard_prefixes(4))
+        assert read_layout(sink, path) == {
+            "version": 1,
+            "key_shards": 4,
+            "shards": shard_prefixes(4),
+            "partition_by": [],
+        }
+
+    def test_not_sharded_by_default(self):
+        sink = MemorySink()
+
+        assert _dump(sink, {}) is True
+
+        assert not any("key_shard=" in key or key.endswith(LAYOUT_OBJECT) for key in sink.objects)
+
+    def test_read_as_hive_partitions(self, tmp_path):
+        sink = LocalSink(str(tmp_path))
+
+        assert _dump(sink, {"key_shards": 8, "partition_by": "bucket"}) is True
+
+        path, _ = sink.make_path("p")
+        dataset = ds.dataset(tmp_path / path, format="parquet", partitioning="hive")
+        table = dataset.to_table()
+        assert sorted(table["id"].to_pylist()) == list(range(200))
+        assert "key_shard" in table.column_names
+        assert json.loads((tmp_path / path / LAYOUT_OBJECT).read_text())["partition_by"] == ["bucket"]
+
+    def test_spilled_files_are_sharded(self, tmp_path):
+        sink = MemorySink()
+
+        assert _dump(sink, {"key_shards": 2, "chunksize": 50}, spill_directory=str(tmp_path)) is True
+
+        files = [key for key in sink.objects if key.endswith(".parquet")]
+        assert len(files) == 4
+        assert all("/key_shard=" in key for key in files)
+
+    def test_shards_are_cleaned_up_before_a_retry(self):
+        sink = Mock(wraps=MemorySink())
+        sink.make_path.return_value = ("p/day", "p/day")
+        db = Mock()
+        db.execute_query.side_effect = [
+            sqlalchemy_exc.OperationalError("statement", {}, orig=Mock(pgcode="40001"), connection_invalidated=False),
+            iter([pd.DataFrame({"id": [1]})]),
+        ]
+        executor = DumpExecutor(sink, db, RetryPolicy(base_delay=0))
+
+        assert executor.execute({"query": "SELECT 1", "prefix": "p", "key_shards": 2}, 1) is True
+        sink.cleanup.assert_called_once_with("p/day", ["key_shard=0", "key_shard=1"])
+
+
+@pytest.mark.standalone
+class TestS3Cleanup:
+    @staticmethod
+    def _client(bucket_name):
+        config = Mock(bucket_name=bucket_name, bucket_url=None, upload_concurrency=4)
+        with patch("floorist.floorist.boto3.setup_default_session"):
+            client = S3Client(config)
+        client._client = Mock()
+        client._client.delete_objects.return_value = {}
+        return client
+
+    @patch("floorist.floorist.wr.s3.delete_objects")
+    def test_shards_are_deleted_separately(self, mock_delete):
+        client = self._client("floorist")
+
+        client.cleanup("s3://floorist/p/day", shard_prefixes(2))
+        client.close()
+
+        assert sorted(mock_delete.call_args_list) == [
+            call("s3://floorist/p/day/key_shard=0"),
+            call("s3://floorist/p/day/key_shard=1"),
+        ]
+        # The rest of the folder is deleted by the keys, without listing it
+        client._client.delete_objects.assert_called_once_with(
+            Bucket="floorist",
+            Delete={"Objects": [{"Key": f"p/day/{LAYOUT_OBJECT}"}, {"Key": "p/day/"}], "Quiet": True},
+        )
+
+    @patch("floorist.floorist.wr.s3.delete_objects")
+    def test_keys_next_to_the_shards_honor_the_bucket_prefix(self, mock_delete):
+        client = self._client("floorist/exports")
+
+        client.cleanup("s3://floorist/exports/p/day", shard_prefixes(2))
+        client.close()
+
+        keys = client._client.delete_objects.call_args.kwargs["Delete"]["Objects"]
+        assert keys == [{"Key": f"exports/p/day/{LAYOUT_OBJECT}"}, {"Key": "exports/p/day/"}]
+
+    @patch("floorist.floorist.wr.s3.delete_objects")
+    def test_failed_keys_fail_the_cleanup(self, mock_delete):
+        client = self._client("floorist")
+        client._client.delete_objects.return_value = {"Errors": [{"Key": "p/day/", "Code": "AccessDenied"}]}
+
+        with pytest.raises(OSError, match="Failed to delete p/day/: AccessDenied"):
+            client.cleanup("s3://floorist/p/day", shard_prefixes(2))
+        client.close()
+
+    @patch("floorist.floorist.wr.s3.delete_objects")
+    def test_folders_without_shards_are_deleted_as_a_whole(self, mock_delete):
+        client = self._client("floorist")
+
+        client.cleanup("s3://floorist/p/day")
+
+        mock_delete.assert_called_once_with("s3://floorist/p/day")
+        client._client.delete_objects.assert_not_called()
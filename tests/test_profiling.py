@@ -0,0 +1,91 @@
+import json
+import pstats
+from unittest.mock import Mock, patch
+
+import pandas as pd
+import pytest
+
+from floorist.floorist import DumpExecutor, Floorist, RetryPolicy
+from floorist.profiling import PROFILE_CPU, PROFILE_MEMORY, DumpProfiler
+
+
+def _build_chunk():
+    return pd.DataFrame({"id": list(range(1000)), "name": [str(i) for i in range(1000)]})
+
+
+@pytest.mark.standalone
+class TestDumpProfiler:
+    def test_profiles_are_written_to_the_directory(self, tmp_path):
+        profiler = DumpProfiler([PROFILE_CPU, PROFILE_MEMORY], directory=str(tmp_path))
+
+        with profiler.profile(dump_count=3):
+            _build_chunk()
+
+        run = tmp_path / profiler.run
+        assert sorted(p.name for p in run.iterdir()) == ["dump-3.cpu.prof", "dump-3.cpu.txt", "dump-3.memory.txt"]
+        stats = pstats.Stats(str(run / "dump-3.cpu.prof"))
+        assert any(name == "_build_chunk" for _, _, name in stats.stats)
+        assert (run / "dump-3.memory.txt").read_text().startswith("Peak of traced memory: ")
+
+    def test_profiles_are_uploaded_to_the_bucket(self):
+        mock_s3 = Mock()
+        profiler = DumpProfiler([PROFILE_MEMORY], sink=mock_s3, prefix="profiles/")
+
+        with profiler.profile(dump_count=1):
+            _build_chunk()
+
+        mock_s3.write_object.assert_called_once()
+        path, body = mock_s3.write_object.call_args.args
+        assert path == f"profiles/{profiler.run}/dump-1.memory.txt"
+        assert b"Allocation sites" in body
+
+    def test_failure_to_write_does_not_fail_the_dump(self, caplog):
+        mock_s3 = Mock()
+        mock_s3.write_object.side_effect = RuntimeError("boom")
+
+        with DumpProfiler([PROFILE_CPU], sink=mock_s3, prefix="profiles").profile(dump_count=1):
+            pass
+
+        assert "[Dump #1] Writing the profile failed" in caplog.text
+
+    def test_only_one_dump_is_cpu_profiled_at_once(self, tmp_path, caplog):
+        profiler = DumpProfiler([PROFILE_CPU], directory=str(tmp_path))
+
+        with profiler.profile(dump_count=1), profiler.profile(dump_count=2):
+            pass
+
+        assert "[Dump #2] Not profiling the CPU" in caplog.text
+        assert sorted(p.name for p in (tmp_path / profiler.run).iterdir()) == ["dump-1.cpu.prof", "dump-1.cpu.txt"]
+
+    def test_executor_profiles_each_dump(self, tmp_path):
+        mock_s3 = Mock()
+        mock_s3.make_path.return_value = ("p/day", "s3://bucket/p/day")
+        mock_db = Mock()
+        mock_db.execute_query.side_effect = lambda *args: iter([_build_chunk()])
+        profiler = DumpProfiler([PROFILE_CPU], directory=str(tmp_path))
+
+        executor = DumpExecutor(mock_s3, mock_db, RetryPolicy(), profiler=profiler)
+        assert executor.execute({"query": "SELECT 1", "prefix": "p"}, dump_count=1) is True
+        assert executor.execute({"query": "SELECT 1"}, dump_count=2) is False
+
+        names = sorted(p.name for p in (tmp_path / profiler.run).iterdir())
+        assert names == ["dump-1.cpu.prof", "dump-1.cpu.txt", "dump-2.cpu.prof", "dump-2.cpu.txt"]
+
+    @patch("floorist.floorist.ThreadPoolExecutor")
+    def test_dumps_run_one_at_a_time_while_profiling_the_memory(self, mock_pool, tmp_path, caplog):
+        floorplan = tmp_path / "floorplan.yaml"
+        floorplan.write_text(json.dumps([{"prefix": "a", "query": "SELECT 1"}, {"prefix": "b", "query": "SELECT 1"}]))
+        floorist = Floorist.__new__(Floorist)
+        floorist.config = Mock(
+            floorplan_filename=str(floorplan), concurrency=4, shard_count=1, engine="threads", profile=[PROFILE_MEMORY]
+        )
+        floorist.executor = Mock()
+        floorist.executor.execute.return_value = True
+        floorist.history = None
+        floorist.checkpoint = None
+
+        floorist.run()
+
+        mock_pool.assert_not_called()
+        assert floorist.executor.execute.call_count == 2
+        assert "Running the dumps one at a time" in caplog.text
@@ -0,0 +1,136 @@
+import io
+from datetime import date
+from unittest.mock import Mock, patch
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from floorist.floorist import DumpExecutor, ParquetOptions, RetryPolicy, _create_sink
+from floorist.sinks import LocalSink, MemorySink, NullSink, Sink
+
+
+def _parquet_files(directory):
+    return sorted(directory.rglob("*.gz.parquet"))
+
+
+@pytest.mark.standalone
+class TestLocalSink:
+    @pytest.mark.parametrize("use_mmap", [False, True])
+    def test_chunks_are_written_into_the_directory(self, tmp_path, use_mmap):
+        sink = LocalSink(str(tmp_path), use_mmap=use_mmap)
+        path, target = sink.make_path("dumps/people")
+        data = pd.DataFrame({"id": [2, 1], "name": ["b", "a"]})
+
+        sink.write_parquet(data, target, path, ParquetOptions(page_index=True))
+
+        assert target == str(tmp_path / path)
+        (written,) = _parquet_files(tmp_path)
+        assert written.parent == tmp_path / path
+        assert pq.read_table(written).to_pandas().equals(data)
+        assert not list(tmp_path.rglob("*.tmp"))
+
+    def test_date_layout_is_the_same_as_in_the_bucket(self, tmp_path):
+        with patch("floorist.sinks.date") as mock_date:
+            mock_date.today.return_value = date(2026, 6, 3)
+            path, _ = LocalSink(str(tmp_path)).make_path("p")
+        assert path == "p/year_created=2026/month_created=6/day_created=3"
+
+    def test_empty_result_creates_the_folder(self, tmp_path):
+        sink = LocalSink(str(tmp_path))
+        path, target = sink.make_path("empty")
+
+        sink.write_parquet(pd.DataFrame(), target, path)
+
+        assert (tmp_path / path).is_dir()
+        assert not _parquet_files(tmp_path)
+
+    def test_uploaded_files_are_moved(self, tmp_path):
+        spilled = tmp_path / "spill.parquet"
+        spilled.write_bytes(b"data")
+        sink = LocalSink(str(tmp_path / "out"))
+
+        sink.upload_file(str(spilled), "p/day/a.gz.parquet").result()
+
+        assert not spilled.exists()
+        assert (tmp_path / "out/p/day/a.gz.parquet").read_bytes() == b"data"
+
+    def test_spilled_files_end_up_in_the_directory(self, tmp_path):
+        (tmp_path / "spill").mkdir()
+        sink = LocalSink(str(tmp_path / "out"))
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter([pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3]})])
+
+        executor = DumpExecutor(sink, mock_db, RetryPolicy(), spill_directory=str(tmp_path / "spill"))
+        assert executor.execute({"query": "SELECT 1", "prefix": "p", "chunksize": 0}, dump_count=1) is True
+
+        (written,) = _parquet_files(tmp_path / "out")
+        assert pq.read_table(written)["id"].to_pylist() == [1, 2, 3]
+        assert not list((tmp_path / "spill").iterdir())
+
+    def test_objects_and_cleanup(self, tmp_path):
+        sink = LocalSink(str(tmp_path))
+        assert sink.read_object("history.json") is None
+        sink.write_object("history.json", "{}")
+        assert sink.read_object("history.json") == b"{}"
+
+        path, target = sink.make_path("p")
+        sink.write_parquet(pd.DataFrame({"id": [1]}), target, path)
+        sink.cleanup(target)
+        assert not (tmp_path / path).exists()
+
+    def test_missing_directory_fails_the_verification(self, tmp_path):
+        with pytest.raises(OSError, match="does not exist or is not writable"):
+            LocalSink(str(tmp_path / "missing")).verify()
+
+
+@pytest.mark.standalone
+class TestMemorySinks:
+    def test_dump_into_memory(self):
+        sink = MemorySink()
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter([pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3]})])
+
+        executor = DumpExecutor(sink, mock_db, RetryPolicy())
+        assert executor.execute({"query": "SELECT 1", "prefix": "p", "chunksize": 2}, dump_count=1) is True
+
+        assert len(sink.objects) == 2
+        ids = sorted(i for body in sink.objects.values() for i in pq.read_table(io.BytesIO(body))["id"].to_pylist())
+        assert ids == [1, 2, 3]
+
+    def test_empty_result_and_cleanup(self):
+        sink = MemorySink()
+        path, target = sink.make_path("p")
+
+        sink.write_parquet(pd.DataFrame(), target, path)
+        assert sink.objects == {f"{path}/": b""}
+
+        sink.cleanup(target)
+        assert sink.objects == {}
+
+    def test_null_sink_only_counts(self, tmp_path):
+        sink = NullSink()
+        path, target = sink.make_path("p")
+        spilled = tmp_path / "a.parquet"
+        spilled.write_bytes(b"12345")
+
+        sink.write_parquet(pd.DataFrame({"id": [1]}), target, path)
+        sink.upload_file(str(spilled), f"{path}/a.parquet").result()
+
+        assert sink.objects == {}
+        assert sink.count == 2
+        assert sink.size > 5
+        assert sink.read_object(f"{path}/a.parquet") is None
+
+    @pytest.mark.parametrize(("name", "cls"), [("local", LocalSink), ("memory", MemorySink), ("null", NullSink)])
+    def test_sink_from_config(self, tmp_path, name, cls):
+        config = Mock(sink=name, sink_directory=str(tmp_path), sink_mmap=True)
+        assert isinstance(_create_sink(config), cls)
+
+    def test_incomplete_sink_cannot_be_created(self):
+        class ReadOnlySink(Sink):
+            def read_object(self, path):
+                return None
+
+        with pytest.raises(TypeError, match="abstract method"):
+            ReadOnlySink()
@@ -0,0 +1,171 @@
+import os
+import random
+from concurrent.futures import Future
+from unittest.mock import Mock, patch
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from floorist.floorist import DumpExecutor, RetryPolicy, S3Client
+from floorist.spill import SPILL_BATCH_SIZE
+
+
+@pytest.mark.standalone
+class TestSpillMode:
+    @pytest.fixture
+    def uploads(self):
+        return {}
+
+    @pytest.fixture
+    def mock_s3(self, uploads):
+        mock = Mock()
+        mock.make_path.return_value = ("p/day", "s3://bucket/p/day")
+        mock.upload_concurrency = 2
+
+        def upload_file(filename, key):
+            uploads[key] = pq.read_table(filename)
+            future = Future()
+            future.set_result(None)
+            return future
+
+        mock.upload_file.side_effect = upload_file
+        return mock
+
+    def test_whole_result_is_assembled_into_a_single_file(self, tmp_path, mock_s3, uploads):
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter([pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3]})])
+
+        executor = DumpExecutor(mock_s3, mock_db, RetryPolicy(), spill_directory=str(tmp_path))
+        assert executor.execute({"query": "SELECT 1", "prefix": "p", "chunksize": 0}, dump_count=1) is True
+
+        mock_db.execute_query.assert_called_once_with("SELECT 1", SPILL_BATCH_SIZE)
+        mock_s3.write_parquet.assert_not_called()
+        [(key, table)] = uploads.items()
+        assert key.startswith("p/day/") and key.endswith(".gz.parquet")
+        assert table.column("id").to_pylist() == [1, 2, 3]
+        assert os.listdir(tmp_path) == []
+
+    def test_batches_are_written_as_a_single_sorted_row_group(self, tmp_path, mock_s3):
+        metadata, tables = [], []
+
+        def upload_file(filename, key):
+            metadata.append(pq.read_metadata(filename))
+            tables.append(pq.read_table(filename))
+            return Mock()
+
+        mock_s3.upload_file.side_effect = upload_file
+        ids = random.Random(42).sample(range(5 * SPILL_BATCH_SIZE), 5 * SPILL_BATCH_SIZE)
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter(
+            pd.DataFrame({"id": ids[i : i + SPILL_BATCH_SIZE]}) for i in range(0, len(ids), SPILL_BATCH_SIZE)
+        )
+
+        executor = DumpExecutor(mock_s3, mock_db, RetryPolicy(), spill_directory=str(tmp_path))
+        row = {"query": "SELECT 1", "prefix": "p", "chunksize": 0, "sort_by": "id"}
+        assert executor.execute(row, dump_count=1) is True
+
+        assert [m.num_row_groups for m in metadata] == [1]
+        assert tables[0].column("id").to_pylist() == sorted(ids)
+
+    @patch("floorist.spill.SPILL_ROW_GROUP_SIZE", 4)
+    def test_row_groups_of_large_files_are_sorted(self, tmp_path, mock_s3):
+        metadata, tables = [], []
+
+        def upload_file(filename, key):
+            metadata.append(pq.read_metadata(filename))
+            tables.append(pq.read_table(filename))
+            return Mock()
+
+        mock_s3.upload_file.side_effect = upload_file
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter(
+            [pd.DataFrame({"id": [6, 3]}), pd.DataFrame({"id": [2, 1]}), pd.DataFrame({"id": [5, 4]})]
+        )
+
+        executor = DumpExecutor(mock_s3, mock_db, RetryPolicy(), spill_directory=str(tmp_path))
+        row = {"query": "SELECT 1", "prefix": "p", "chunksize": 0, "sort_by": "id"}
+        assert executor.execute(row, dump_count=1) is True
+
+        assert [metadata[0].row_group(i).num_rows for i in range(metadata[0].num_row_groups)] == [4, 2]
+        # Only every row group is sorted, the file would have to be held in memory as a whole otherwise
+        assert tables[0].column("id").to_pylist() == [1, 2, 3, 6, 4, 5]
+
+    def test_bloom_filter_is_written(self, tmp_path, mock_s3):
+        metadata = []
+        mock_s3.upload_file.side_effect = lambda filename, key: metadata.append(pq.read_metadata(filename)) or Mock()
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter([pd.DataFrame({"id": [1, 2], "value": ["a", "b"]})])
+
+        executor = DumpExecutor(mock_s3, mock_db, RetryPolicy(), spill_directory=str(tmp_path))
+        row = {"query": "SELECT 1", "prefix": "p", "bloom_filter": "id"}
+        assert executor.execute(row, dump_count=1) is True
+
+        row_group = metadata[0].row_group(0)
+        assert row_group.column(0).bloom_filter_offset is not None
+        assert row_group.column(1).bloom_filter_offset is None
+
+    def test_files_are_rolled_after_chunksize_rows(self, tmp_path, mock_s3, uploads):
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter(
+            [pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3, 4]}), pd.DataFrame({"id": [5]})]
+        )
+
+        executor = DumpExecutor(mock_s3, mock_db, RetryPolicy(), spill_directory=str(tmp_path))
+        assert executor.execute({"query": "SELECT 1", "prefix": "p", "chunksize": 4}, dump_count=1) is True
+
+        mock_db.execute_query.assert_called_once_with("SELECT 1", 4)
+        assert sorted(len(table) for table in uploads.values()) == [1, 4]
+        assert os.listdir(tmp_path) == []
+
+    def test_empty_result_creates_folder(self, tmp_path, mock_s3, uploads):
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter([pd.DataFrame()])
+
+        executor = DumpExecutor(mock_s3, mock_db, RetryPolicy(), spill_directory=str(tmp_path))
+        assert executor.execute({"query": "SELECT 1", "prefix": "p"}, dump_count=1) is True
+
+        assert uploads == {}
+        mock_s3.write_parquet.assert_called_once()
+        assert len(mock_s3.write_parquet.call_args.args[0]) == 0
+
+    @patch("floorist.floorist.logger")
+    def test_failed_upload_fails_the_dump_and_removes_local_files(self, mock_logger, tmp_path, mock_s3):
+        future = Future()
+        future.set_exception(RuntimeError("SlowDown"))
+        mock_s3.upload_file.side_effect = None
+        mock_s3.upload_file.return_value = future
+        mock_db = Mock()
+        mock_db.execute_query.return_value = iter([pd.DataFrame({"id": [1]}), pd.DataFrame({"id": [2]})])
+
+        executor = DumpExecutor(mock_s3, mock_db, RetryPolicy(), spill_directory=str(tmp_path))
+        assert executor.execute({"query": "SELECT 1", "prefix": "p", "chunksize": 1}, dump_count=1) is False
+
+        mock_logger.exception.assert_called_once_with("[Dump #%d] Unexpected error", 1)
+        assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.standalone
+class TestUploadFile:
+    @patch("floorist.floorist.boto3.client")
+    @patch("floorist.floorist.s3transfer.manager.TransferManager")
+    def test_upload_uses_bucket_prefix_and_shared_manager(self, mock_manager, mock_client):
+        config = Mock(bucket_name="export-bucket/object-prefix/", bucket_url=None)
+        config.upload_concurrency = 4
+        config.multipart_chunksize = 16 * 1024 * 1024
+        with patch("floorist.floorist.boto3.setup_default_session"):
+            client = S3Client(config)
+
+        client.upload_file("/tmp/a.parquet", "p/day/a.parquet").result()
+        client.upload_file("/tmp/b.parquet", "p/day/b.parquet").result()
+
+        mock_manager.assert_called_once()
+        transfer_config = mock_manager.call_args.args[1]
+        assert transfer_config.max_request_concurrency == 4
+        assert transfer_config.multipart_chunksize == 16 * 1024 * 1024
+        mock_manager.return_value.upload.assert_called_with(
+            "/tmp/b.parquet", "export-bucket", "object-prefix/p/day/b.parquet"
+        )
+
+        client.close()
+        mock_manager.return_value.shutdown.assert_called_once()
@@ -0,0 +1,54 @@
+import json
+import subprocess
+import sys
+from os import environ
+
+import pytest
+
+# Modules that are expensive to import and must only be loaded once a dump actually needs them
+HEAVY_MODULES = (
+    "aiohttp",
+    "asyncpg",
+    "awswrangler",
+    "boto3",
+    "botocore",
+    "pandas",
+    "psycopg2",
+    "pyarrow",
+    "s3transfer",
+    "sqlalchemy",
+)
+
+# Upper bound of the time needed to import the entry point, can be raised for slow machines
+STARTUP_BUDGET_MS = int(environ.get("FLOORIST_STARTUP_BUDGET_MS", "500"))
+
+
+def _run_python(*args):
+    return subprocess.run([sys.executable, *args], check=True, capture_output=True, text=True)
+
+
+def _import_time_ms():
+    # The last line of the -X importtime report is the module imported by the command, with the cumulative time
+    # of all its imports in microseconds as the second column
+    report = _run_python("-X", "importtime", "-c", "import floorist.floorist").stderr.strip().splitlines()
+    _, cumulative, module = report[-1].split("|")
+    assert module.strip() == "floorist.floorist"
+    return int(cumulative) / 1000
+
+
+@pytest.mark.standalone
+class TestStartup:
+    def test_heavy_modules_are_imported_lazily(self):
+        script = (
+            "import json, sys, floorist.floorist\n"
+            f"print(json.dumps([module for module in {HEAVY_MODULES!r} if module in sys.modules]))"
+        )
+        assert json.loads(_run_python("-c", script).stdout) == []
+
+
+@pytest.mark.benchmark
+class TestStartupBenchmark:
+    def test_import_time_is_within_budget(self):
+        # Best of a few runs, so a busy machine does not make the benchmark flaky
+        elapsed = min(_import_time_ms() for _ in range(3))
+        assert elapsed < STARTUP_BUDGET_MS, f"Importing floorist took {elapsed:.0f}ms (budget {STARTUP_BUDGET_MS}ms)"
@@ -0,0 +1,207 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import Mock, patch
+
+import botocore.exceptions
+import pandas as pd
+import pytest
+from sqlalchemy import exc as sqlalchemy_exc
+
+from floorist import tracing
+from floorist.floorist import DumpExecutor, RetryPolicy, S3Client, S3RetryPolicy
+from floorist.sinks import MemorySink
+from floorist.tracing import JsonFileExporter, OtlpExporter, Tracer
+
+
+class _Exporter:
+    def __init__(self):
+        self.payloads = []
+
+    def export(self, payload):
+        self.payloads.append(payload)
+
+
+@pytest.fixture
+def exporter():
+    exporter = _Exporter()
+    tracing.set_tracer(Tracer([exporter]))
+    yield exporter
+    tracing.set_tracer(None)
+
+
+def _spans(exporter):
+    tracing.shutdown()
+    ((payload,),) = [exporter.payloads]
+    return payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+
+def _attributes(span):
+    return {item["key"]: next(iter(item["value"].values())) for item in span["attributes"]}
+
+
+def _named(spans, name):
+    return [span for span in spans if span["name"] == name]
+
+
+@pytest.mark.standalone
+class TestSpans:
+    def test_nested_in_a_single_trace(self, exporter):
+        with tracing.span("run", dumps=2) as run:
+            with tracing.span("dump", dump=1):
+                pass
+            run.set(failed=0)
+
+        dump, run = _spans(exporter)
+        assert dump["traceId"] == run["traceId"]
+        assert dump["parentSpanId"] == run["spanId"]
+        assert "parentSpanId" not in run
+        assert _attributes(run) == {"dumps": "2", "failed": "0"}
+        assert run["status"] == {"code": 1}
+
+    def test_failed_by_an_exception(self, exporter):
+        with pytest.raises(ValueError), tracing.span("dump"):
+            raise ValueError("invalid\nrow")
+
+        (span,) = _spans(exporter)
+        assert span["status"] == {"code": 2, "message": "ValueError: invalid"}
+
+    def test_noop_without_a_tracer(self):
+        with tracing.span("dump") as span:
+            span.set(rows=1)
+            tracing.current().add("retries")
+
+        assert list(tracing.batches(iter([1, 2]))) == [1, 2]
+
+    def test_spans_over_the_limit_are_dropped(self, caplog):
+        exporter = _Exporter()
+        tracing.set_tracer(Tracer([exporter], max_spans=2))
+        for _ in range(3):
+            with tracing.span("upload"):
+                pass
+
+        assert len(_spans(exporter)) == 2
+        assert "Dropped 1 spans over the limit of 2" in caplog.text
+
+    def test_failing_exporter_does_not_fail_the_run(self, caplog):
+        failing = Mock(export=Mock(side_effect=OSError("unreachable")))
+        tracing.set_tracer(Tracer([failing]))
+        with tracing.span("run"):
+            pass
+
+        tracing.shutdown()
+        assert "Exporting the trace to" in caplog.text
+
+
+@pytest.mark.standalone
+class TestDumpSpans:
+    def test_stages_of_a_dump(self, exporter):
+        db = Mock()
+        db.execute_query.return_value = iter([pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3]})])
+        executor = DumpExecutor(MemorySink(), db, RetryPolicy())
+
+        assert executor.execute({"query": "SELECT 1", "prefix": "p"}, 1) is True
+
+        spans = _spans(exporter)
+        (dump,) = _named(spans, "dump")
+        (attempt,) = _named(spans, "attempt")
+        (query,) = _named(spans, "query")
+        assert attempt["parentSpanId"] == dump["spanId"]
+        assert query["parentSpanId"] == attempt["spanId"]
+        assert _attributes(query)["db.statement"] == "SELECT 1"
+        assert [_attributes(span)["rows"] for span in _named(spans, "fetch")] == ["2", "1"]
+        assert [_attributes(span)["rows"] for span in _named(spans, "encode")] == ["2", "1"]
+        assert all(span["parentSpanId"] == query["spanId"] for span in _named(spans, "encode"))
+        assert _attributes(dump) == {
+            "dump": "1",
+            "prefix": "p",
+            "succeeded": True,
+            "rows": "3",
+            "bytes": _attributes(dump)["bytes"],
+            "objects": "2",
+            "retries": "0",
+        }
+
+    def test_retried_attempt_records_the_cause(self, exporter):
+        db = Mock()
+        db.execute_query.side_effect = [
+            sqlalchemy_exc.OperationalError("statement", {}, orig=Mock(pgcode="40001"), connection_invalidated=False),
+            iter([pd.DataFrame({"id": [1]})]),
+        ]
+        executor = DumpExecutor(MemorySink(), db, RetryPolicy(base_delay=0))
+
+        assert executor.execute({"query": "SELECT 1", "prefix": "p"}, 1) is True
+
+        spans = _named(_spans(exporter), "attempt")
+        assert [_attributes(span)["attempt"] for span in spans] == ["1", "2"]
+        assert spans[0]["status"]["code"] == 2
+        assert _attributes(spans[0])["retry.cause"] == "40001"
+        assert spans[1]["status"] == {"code": 1}
+
+    def test_retried_upload_records_the_cause(self, exporter):
+        config = Mock(bucket_name="floorist", bucket_url=None, upload_concurrency=1)
+        with patch("floorist.floorist.boto3.setup_default_session"):
+            client = S3Client(config)
+        client.retry_policy = S3RetryPolicy(base_delay=0)
+        slow_down = botocore.exceptions.ClientError(
+            {"Error": {"Code": "SlowDown"}, "ResponseMetadata": {"HTTPStatusCode": 503}}, "PutObject"
+        )
+        request = Mock(side_effect=[slow_down, None])
+
+        with tracing.span("upload"):
+            client._retrying("p/a.parquet", request)
+
+        (upload,) = _spans(exporter)
+        assert _attributes(upload) == {"retries": "1", "retry.cause": "SlowDown"}
+
+
+class _Collector(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append((self.path, self.headers["Content-Type"], json.loads(body)))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.standalone
+class TestExporters:
+    def test_json_file(self, tmp_path):
+        path = tmp_path / "trace.json"
+        tracing.set_tracer(Tracer([JsonFileExporter(str(path))]))
+        with tracing.span("run"):
+            pass
+        tracing.shutdown()
+
+        payload = json.loads(path.read_text())
+        resource = payload["resourceSpans"][0]
+        assert resource["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "floorist"}}]
+        assert [span["name"] for span in resource["scopeSpans"][0]["spans"]] == ["run"]
+
+    def test_otlp_collector(self):
+        server = HTTPServer(("127.0.0.1", 0), _Collector)
+        server.received = []
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            tracing.set_tracer(Tracer([OtlpExporter(f"http://127.0.0.1:{server.server_port}/")]))
+            with tracing.span("run"):
+                pass
+            tracing.shutdown()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        ((path, content_type, payload),) = server.received
+        assert path == "/v1/traces"
+        assert content_type == "application/json"
+        assert payload["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["name"] == "run"
+
+    def test_from_config(self):
+        assert Tracer.from_config(Mock(trace_file=None, trace_endpoint=None)) is None
+
+        tracer = Tracer.from_config(Mock(trace_file="trace.json", trace_endpoint="http://collector:4318/v1/traces"))
+
+        assert [str(exporter) for exporter in tracer.exporters] == ["trace.json", "http://collector:4318/v1/traces"]